@@ -0,0 +1,22 @@
+"""
+Gunicorn profile for serving the ASGI app with uvicorn workers:
+
+    gunicorn -c gunicorn_asgi.conf.py webapps.webapps2025.webapps2025.asgi:application
+
+Each worker runs one event loop, so a handful of workers can keep many
+checkout requests waiting on Stripe at once. The async views are switched
+on here; sync views still work, Django runs them in a thread pool.
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault("PAYAPP_ASYNC_VIEWS", "1")
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+max_requests = 5000
+max_requests_jitter = 500
@@ -1,16 +1,77 @@
+import json
+
 from django.contrib import admin
-from .models import PaymentRequest, Transaction
+from django.utils.html import format_html
+
+from .db_router import replica_reads
+from .models import FxRate, PaymentRequest, ReceiptEmail, ReceiptPreference, ReportingPreference, Transaction
+
+
+class ReplicaChangelistMixin:
+    """Serve GET changelists (the heavy, read-only admin pages) from the replica."""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "GET":
+            # Bulk actions delete/update what they read; keep them on the primary.
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            # The result list is a lazy queryset evaluated during rendering.
+            if hasattr(response, "render"):
+                response.render()
+        return response
 
 
 @admin.register(PaymentRequest)
-class PaymentRequestAdmin(admin.ModelAdmin):
+class PaymentRequestAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ("short_code", "merchant", "amount", "currency", "status", "created_at")
     list_filter = ("status", "currency", "created_at")
     search_fields = ("short_code", "merchant__username", "description")
+    list_select_related = ("merchant",)
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
     list_display = ("id", "payment_request", "status", "amount", "currency", "created_at")
     list_filter = ("status", "currency", "created_at")
     search_fields = ("id", "provider_txn_id", "payment_request__short_code")
+    list_select_related = ("payment_request",)
+    exclude = ("raw_response",)
+    readonly_fields = ("stripe_payload",)
+
+    @admin.display(description="Raw response")
+    def stripe_payload(self, obj):
+        # Archived payloads are fetched only on this page (see payapp.retention).
+        payload = obj.get_raw_response()
+        return format_html("<pre>{}</pre>", json.dumps(payload, indent=2)) if payload is not None else "-"
+
+
+@admin.register(ReceiptPreference)
+class ReceiptPreferenceAdmin(admin.ModelAdmin):
+    list_display = ("merchant", "mode")
+    list_filter = ("mode",)
+    search_fields = ("merchant__username", "merchant__email")
+    list_select_related = ("merchant",)
+
+
+@admin.register(ReportingPreference)
+class ReportingPreferenceAdmin(admin.ModelAdmin):
+    list_display = ("merchant", "currency")
+    search_fields = ("merchant__username", "merchant__email")
+    list_select_related = ("merchant",)
+
+
+@admin.register(FxRate)
+class FxRateAdmin(admin.ModelAdmin):
+    # Loaded by `manage.py load_fx_rates`; processes pick up edits within FX["TTL"].
+    list_display = ("currency", "rate", "updated_at")
+    search_fields = ("currency",)
+
+
+@admin.register(ReceiptEmail)
+class ReceiptEmailAdmin(ReplicaChangelistMixin, admin.ModelAdmin):
+    list_display = ("transaction", "to_email", "digest", "status", "attempts", "created_at", "sent_at")
+    list_filter = ("status", "digest")
+    search_fields = ("to_email", "transaction__id")
+    raw_id_fields = ("transaction", "merchant")
+
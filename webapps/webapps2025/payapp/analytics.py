@@ -0,0 +1,304 @@
+"""
+Buffered ingestion of PaymentView / PaymentConversion rows.
+
+The public pay page only appends an event to an in-process queue. A
+background flusher thread drains the queue with ``bulk_create`` once it
+reaches ANALYTICS_BUFFER["BATCH_SIZE"] events or every
+ANALYTICS_BUFFER["FLUSH_INTERVAL"] seconds, whichever comes first.
+
+Backends:
+    "memory"  - flush straight to the database from the flusher thread
+    "celery"  - hand each drained batch to the ``ingest_analytics`` task
+    "sync"    - no buffering, write on every call (handy in tests)
+"""
+import atexit
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import hll, rollups
+from .models import PaymentRequest, PaymentView, PaymentConversion
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "BACKEND": "memory",
+    "MAX_SIZE": 10000,
+    "BATCH_SIZE": 500,
+    "FLUSH_INTERVAL": 2.0,
+    "OVERFLOW": "drop",
+}
+
+VIEW = "view"
+CONVERSION = "conversion"
+
+
+class AnalyticsBuffer:
+    """
+    Bounded, thread-safe queue of analytics events.
+
+    When the queue holds MAX_SIZE events, new events are either dropped
+    (OVERFLOW="drop", counted in ``dropped``) or the caller flushes the
+    queue itself before appending (OVERFLOW="flush"), which pushes the
+    write cost back onto the request as backpressure.
+    """
+
+    def __init__(self, backend="memory", max_size=10000, batch_size=500,
+                 flush_interval=2.0, overflow="drop"):
+        self.backend = backend
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+
+        self.dropped = 0
+        self.flushed = 0
+
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @classmethod
+    def from_settings(cls):
+        conf = {**DEFAULTS, **getattr(settings, "ANALYTICS_BUFFER", {})}
+        return cls(
+            backend=conf["BACKEND"],
+            max_size=conf["MAX_SIZE"],
+            batch_size=conf["BATCH_SIZE"],
+            flush_interval=conf["FLUSH_INTERVAL"],
+            overflow=conf["OVERFLOW"],
+        )
+
+    def __len__(self):
+        return len(self._events)
+
+    # ─────────────────────────────────────
+    # Producer side
+    # ─────────────────────────────────────
+    def add(self, kind, payment_request_id, **fields):
+        event = {
+            "kind": kind,
+            "payment_request_id": payment_request_id,
+            "timestamp": timezone.now(),
+            **fields,
+        }
+
+        if self.backend == "sync":
+            self._write([event])
+            return True
+
+        with self._lock:
+            full = len(self._events) >= self.max_size
+            if full and self.overflow != "flush":
+                self.dropped += 1
+                return False
+
+        if full:
+            self.flush()
+
+        with self._lock:
+            self._events.append(event)
+            pending = len(self._events)
+
+        self._ensure_flusher()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def aadd(self, kind, payment_request_id, **fields):
+        """add() for async views; hops to a thread only if it might write to the DB."""
+        if self.backend == "sync" or self.overflow == "flush":
+            return await sync_to_async(self.add)(kind, payment_request_id, **fields)
+        return self.add(kind, payment_request_id, **fields)
+
+    # ─────────────────────────────────────
+    # Consumer side
+    # ─────────────────────────────────────
+    def drain(self, limit=None):
+        with self._lock:
+            count = len(self._events) if limit is None else min(limit, len(self._events))
+            return [self._events.popleft() for _ in range(count)]
+
+    def flush(self):
+        """Write out everything queued so far. Returns the number of events handled."""
+        total = 0
+        with self._flush_lock:
+            while True:
+                batch = self.drain(self.batch_size)
+                if not batch:
+                    break
+                try:
+                    if self.backend == "celery":
+                        from .tasks import ingest_analytics
+                        ingest_analytics.delay(serialize_events(batch))
+                    else:
+                        self._write(batch)
+                except Exception:
+                    logger.exception("Dropping %d analytics events after a failed flush", len(batch))
+                    self.dropped += len(batch)
+                else:
+                    self.flushed += len(batch)
+                total += len(batch)
+        return total
+
+    def _write(self, events):
+        write_events(events)
+
+    def _ensure_flusher(self):
+        # Start lazily and once per process, so forked workers get their own thread.
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="payapp-analytics-flusher",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+    def shutdown(self):
+        """Stop the flusher and write out whatever is still queued."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+def write_events(events):
+    """Persist a batch of buffered events with one bulk_create per model."""
+    views = [e for e in events if e["kind"] == VIEW]
+    conversions = [e for e in events if e["kind"] == CONVERSION]
+
+    try:
+        _bulk_insert(views, conversions)
+    except IntegrityError:
+        # A link was deleted while its events sat in the buffer; keep the rest.
+        known = set(
+            PaymentRequest.objects
+            .filter(pk__in={e["payment_request_id"] for e in events})
+            .values_list("pk", flat=True)
+        )
+        _bulk_insert(
+            [e for e in views if e["payment_request_id"] in known],
+            [e for e in conversions if e["payment_request_id"] in known],
+        )
+
+
+def _bulk_insert(views, conversions):
+    with transaction.atomic():
+        if views:
+            PaymentView.objects.bulk_create(
+                [
+                    PaymentView(
+                        payment_request_id=e["payment_request_id"],
+                        timestamp=e["timestamp"],
+                        ip_address=e.get("ip_address"),
+                        user_agent=e.get("user_agent", ""),
+                        referer=e.get("referer", ""),
+                    )
+                    for e in views
+                ]
+            )
+        if conversions:
+            PaymentConversion.objects.bulk_create(
+                [
+                    PaymentConversion(
+                        payment_request_id=e["payment_request_id"],
+                        timestamp=e["timestamp"],
+                        source=e.get("source"),
+                        visitor=e.get("visitor", ""),
+                    )
+                    for e in conversions
+                ]
+            )
+        rollups.record_events(views, conversions)
+
+
+def serialize_events(events):
+    return [
+        {
+            **e,
+            "payment_request_id": str(e["payment_request_id"]),
+            "timestamp": e["timestamp"].isoformat(),
+        }
+        for e in events
+    ]
+
+
+def deserialize_events(events):
+    return [
+        {
+            **e,
+            "payment_request_id": uuid.UUID(e["payment_request_id"]),
+            "timestamp": parse_datetime(e["timestamp"]),
+        }
+        for e in events
+    ]
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> AnalyticsBuffer:
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = AnalyticsBuffer.from_settings()
+                atexit.register(_buffer.shutdown)
+    return _buffer
+
+
+def _view_fields(request):
+    return {
+        "ip_address": request.META.get("REMOTE_ADDR"),
+        "user_agent": request.META.get("HTTP_USER_AGENT", ""),
+        "referer": request.META.get("HTTP_REFERER", ""),
+    }
+
+
+def _visitor(request):
+    return hll.visitor_key(request.META.get("REMOTE_ADDR"), request.META.get("HTTP_USER_AGENT", ""))
+
+
+def record_view(payment_request_id, request):
+    return get_buffer().add(VIEW, payment_request_id, **_view_fields(request))
+
+
+def record_conversion(payment_request_id, request, source):
+    return get_buffer().add(CONVERSION, payment_request_id, source=source, visitor=_visitor(request))
+
+
+async def arecord_view(payment_request_id, request):
+    return await get_buffer().aadd(VIEW, payment_request_id, **_view_fields(request))
+
+
+async def arecord_conversion(payment_request_id, request, source):
+    return await get_buffer().aadd(CONVERSION, payment_request_id, source=source, visitor=_visitor(request))
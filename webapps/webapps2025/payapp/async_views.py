@@ -0,0 +1,166 @@
+"""
+Async (ASGI) versions of the public, I/O-bound views.
+
+Same behaviour as their counterparts in payapp.views, but the Stripe call
+goes through httpx and the lookups use the async ORM and cache API, so
+under an ASGI server (see gunicorn_asgi.conf.py) a worker keeps serving
+other requests while one waits on Stripe. urls.py routes to these when
+PAYAPP_ASYNC_VIEWS is on.
+
+dashboard_events has no sync counterpart: an SSE stream held by a sync
+worker would tie up a thread for as long as the dashboard stays open.
+"""
+import json
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import analytics, checkout, idempotency, link_cache, link_status, live, qr, ratelimit, webhooks
+from .models import PaymentRequest
+from .views import _checkout_urls, _see_other
+
+
+async def _render(request, template_name, context=None):
+    # base.html reads `user`; resolve it here so the lazy sync lookup
+    # from the auth context processor never runs on the event loop.
+    context = {**(context or {}), "user": await request.auser()}
+    return render(request, template_name, context)
+
+
+@require_http_methods(["GET", "POST"])
+async def public_pay_page(request, short_code):
+    payment_request = await link_cache.aget_snapshot_or_404(short_code)
+
+    if payment_request.status == PaymentRequest.STATUS_EXPIRED or payment_request.is_expired():
+        return await _render(request, "payapp/payment_expired.html", {"payment": payment_request})
+
+    if request.method == "POST":
+        too_many = await ratelimit.acheck_pay_post(request, payment_request)
+        if too_many:
+            return too_many
+
+    await analytics.arecord_view(payment_request.pk, request)
+
+    success_url, cancel_url = _checkout_urls(request)
+
+    if request.method == "POST":
+        claimed = await idempotency.aclaim(request)
+        if isinstance(claimed, HttpResponse):
+            return claimed
+
+        try:
+            await analytics.arecord_conversion(payment_request.pk, request, source="public_page")
+            session = await checkout.aget_session(payment_request, success_url, cancel_url, claimed)
+        except BaseException:
+            if claimed:
+                await idempotency.arelease(claimed)
+            raise
+
+        response = _see_other(session["url"])
+        if claimed:
+            await idempotency.astore(claimed, response, checkout.session_expires(session))
+        return response
+
+    if await checkout.anote_view(payment_request):
+        await sync_to_async(checkout.schedule_prewarm)(short_code, success_url, cancel_url)
+
+    return await _render(
+        request,
+        "payapp/public_pay.html",
+        {"payment": payment_request, "idempotency_key": idempotency.new_key()},
+    )
+
+
+@login_required
+async def payment_qr(request, short_code):
+    fmt = request.GET.get("format", "png")
+    if fmt not in qr.FORMATS:
+        return HttpResponseBadRequest("Unsupported format")
+
+    try:
+        box_size = int(request.GET.get("size", qr.DEFAULT_BOX_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid size")
+    box_size = max(qr.MIN_BOX_SIZE, min(box_size, qr.MAX_BOX_SIZE))
+
+    payment = await aget_object_or_404(
+        PaymentRequest,
+        short_code=short_code,
+        merchant=await request.auser(),
+    )
+
+    pay_url = request.build_absolute_uri(
+        reverse("payapp:public_pay", args=[payment.short_code])
+    )
+
+    etag = quote_etag(qr.cache_key(pay_url, fmt, box_size))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        # Rendering is CPU work; keep it off the loop.
+        _, content = await sync_to_async(qr.get_qr, thread_sensitive=False)(pay_url, fmt, box_size)
+        response = HttpResponse(content, content_type=qr.FORMATS[fmt])
+
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, max_age=qr.max_age())
+    return response
+
+
+@csrf_exempt
+async def stripe_webhook(request):
+    payload = request.body
+    sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
+    webhook_secret = settings.STRIPE_WEBHOOK_SECRET
+
+    if not webhook_secret:
+        return HttpResponse(status=200)
+
+    try:
+        stripe.Webhook.construct_event(
+            payload=payload,
+            sig_header=sig_header,
+            secret=webhook_secret,
+        )
+    except ValueError:
+        return HttpResponseBadRequest("Invalid payload")
+    except stripe.error.SignatureVerificationError:
+        return HttpResponseBadRequest("Invalid signature")
+
+    # The inbox insert needs a transaction (on_commit enqueue), which the
+    # async ORM cannot give us.
+    await sync_to_async(webhooks.receive)(json.loads(payload))
+    return HttpResponse(status=200)
+
+
+@require_http_methods(["GET", "HEAD"])
+async def payment_status(request, short_code):
+    # Honours ?wait= (long polling); the sync view cannot.
+    return await link_status.aget_response(request, short_code)
+
+
+async def payment_success(request):
+    payment = None
+    short_code = await checkout.ashort_code_for_session(request.GET.get("session_id"))
+    if short_code:
+        payment = await link_cache.aget_snapshot(short_code)
+    return await _render(request, "payapp/payment_success.html", {"payment": payment})
+
+
+@login_required
+async def dashboard_events(request):
+    if not live.conf()["ENABLED"]:
+        return HttpResponse(status=204)
+    user = await request.auser()
+    response = StreamingHttpResponse(live.stream(user.pk), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
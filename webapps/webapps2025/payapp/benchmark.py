@@ -0,0 +1,293 @@
+"""
+Load-test harness for the hot paths.
+
+Boots the app in-process on a throwaway test database, with Stripe replaced
+by payapp.stripe_stub, and drives each scenario through the full
+middleware stack from a pool of client threads (WSGI) or a single event
+loop (ASGI, with the async views). Every request is timed, and under WSGI
+its database queries are counted, so a run reports latency percentiles,
+throughput and queries per request for each scenario.
+
+Used by `manage.py benchmark` and `manage.py bench_checkout`.
+"""
+import asyncio
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from django.urls import clear_url_caches, reverse
+
+from . import rollups, stripe_client
+from .models import PaymentRequest
+from .stripe_stub import FakeStripeServer
+
+WEBHOOK_SECRET = "whsec_benchmark"
+
+
+def route_views(async_views=None):
+    """Switch urls.py between the sync and async views; None restores the setting."""
+    # urls.py picks the view module at import time, and the root urlconf's
+    # include() keeps the resolved patterns, so both are reloaded.
+    overrides = {} if async_views is None else {"PAYAPP_ASYNC_VIEWS": async_views}
+    with override_settings(**overrides):
+        importlib.reload(importlib.import_module("payapp.urls"))
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+@contextmanager
+def environment(stripe_latency=0.0, async_views=False):
+    """Test database + fake Stripe server + settings pointing at it. Yields the server."""
+    test_settings = connection.settings_dict["TEST"]
+    old_name = test_settings.get("NAME")
+    if connection.vendor == "sqlite" and not old_name:
+        # In-memory SQLite fails concurrent writers with "table is locked"
+        # instead of waiting for the lock; a file database waits.
+        test_settings["NAME"] = os.path.join(tempfile.gettempdir(), f"payapp-bench-{os.getpid()}.sqlite3")
+    old_config = setup_databases(verbosity=0, interactive=False)
+    server = FakeStripeServer(latency=stripe_latency).start()
+    try:
+        with override_settings(
+            STRIPE_API_BASE=server.url,
+            STRIPE_SECRET_KEY="sk_test_benchmark",
+            STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+            STRIPE_MAX_NETWORK_RETRIES=0,
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            # Every simulated payer shares one IP; `bench_ratelimit` measures the limiter.
+            RATE_LIMIT={"ENABLED": False},
+        ):
+            stripe_client.reset()
+            route_views(async_views)
+            yield server
+    finally:
+        route_views()
+        stripe_client.reset()
+        server.shutdown()
+        server.server_close()
+        connections.close_all()
+        teardown_databases(old_config, verbosity=0)
+        test_settings["NAME"] = old_name
+
+
+def create_merchant(username="bench"):
+    return get_user_model().objects.create_user(username, f"{username}@example.com", "bench")
+
+
+def create_links(merchant, count):
+    """`count` fresh pending links for `merchant`, counted in the rollups like real ones."""
+    links = PaymentRequest.objects.bulk_create(
+        PaymentRequest(
+            merchant=merchant,
+            short_code=secrets.token_urlsafe(6)[:8],
+            amount=Decimal("12.50"),
+            description="Benchmark link",
+        )
+        for _ in range(count)
+    )
+    rollups.record_links_created(links)
+    return links
+
+
+def signed_webhook(event):
+    """Body and Stripe-Signature header for `event`, signed with WEBHOOK_SECRET."""
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(
+        WEBHOOK_SECRET.encode(),
+        f"{timestamp}.{payload}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+    return payload, f"t={timestamp},v1={signature}"
+
+
+def checkout_completed_event(link):
+    return {
+        "id": f"evt_{secrets.token_hex(12)}",
+        "type": "checkout.session.completed",
+        "data": {
+            "object": {
+                "id": f"cs_test_{secrets.token_hex(12)}",
+                "object": "checkout.session",
+                "amount_total": int(link.amount * 100),
+                "currency": link.currency.lower(),
+                "payment_intent": f"pi_{secrets.token_hex(12)}",
+                "metadata": {"short_code": link.short_code},
+            }
+        },
+    }
+
+
+# ─────────────────────────────────────
+# Scenarios
+# ─────────────────────────────────────
+class Scenario:
+    """
+    A named list of requests. Each request is (method, path, kwargs) for
+    the test client; `login` runs them as the seeded merchant.
+    """
+
+    def __init__(self, name, requests, expect=200, login=False):
+        self.name = name
+        self.requests = requests
+        self.expect = expect
+        self.login = login
+
+
+def _cycle(items, count):
+    return [items[i % len(items)] for i in range(count)]
+
+
+def public_get(merchant, links, count):
+    paths = [reverse("payapp:public_pay", args=[link.short_code]) for link in links]
+    return Scenario("public_get", [("get", path, {}) for path in _cycle(paths, count)])
+
+
+def checkout_post(merchant, links, count):
+    # Links beyond the first pass reuse their open Checkout Session.
+    paths = [reverse("payapp:public_pay", args=[link.short_code]) for link in links]
+    return Scenario("checkout_post", [("post", path, {}) for path in _cycle(paths, count)], expect=303)
+
+
+def webhook_burst(merchant, links, count):
+    path = reverse("payapp:stripe_webhook")
+    requests = []
+    for link in _cycle(links, count):
+        payload, signature = signed_webhook(checkout_completed_event(link))
+        requests.append((
+            "post",
+            path,
+            {
+                "data": payload,
+                "content_type": "application/json",
+                "headers": {"Stripe-Signature": signature},
+            },
+        ))
+    return Scenario("webhook_burst", requests)
+
+
+def dashboard(merchant, links, count):
+    return Scenario("dashboard", [("get", reverse("payapp:dashboard"), {})] * count, login=True)
+
+
+def qr_code(merchant, links, count):
+    paths = [reverse("payapp:payment_qr", args=[link.short_code]) for link in links]
+    return Scenario("qr", [("get", path, {}) for path in _cycle(paths, count)], login=True)
+
+
+SCENARIOS = {
+    "public_get": public_get,
+    "checkout_post": checkout_post,
+    "webhook_burst": webhook_burst,
+    "dashboard": dashboard,
+    "qr": qr_code,
+}
+
+
+# ─────────────────────────────────────
+# Running and reporting
+# ─────────────────────────────────────
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(name, samples, elapsed, errors):
+    """samples: list of (seconds, query count or None)."""
+    latencies = sorted(seconds for seconds, _ in samples)
+    queries = [count for _, count in samples if count is not None]
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "scenario": name,
+        "requests": len(samples),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": ms(_percentile(latencies, 50)),
+            "p95": ms(_percentile(latencies, 95)),
+            "p99": ms(_percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+        "queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "max": max(queries) if queries else None,
+        },
+    }
+
+
+def run_threaded(scenario, merchant, concurrency):
+    """Drive a scenario through the WSGI handler from `concurrency` threads."""
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = Client()
+            if scenario.login:
+                local.client.force_login(merchant)
+        return local.client
+
+    def send(request):
+        method, path, kwargs = request
+        http = client()
+        # The test client runs the view on this thread, so this connection
+        # sees every query the request makes.
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(http, method)(path, **kwargs)
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), response.status_code == scenario.expect
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, scenario.requests))
+    elapsed = time.perf_counter() - started
+    connections.close_all()
+
+    errors = sum(1 for _, _, ok in results if not ok)
+    return summarize(scenario.name, [(s, q) for s, q, _ in results], elapsed, errors)
+
+
+async def _run_async(scenario, merchant, concurrency):
+    client = AsyncClient()
+    if scenario.login:
+        await client.aforce_login(merchant)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(request):
+        method, path, kwargs = request
+        async with slots:
+            started = time.perf_counter()
+            response = await getattr(client, method)(path, **kwargs)
+            return time.perf_counter() - started, response.status_code == scenario.expect
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(send(request) for request in scenario.requests))
+    elapsed = time.perf_counter() - started
+
+    errors = sum(1 for _, ok in results if not ok)
+    # ORM calls run on sync_to_async threads, so queries are not counted here.
+    return summarize(scenario.name, [(s, None) for s, _ in results], elapsed, errors)
+
+
+def run_async(scenario, merchant, concurrency):
+    """Drive a scenario through the ASGI handler with `concurrency` requests in flight."""
+    return asyncio.run(_run_async(scenario, merchant, concurrency))
@@ -0,0 +1,161 @@
+"""
+Bulk creation of payment links, e.g. for invoicing runs.
+
+`validate()` checks every row first, so a bad upload creates nothing.
+`create_links()` then inserts the rows in chunks of
+BULK_LINKS["CHUNK_SIZE"], one transaction per chunk:
+
+- short codes for the whole chunk come from `allocate_short_codes()`,
+  which generates candidates and drops any already taken with one
+  `short_code IN (...)` query per few hundred codes;
+- the rows go in with one bulk_create;
+- the rollups get one update per merchant, currency and day.
+
+Codes are 8 random URL-safe characters (48 bits), so a clash with an
+existing code is rare but real at millions of links. The allocation
+check handles existing codes; a chunk that still collides with a
+concurrent insert is rolled back and retried with fresh codes.
+
+The form view creates its single link through here as well.
+"""
+import csv
+import io
+import json
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import fragments, link_cache, rollups
+from .forms import BulkLinkRowForm
+from .models import PaymentRequest
+
+DEFAULTS = {
+    "CHUNK_SIZE": 1000,
+    # Rows accepted by one API request; the command has no limit.
+    "MAX_ROWS": 10000,
+}
+
+# Codes per existence query, well under SQLite's bound-parameter limit.
+LOOKUP_BATCH = 500
+INSERT_ATTEMPTS = 3
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "BULK_LINKS", {})}
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# ─────────────────────────────────────
+# Short codes
+# ─────────────────────────────────────
+def generate_short_code():
+    return secrets.token_urlsafe(6)
+
+
+def allocate_short_codes(count):
+    """`count` distinct short codes that no existing link uses."""
+    codes = set()
+    while len(codes) < count:
+        candidates = list({generate_short_code() for _ in range(count - len(codes))} - codes)
+        for batch in _chunks(candidates, LOOKUP_BATCH):
+            taken = set(
+                PaymentRequest.objects
+                .filter(short_code__in=batch)
+                .values_list("short_code", flat=True)
+            )
+            codes.update(code for code in batch if code not in taken)
+    return list(codes)
+
+
+# ─────────────────────────────────────
+# Input
+# ─────────────────────────────────────
+def parse(content, content_type):
+    """Rows (dicts of strings) from a JSON array / {"links": [...]} or a CSV with a header line."""
+    if "csv" in content_type:
+        try:
+            return list(csv.DictReader(io.StringIO(content)))
+        except csv.Error as exc:
+            raise ValueError(f"Invalid CSV: {exc}")
+    data = json.loads(content)
+    if isinstance(data, dict):
+        data = data.get("links")
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise ValueError('Expected a JSON array of links or {"links": [...]}.')
+    return data
+
+
+def validate(rows):
+    """(cleaned rows, errors); errors is [{"row": 1-based number, "errors": {...}}]."""
+    cleaned, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        form = BulkLinkRowForm(row)
+        if form.is_valid():
+            cleaned.append(form.cleaned_data)
+        else:
+            errors.append({"row": number, "errors": form.errors.get_json_data()})
+    return cleaned, errors
+
+
+# ─────────────────────────────────────
+# Insert
+# ─────────────────────────────────────
+def _insert_chunk(merchant, rows, now):
+    for attempt in range(INSERT_ATTEMPTS):
+        links = [
+            PaymentRequest(
+                merchant=merchant,
+                short_code=code,
+                amount=row["amount"],
+                currency=row["currency"],
+                description=row.get("description") or "",
+                expires_at=now + timedelta(days=row.get("expiry_days") or 7),
+            )
+            for row, code in zip(rows, allocate_short_codes(len(rows)))
+        ]
+        try:
+            with transaction.atomic():
+                PaymentRequest.objects.bulk_create(links)
+                rollups.record_links_created(links)
+        except IntegrityError:
+            # A concurrent insert took one of the codes after the check.
+            if attempt == INSERT_ATTEMPTS - 1:
+                raise
+            continue
+        return links
+
+
+def create_links(merchant, rows, chunk_size=None, qr_base_url=None):
+    """
+    Create a link per cleaned row (see `validate()`); returns them in row
+    order. With `qr_base_url` (scheme and host), their QR codes are
+    rendered ahead of time by Celery.
+    """
+    from .tasks import prerender_qr_codes
+
+    chunk_size = chunk_size or conf()["CHUNK_SIZE"]
+    now = timezone.now()
+    created = []
+    for chunk in _chunks(rows, chunk_size):
+        links = _insert_chunk(merchant, chunk, now)
+        created.extend(links)
+
+        # bulk_create sends no post_save, so do what payapp.signals would.
+        short_codes = [link.short_code for link in links]
+        transaction.on_commit(lambda short_codes=short_codes: link_cache.invalidate(*short_codes))
+        if qr_base_url:
+            urls = [qr_base_url.rstrip("/") + reverse("payapp:public_pay", args=[code]) for code in short_codes]
+            # robust: the links are committed; a broker outage only costs the warm-up.
+            transaction.on_commit(lambda urls=urls: prerender_qr_codes.delay(urls), robust=True)
+
+    if created:
+        transaction.on_commit(lambda: fragments.bump(merchant.pk))
+    return created
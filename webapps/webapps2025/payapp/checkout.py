@@ -0,0 +1,300 @@
+"""
+Stripe Checkout Session reuse.
+
+A payment link keeps at most one open Checkout Session, cached by
+short_code together with the amount/currency it was created for. Double
+clicks and parallel tabs reuse it until shortly before it expires, and the
+webhook drops it once the link is paid. Hot links can have their session
+created ahead of time by a Celery task (when a broker is configured) so
+the Pay POST is just a redirect. Each session id is also mapped back to
+its short_code, so the success page can find the link from the
+?session_id= Stripe redirects with.
+
+The `a*` functions are the same operations for the async views; they talk
+to the cache and to Stripe without blocking the event loop.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import link_cache
+from .stripe_client import get_async_client, get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "SESSION_TTL": 3600,
+    "REUSE_MARGIN": 300,
+    "LOCK_TIMEOUT": 10,
+    "PREWARM_AFTER_VIEWS": 10,
+    "PREWARM_WINDOW": 60,
+}
+
+SESSION_LOOKUP_GRACE = 3600
+
+
+def _conf():
+    return {**DEFAULTS, **getattr(settings, "CHECKOUT_SESSIONS", {})}
+
+
+def _cache():
+    return caches[_conf()["ALIAS"]]
+
+
+def _key(short_code):
+    return f"payapp:checkout:{short_code}"
+
+
+def _session_key(session_id):
+    return f"payapp:checkout-session:{session_id}"
+
+
+def _amount_minor(payment_request):
+    return int(payment_request.amount * 100)
+
+
+def _usable(session, payment_request):
+    return (
+        session is not None
+        and session["amount"] == _amount_minor(payment_request)
+        and session["currency"] == payment_request.currency.lower()
+        and session["expires_at"] - _conf()["REUSE_MARGIN"] > time.time()
+    )
+
+
+def _session_params(payment_request, success_url, cancel_url, claimed=None):
+    # From the claimed key's row when there is one, so a retry sends Stripe
+    # the same parameters as the first attempt under the same key.
+    started = int(claimed.created_at.timestamp()) if claimed else int(time.time())
+    return {
+        "payment_method_types": ["card"],
+        "mode": "payment",
+        "line_items": [
+            {
+                "price_data": {
+                    "currency": payment_request.currency.lower(),
+                    "product_data": {
+                        "name": payment_request.description
+                        or f"Payment {payment_request.short_code}",
+                    },
+                    "unit_amount": _amount_minor(payment_request),
+                },
+                "quantity": 1,
+            }
+        ],
+        "metadata": {
+            "short_code": payment_request.short_code,
+        },
+        # Stripe requires at least 30 minutes.
+        "expires_at": started + max(_conf()["SESSION_TTL"], 1800),
+        "success_url": success_url,
+        "cancel_url": cancel_url,
+    }
+
+
+def _summary(session, payment_request):
+    return {
+        "id": session.id,
+        "url": session.url,
+        "expires_at": session.expires_at,
+        "amount": _amount_minor(payment_request),
+        "currency": payment_request.currency.lower(),
+    }
+
+
+def _store_timeout(session):
+    return session["expires_at"] - _conf()["REUSE_MARGIN"] - int(time.time())
+
+
+def _lookup_timeout(session):
+    # The payer lands on the success page right after paying, which can
+    # be up to the moment the session expires.
+    return session["expires_at"] + SESSION_LOOKUP_GRACE - int(time.time())
+
+
+def session_expires(session):
+    """When a session summary's Checkout page stops taking payments, as an aware datetime."""
+    return datetime.fromtimestamp(session["expires_at"], tz=timezone.utc)
+
+
+def create_session(payment_request, success_url, cancel_url, claimed=None):
+    """Create a fresh Checkout Session at Stripe and return its cacheable summary."""
+    params = _session_params(payment_request, success_url, cancel_url, claimed)
+    options = {"idempotency_key": claimed.pk} if claimed else {}
+    session = get_client().v1.checkout.sessions.create(params=params, options=options)
+    summary = _summary(session, payment_request)
+    _cache().set(_session_key(summary["id"]), payment_request.short_code, _lookup_timeout(summary))
+    return summary
+
+
+async def acreate_session(payment_request, success_url, cancel_url, claimed=None):
+    params = _session_params(payment_request, success_url, cancel_url, claimed)
+    options = {"idempotency_key": claimed.pk} if claimed else {}
+    session = await get_async_client().v1.checkout.sessions.create_async(params=params, options=options)
+    summary = _summary(session, payment_request)
+    await _cache().aset(_session_key(summary["id"]), payment_request.short_code, _lookup_timeout(summary))
+    return summary
+
+
+def short_code_for_session(session_id):
+    """The short_code a Checkout Session was created for, or None if it is unknown or long gone."""
+    if not session_id:
+        return None
+    return _cache().get(_session_key(session_id))
+
+
+async def ashort_code_for_session(session_id):
+    if not session_id:
+        return None
+    return await _cache().aget(_session_key(session_id))
+
+
+def get_session(payment_request, success_url, cancel_url, claimed=None):
+    """
+    Return the link's open Checkout Session, creating one only if needed.
+    `claimed` is the request's IdempotencyKey (see payapp.idempotency); its
+    key goes to Stripe with the create.
+    """
+    conf = _conf()
+    cache = _cache()
+    key = _key(payment_request.short_code)
+
+    session = cache.get(key)
+    if _usable(session, payment_request):
+        return session
+
+    # Let one request create the session while concurrent ones wait briefly for it.
+    locked = cache.add(f"{key}:lock", 1, conf["LOCK_TIMEOUT"])
+    if not locked:
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            session = cache.get(key)
+            if _usable(session, payment_request):
+                return session
+
+    try:
+        session = create_session(payment_request, success_url, cancel_url, claimed)
+        timeout = _store_timeout(session)
+        if timeout > 0:
+            cache.set(key, session, timeout)
+        return session
+    finally:
+        if locked:
+            cache.delete(f"{key}:lock")
+
+
+async def aget_session(payment_request, success_url, cancel_url, claimed=None):
+    conf = _conf()
+    cache = _cache()
+    key = _key(payment_request.short_code)
+
+    session = await cache.aget(key)
+    if _usable(session, payment_request):
+        return session
+
+    locked = await cache.aadd(f"{key}:lock", 1, conf["LOCK_TIMEOUT"])
+    if not locked:
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            session = await cache.aget(key)
+            if _usable(session, payment_request):
+                return session
+
+    try:
+        session = await acreate_session(payment_request, success_url, cancel_url, claimed)
+        timeout = _store_timeout(session)
+        if timeout > 0:
+            await cache.aset(key, session, timeout)
+        return session
+    finally:
+        if locked:
+            await cache.adelete(f"{key}:lock")
+
+
+def note_view(payment_request):
+    """
+    Count a public page view; returns True when the link has become hot
+    enough that its Checkout Session should be created in the background.
+    """
+    conf = _conf()
+    if not conf["PREWARM_AFTER_VIEWS"]:
+        return False
+
+    cache = _cache()
+    key = _key(payment_request.short_code)
+    hits_key = f"{key}:views"
+    if cache.add(hits_key, 1, conf["PREWARM_WINDOW"]):
+        hits = 1
+    else:
+        try:
+            hits = cache.incr(hits_key)
+        except ValueError:
+            hits = 1
+
+    if hits < conf["PREWARM_AFTER_VIEWS"] or _usable(cache.get(key), payment_request):
+        return False
+    # Only one prewarm per window.
+    return cache.add(f"{key}:prewarm", 1, conf["PREWARM_WINDOW"])
+
+
+async def anote_view(payment_request):
+    conf = _conf()
+    if not conf["PREWARM_AFTER_VIEWS"]:
+        return False
+
+    cache = _cache()
+    key = _key(payment_request.short_code)
+    hits_key = f"{key}:views"
+    if await cache.aadd(hits_key, 1, conf["PREWARM_WINDOW"]):
+        hits = 1
+    else:
+        try:
+            hits = await cache.aincr(hits_key)
+        except ValueError:
+            hits = 1
+
+    if hits < conf["PREWARM_AFTER_VIEWS"] or _usable(await cache.aget(key), payment_request):
+        return False
+    return await cache.aadd(f"{key}:prewarm", 1, conf["PREWARM_WINDOW"])
+
+
+def _enqueue_prewarm(short_code, success_url, cancel_url):
+    from .tasks import prewarm_checkout_session
+
+    try:
+        prewarm_checkout_session.delay(short_code, success_url, cancel_url)
+    except Exception:
+        # Best effort: the Pay POST creates the session if this never runs.
+        logger.exception("Could not enqueue a Checkout Session prewarm for %r", short_code)
+
+
+def schedule_prewarm(short_code, success_url, cancel_url):
+    """
+    Queue prewarm() for a hot link once the current transaction commits.
+    Without a broker Celery would run it inline, putting the Stripe call
+    back on the page view, so then it is skipped.
+    """
+    if getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):
+        return
+    transaction.on_commit(lambda: _enqueue_prewarm(short_code, success_url, cancel_url))
+
+
+def prewarm(short_code, success_url, cancel_url):
+    payment_request = link_cache.get_snapshot(short_code)
+    if payment_request is None or payment_request.is_expired():
+        return None
+    if payment_request.status != payment_request.STATUS_PENDING:
+        return None
+    return get_session(payment_request, success_url, cancel_url)
+
+
+def invalidate(*short_codes):
+    _cache().delete_many([_key(code) for code in short_codes])
@@ -0,0 +1,59 @@
+"""
+Read-replica routing for analytics reads.
+
+Reads go to the "replica" alias only inside `replica_reads()`, and only
+for payapp models, so sessions and auth always come from the primary.
+Everything else, including every write and the read-after-write paths
+(webhook handling, link creation), stays on "default". Without a
+"replica" in DATABASES the router is a no-op.
+
+QuerySets pick their database when they are evaluated, not when they are
+built: wrap the code that evaluates them (a view that renders its
+template, an admin changelist rendered in place), or pin lazily streamed
+querysets with `.using(read_alias())`.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = "replica"
+
+_use_replica = ContextVar("payapp_use_replica", default=False)
+
+
+def has_replica():
+    return REPLICA in settings.DATABASES
+
+
+def read_alias():
+    """Alias analytics reads should use right now: the replica if there is one."""
+    return REPLICA if has_replica() else "default"
+
+
+@contextmanager
+def replica_reads():
+    """Send payapp reads in this block (or decorated view) to the replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and model._meta.app_label == "payapp" and has_replica():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Same data on both aliases.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, never migrated on its own.
+        return db != REPLICA
@@ -0,0 +1,62 @@
+"""
+Bulk expiry of overdue payment links.
+
+Runs from Celery beat (tasks.expire_payment_links) or the
+`expire_payment_links` command, so the public pay page never has to write.
+Each chunk is one short UPDATE ... WHERE status='PENDING' AND
+expires_at < now, driven by the partial index on pending expiries.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import checkout, fragments, link_cache, live
+from .models import PaymentRequest
+
+
+def expire_overdue(chunk_size=1000, now=None):
+    """Mark overdue PENDING links as EXPIRED. Returns how many were expired."""
+    now = now or timezone.now()
+    total = 0
+    expired_label = dict(PaymentRequest.STATUS_CHOICES)[PaymentRequest.STATUS_EXPIRED]
+
+    while True:
+        with transaction.atomic():
+            overdue = list(
+                PaymentRequest.objects
+                .filter(status=PaymentRequest.STATUS_PENDING, expires_at__lt=now)
+                .order_by("expires_at")
+                .values_list("pk", "short_code", "merchant_id")[:chunk_size]
+            )
+            if not overdue:
+                break
+
+            total += (
+                PaymentRequest.objects
+                .filter(
+                    pk__in=[pk for pk, _, _ in overdue],
+                    status=PaymentRequest.STATUS_PENDING,
+                )
+                .update(status=PaymentRequest.STATUS_EXPIRED, status_changed_at=now)
+            )
+
+        # update() skips the post_save signal, so invalidate by hand.
+        short_codes = [code for _, code, _ in overdue]
+        link_cache.invalidate(*short_codes)
+        checkout.invalidate(*short_codes)
+        fragments.bump(*(merchant_id for _, _, merchant_id in overdue))
+        by_merchant = defaultdict(list)
+        for _, short_code, merchant_id in overdue:
+            by_merchant[merchant_id].append(short_code)
+        for merchant_id, merchant_codes in by_merchant.items():
+            live.publish(merchant_id, "link_status", {
+                "short_codes": merchant_codes,
+                "status": PaymentRequest.STATUS_EXPIRED,
+                "label": expired_label,
+            })
+
+        if len(overdue) < chunk_size:
+            break
+
+    return total
@@ -0,0 +1,193 @@
+"""
+Streaming exports of merchant history.
+
+Rows are pulled with values_list().iterator(chunk_size=...) - a
+server-side cursor on PostgreSQL - and encoded into ~64 KB chunks as
+they arrive, optionally gzipped on the fly. Memory use is bounded by the
+chunk size, not by the number of rows exported.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import PaymentRequest, PaymentView, Transaction, TransactionArchive
+
+CHUNK_SIZE = 2000
+FLUSH_BYTES = 64 * 1024
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class ExportKind:
+    def __init__(self, model, queryset, fields, date_field, status_choices=()):
+        self.model = model
+        self._queryset = queryset
+        self.fields = fields
+        self.date_field = date_field
+        self.status_choices = status_choices
+
+    def queryset(self, merchant):
+        return self._queryset(merchant)
+
+
+KINDS = {
+    "transactions": ExportKind(
+        Transaction,
+        lambda merchant: Transaction.objects.filter(merchant=merchant),
+        [
+            ("id", "id"),
+            ("short_code", "payment_request__short_code"),
+            ("status", "status"),
+            ("amount", "amount"),
+            ("currency", "currency"),
+            ("provider_txn_id", "provider_txn_id"),
+            ("created_at", "created_at"),
+        ],
+        "created_at",
+        Transaction.STATUS_CHOICES,
+    ),
+    "payments": ExportKind(
+        PaymentRequest,
+        lambda merchant: PaymentRequest.objects.filter(merchant=merchant),
+        [
+            ("short_code", "short_code"),
+            ("amount", "amount"),
+            ("currency", "currency"),
+            ("description", "description"),
+            ("status", "status"),
+            ("created_at", "created_at"),
+            ("expires_at", "expires_at"),
+        ],
+        "created_at",
+        PaymentRequest.STATUS_CHOICES,
+    ),
+    "views": ExportKind(
+        PaymentView,
+        lambda merchant: PaymentView.objects.filter(payment_request__merchant=merchant),
+        [
+            ("short_code", "payment_request__short_code"),
+            ("timestamp", "timestamp"),
+            ("ip_address", "ip_address"),
+            ("user_agent", "user_agent"),
+            ("referer", "referer"),
+            ("country", "country"),
+            ("city", "city"),
+            ("device_type", "device_type"),
+            ("platform", "platform"),
+        ],
+        "timestamp",
+    ),
+}
+
+
+def export_rows(kind, merchant, start=None, end=None, status=None, include_raw=False, using=None):
+    """Return (header, row iterator) for one export. `end` is exclusive."""
+    spec = KINDS[kind]
+    fields = list(spec.fields)
+    # raw_response holds the whole Stripe event; only ship it when asked.
+    if include_raw and spec.model is Transaction:
+        fields.append(("raw_response", "raw_response"))
+
+    queryset = spec.queryset(merchant)
+    if using:
+        queryset = queryset.using(using)
+    if start:
+        queryset = queryset.filter(**{f"{spec.date_field}__gte": start})
+    if end:
+        queryset = queryset.filter(**{f"{spec.date_field}__lt": end})
+    if status and spec.status_choices:
+        queryset = queryset.filter(status=status)
+
+    rows = (
+        queryset
+        .order_by(spec.date_field)
+        .values_list(*[lookup for _, lookup in fields])
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    header = [name for name, _ in fields]
+    if "raw_response" in header:
+        rows = _with_archived_payloads(rows, header.index("id"), header.index("raw_response"), using)
+    return header, rows
+
+
+def _with_archived_payloads(rows, id_index, raw_index, using=None):
+    """Fill in raw_response from TransactionArchive for rows whose payload was archived."""
+    archives = TransactionArchive.objects.using(using) if using else TransactionArchive.objects
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        missing = [row[id_index] for row in chunk if row[raw_index] is None]
+        payloads = {
+            archive.transaction_id: archive.payload()
+            for archive in archives.filter(transaction_id__in=missing)
+        } if missing else {}
+        for row in chunk:
+            if row[raw_index] is None and row[id_index] in payloads:
+                row = row[:raw_index] + (payloads[row[id_index]],) + row[raw_index + 1:]
+            yield row
+
+
+class _Echo:
+    """File-like object whose write() just returns the line for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def _ndjson_lines(header, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def _batched(lines):
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(header, rows, fmt="csv", gzip=False):
+    """Encode rows as CSV or NDJSON byte chunks, optionally gzipped."""
+    lines = _csv_lines(header, rows) if fmt == "csv" else _ndjson_lines(header, rows)
+    chunks = _batched(lines)
+    return _gzipped(chunks) if gzip else chunks
@@ -1,4 +1,9 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
 from django import forms
+from django.utils import timezone
+
 from .models import PaymentRequest
 
 
@@ -24,3 +29,57 @@ class PaymentRequestForm(forms.ModelForm):
             "currency": forms.TextInput(),
             "description": forms.Textarea(attrs={"rows": 3}),
         }
+
+
+class BulkLinkRowForm(forms.Form):
+    """One row of a bulk link upload (payapp.bulk_links): the same fields as PaymentRequestForm."""
+    amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0.01"))
+    currency = forms.CharField(required=False, max_length=3)
+    description = forms.CharField(required=False, max_length=255)
+    expiry_days = forms.IntegerField(required=False, min_value=1, max_value=365)
+
+    def clean_amount(self):
+        # As stored, so the links returned by bulk_create match the database.
+        return self.cleaned_data["amount"].quantize(Decimal("0.01"))
+
+    def clean_currency(self):
+        return (self.cleaned_data["currency"] or "GBP").upper()
+
+    def clean_expiry_days(self):
+        return self.cleaned_data["expiry_days"] or 7
+
+
+class HistoryFilterForm(forms.Form):
+    """
+    Query-string filters for the paginated link and transaction listings.
+    `status_choices` differ between PaymentRequest and Transaction.
+    """
+    status = forms.ChoiceField(required=False)
+    currency = forms.CharField(required=False, max_length=3)
+    date_from = forms.DateField(required=False, label="From")
+    date_to = forms.DateField(required=False, label="To")
+    cursor = forms.CharField(required=False, widget=forms.HiddenInput)
+    limit = forms.IntegerField(required=False, min_value=1, max_value=100, widget=forms.HiddenInput)
+
+    def __init__(self, *args, status_choices=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["status"].choices = [("", "Any status"), *status_choices]
+
+    def clean_currency(self):
+        return self.cleaned_data["currency"].upper()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get("date_from")
+        date_to = cleaned_data.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("The start date must be before the end date.")
+        return cleaned_data
+
+    def date_range(self):
+        """(start, end) aware datetimes for the chosen dates; end is exclusive, either may be None."""
+        date_from = self.cleaned_data.get("date_from")
+        date_to = self.cleaned_data.get("date_to")
+        start = timezone.make_aware(datetime.combine(date_from, time.min)) if date_from else None
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None
+        return start, end
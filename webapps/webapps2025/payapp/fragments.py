@@ -0,0 +1,37 @@
+"""
+Version tokens for the dashboard's cached template fragments.
+
+dashboard.html caches its summary cards and recent lists with
+`{% cache %}`, keyed on the merchant and `version(merchant_id)`. Anything
+that changes what those fragments show calls `bump()` (model saves do it
+via payapp.signals). That orphans the old entries instead of deleting
+them; they expire on their own. The fragments themselves live in the
+"template_fragments" cache alias, the tokens in "default".
+"""
+import uuid
+
+from django.core.cache import cache
+
+
+def _key(merchant_id):
+    return f"payapp:fragments:{merchant_id}"
+
+
+def _token():
+    return uuid.uuid4().hex[:12]
+
+
+def version(merchant_id):
+    key = _key(merchant_id)
+    token = cache.get(key)
+    if token is None:
+        # A random token rather than a counter, so an evicted key can
+        # never bring back fragments cached under an old version.
+        token = _token()
+        if not cache.add(key, token, None):
+            token = cache.get(key, token)
+    return token
+
+
+def bump(*merchant_ids):
+    cache.set_many({_key(merchant_id): _token() for merchant_id in set(merchant_ids)}, None)
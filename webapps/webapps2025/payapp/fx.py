@@ -0,0 +1,110 @@
+"""
+Foreign exchange rates for reporting totals in one currency.
+
+Rates live in the FxRate table, seeded from a local JSON file by the
+`load_fx_rates` command; nothing here touches the network. Each process
+keeps the whole table in memory and reloads it after FX["TTL"] seconds,
+so the dashboard converts without a query on most requests.
+
+Conversion is applied to per-currency totals (one row per currency from
+the rollups), never to individual payments.
+"""
+import json
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import FxRate
+
+DEFAULTS = {
+    "BASE_CURRENCY": "GBP",
+    "TTL": 300,
+    # JSON file `load_fx_rates` reads when no path is given.
+    "RATES_FILE": "",
+}
+
+CENT = Decimal("0.01")
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "FX", {})}
+
+
+# ─────────────────────────────────────
+# In-process rate table
+# ─────────────────────────────────────
+_rates = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def rates():
+    """{currency: units per base currency unit}, refreshed from the database every FX["TTL"] seconds."""
+    global _rates, _loaded_at
+    config = conf()
+    if _rates is None or time.monotonic() - _loaded_at > config["TTL"]:
+        with _lock:
+            if _rates is None or time.monotonic() - _loaded_at > config["TTL"]:
+                table = dict(FxRate.objects.values_list("currency", "rate"))
+                table[config["BASE_CURRENCY"]] = Decimal(1)
+                _rates = table
+                _loaded_at = time.monotonic()
+    return _rates
+
+
+def reset():
+    """Drop the in-process table so the next lookup reloads it."""
+    global _rates
+    with _lock:
+        _rates = None
+
+
+def convert_totals(totals, to_currency):
+    """
+    Sum {currency: amount} in `to_currency`, rounded to cents. None if any
+    currency involved has no rate.
+    """
+    table = rates()
+    to_currency = to_currency.upper()
+    if to_currency not in table or any(currency.upper() not in table for currency in totals):
+        return None
+    in_base = sum(
+        (Decimal(amount or 0) / table[currency.upper()] for currency, amount in totals.items()),
+        Decimal(0),
+    )
+    return (in_base * table[to_currency]).quantize(CENT)
+
+
+# ─────────────────────────────────────
+# Seeding
+# ─────────────────────────────────────
+def load(path):
+    """
+    Replace the rate table from a JSON file shaped like
+    {"base": "GBP", "rates": {"USD": 1.27, "EUR": 1.17}}. Rates are
+    rebased if the file's base differs from FX["BASE_CURRENCY"]. Returns
+    how many rates were stored.
+    """
+    with open(path) as fh:
+        data = json.load(fh)
+
+    base = conf()["BASE_CURRENCY"]
+    table = {currency.upper(): Decimal(str(rate)) for currency, rate in data["rates"].items()}
+    table[data.get("base", base).upper()] = Decimal(1)
+    if base not in table:
+        raise ValueError(f"{path} has no rate for the base currency {base}.")
+    rebase = table[base]
+
+    with transaction.atomic():
+        FxRate.objects.exclude(currency__in=table).delete()
+        FxRate.objects.bulk_create(
+            [FxRate(currency=currency, rate=rate / rebase) for currency, rate in table.items()],
+            update_conflicts=True,
+            unique_fields=["currency"],
+            update_fields=["rate", "updated_at"],
+        )
+    reset()
+    return len(table)
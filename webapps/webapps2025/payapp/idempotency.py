@@ -0,0 +1,282 @@
+"""
+Idempotency keys for the POSTs that create things: payment links (the
+form and the bulk API) and Checkout Sessions (the public Pay POST).
+
+Clients send an Idempotency-Key header. The HTML forms instead send an
+`idempotency_key` field that was rendered into the page. A retry with
+the same key gets the first response back instead of running the view
+again:
+
+- The first request claims the key by inserting an IdempotencyKey row.
+  The row's key is a digest of the view, the caller and the client's
+  key. It also holds a fingerprint of the request (method, path, body).
+  Until the response is stored, the row's expires_at is a lease of
+  LOCK_TIMEOUT seconds; a retry after that takes the claim over, keeping
+  the row's created_at.
+- Its response is stored on the row. Server errors, 429s and streaming
+  responses are not stored; they free the key for another try.
+- A retry with the same fingerprint gets the stored response, marked
+  Idempotent-Replayed: true. If the first request is still running, the
+  retry waits up to REPLAY_WAIT seconds for it, then gets a 409. A
+  double-clicked form therefore ends on the first click's redirect.
+- The same key with a different request is a 422.
+
+`idempotent` wraps a whole view. The public Pay POST calls `claim` and
+`store` itself instead, so a flood shed by the rate limiter never
+writes a row. It forwards the claimed row to payapp.checkout, which
+passes the key on to Stripe and derives the session's parameters from
+the row, so a retry sends Stripe the same request again. Rows expire
+after IDEMPOTENCY["TTL"] seconds, or earlier when `store` is given a
+shorter lifetime, and tasks.purge_idempotency_keys deletes them.
+"""
+import asyncio
+import hashlib
+import time
+import uuid
+import zlib
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+DEFAULTS = {
+    "TTL": 24 * 60 * 60,
+    # An unfinished claim older than this belongs to a request that died.
+    "LOCK_TIMEOUT": 60,
+    "REPLAY_WAIT": 5,
+    "CHUNK_SIZE": 1000,
+}
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+FIELD = "idempotency_key"
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADERS = ("Content-Type", "Location")
+
+# _try_claim(): another request holds the key and may still finish.
+_BUSY = object()
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "IDEMPOTENCY", {})}
+
+
+def new_key():
+    """A key to render into a form, so resubmitting it is recognised."""
+    return uuid.uuid4().hex
+
+
+def _digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else str(part).encode())
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def _prepare(request):
+    """(key digest, fingerprint), None without a key, or a 400 response for a bad one."""
+    if request.method != "POST":
+        return None
+    # The body first: for multipart forms it cannot be read after POST.
+    body = request.body
+    client_key = request.META.get(HEADER) or request.POST.get(FIELD)
+    if not client_key:
+        return None
+    if len(client_key) > MAX_KEY_LENGTH:
+        return HttpResponse(
+            f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters.",
+            status=400,
+            content_type="text/plain; charset=utf-8",
+        )
+    # Keys are per caller: anonymous callers share a namespace, so their
+    # keys must be unguessable (new_key()).
+    caller = request.user.pk if request.user.is_authenticated else "anonymous"
+    view_name = request.resolver_match.view_name if request.resolver_match else ""
+    key = _digest(view_name, caller, client_key)
+    fingerprint = _digest(request.method, request.path, request.content_type, body)
+    return key, fingerprint
+
+
+def _error(status, message):
+    return HttpResponse(message, status=status, content_type="text/plain; charset=utf-8")
+
+
+def _replay(row):
+    response = HttpResponse(zlib.decompress(row.body) if row.body else b"", status=row.status_code)
+    for name, value in row.headers.items():
+        response[name] = value
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _try_claim(key, fingerprint):
+    """The claimed row once this request owns the key; _BUSY; or the response to send instead."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=conf()["LOCK_TIMEOUT"])
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                key=key,
+                fingerprint=fingerprint,
+                created_at=now,
+                expires_at=lease,
+            )
+    except IntegrityError:
+        row = IdempotencyKey.objects.filter(pk=key).first()
+
+    if row is None:
+        # Released in between; try again.
+        return _BUSY
+    if row.status_code is not None and row.expires_at <= now:
+        # Only one of several racing retries deletes the row.
+        IdempotencyKey.objects.filter(pk=key, expires_at=row.expires_at).delete()
+        return _BUSY
+    if row.fingerprint != fingerprint:
+        return _error(422, "This Idempotency-Key was already used for a different request.")
+    if row.status_code is None:
+        if row.expires_at > now:
+            return _BUSY
+        # The first request died. Take its claim over, created_at and all,
+        # so whatever was derived from the row comes out the same.
+        if not IdempotencyKey.objects.filter(pk=key, expires_at=row.expires_at).update(expires_at=lease):
+            return _BUSY
+        row.expires_at = lease
+        return row
+    return _replay(row)
+
+
+def store(claimed, response, expires_at=None):
+    """
+    Keep `response` for retries of the claimed key, until the key's TTL
+    or `expires_at` if that comes first.
+    """
+    if response.streaming or response.status_code >= 500 or response.status_code == 429:
+        release(claimed)
+        return
+    ttl_expiry = claimed.created_at + timedelta(seconds=conf()["TTL"])
+    expires_at = min(expires_at, ttl_expiry) if expires_at else ttl_expiry
+    IdempotencyKey.objects.filter(pk=claimed.pk).update(
+        status_code=response.status_code,
+        headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+        body=zlib.compress(response.content),
+        expires_at=expires_at,
+    )
+
+
+def release(claimed):
+    """Free the key for another try."""
+    IdempotencyKey.objects.filter(pk=claimed.pk, status_code__isnull=True).delete()
+
+
+async def astore(claimed, response, expires_at=None):
+    await sync_to_async(store)(claimed, response, expires_at)
+
+
+async def arelease(claimed):
+    await sync_to_async(release)(claimed)
+
+
+def _in_progress():
+    response = _error(409, "A request with this Idempotency-Key is still in progress.")
+    response["Retry-After"] = "1"
+    return response
+
+
+def _claim(key, fingerprint):
+    deadline = time.monotonic() + conf()["REPLAY_WAIT"]
+    while (outcome := _try_claim(key, fingerprint)) is _BUSY:
+        if time.monotonic() >= deadline:
+            return _in_progress()
+        time.sleep(0.1)
+    return outcome
+
+
+async def _aclaim(key, fingerprint):
+    deadline = time.monotonic() + conf()["REPLAY_WAIT"]
+    while (outcome := await sync_to_async(_try_claim)(key, fingerprint)) is _BUSY:
+        if time.monotonic() >= deadline:
+            return _in_progress()
+        await asyncio.sleep(0.1)
+    return outcome
+
+
+def claim(request):
+    """
+    Claim the request's key. Returns the claimed IdempotencyKey, None
+    when the request has no key, or a response to send instead (a replay,
+    400, 409 or 422). The caller must `store` or `release` a claimed key.
+    """
+    prepared = _prepare(request)
+    if prepared is None or isinstance(prepared, HttpResponse):
+        return prepared
+    return _claim(*prepared)
+
+
+async def aclaim(request):
+    prepared = await sync_to_async(_prepare)(request)
+    if prepared is None or isinstance(prepared, HttpResponse):
+        return prepared
+    return await _aclaim(*prepared)
+
+
+def idempotent(view):
+    """Honour Idempotency-Key on POSTs to `view`, a sync or async view."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            claimed = await aclaim(request)
+            if claimed is None:
+                return await view(request, *args, **kwargs)
+            if isinstance(claimed, HttpResponse):
+                return claimed
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await arelease(claimed)
+                raise
+            await astore(claimed, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        claimed = claim(request)
+        if claimed is None:
+            return view(request, *args, **kwargs)
+        if isinstance(claimed, HttpResponse):
+            return claimed
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release(claimed)
+            raise
+        store(claimed, response)
+        return response
+
+    return wrapper
+
+
+def purge_expired(chunk_size=None, now=None):
+    """Delete expired keys in chunks. Returns how many were deleted."""
+    chunk_size = chunk_size or conf()["CHUNK_SIZE"]
+    now = now or timezone.now()
+    total = 0
+    while True:
+        pks = list(
+            IdempotencyKey.objects
+            .filter(expires_at__lte=now)
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+        total += IdempotencyKey.objects.filter(pk__in=pks).delete()[0]
+        if len(pks) < chunk_size:
+            break
+    return total
@@ -0,0 +1,182 @@
+"""
+Read-through cache for short_code -> PaymentRequest resolution.
+
+Public pay pages only need a handful of fields, so we cache a compact
+snapshot (plain dict, safe to pickle into Redis) rather than the model
+instance. Unknown codes are cached too, for a shorter time, so bots
+probing random codes do not reach the database.
+
+Entries live in the "links" cache alias: locmem evicts least recently
+used entries past MAX_ENTRIES, Redis relies on its own maxmemory policy;
+both expire entries after PAYMENT_LINK_CACHE["TTL"] seconds. Every status
+change must call `invalidate()` (model saves do it via payapp.signals).
+"""
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+from django.utils import timezone
+
+from .models import PaymentRequest
+
+DEFAULTS = {
+    "ALIAS": "links",
+    "TTL": 300,
+    "NEGATIVE_TTL": 30,
+}
+
+# Anything that could never have come out of bulk_links.generate_short_code().
+_VALID_CODE = re.compile(r"^[A-Za-z0-9_-]{1,12}$")
+
+_MISSING = "missing"
+
+
+def _conf():
+    return {**DEFAULTS, **getattr(settings, "PAYMENT_LINK_CACHE", {})}
+
+
+def _cache():
+    return caches[_conf()["ALIAS"]]
+
+
+def _key(short_code):
+    return f"payapp:link:{short_code}"
+
+
+class PaymentSnapshot:
+    """Read-only view of a PaymentRequest, good enough for the public pages."""
+
+    STATUS_PENDING = PaymentRequest.STATUS_PENDING
+    STATUS_PAID = PaymentRequest.STATUS_PAID
+    STATUS_EXPIRED = PaymentRequest.STATUS_EXPIRED
+    STATUS_CANCELLED = PaymentRequest.STATUS_CANCELLED
+
+    FIELDS = (
+        "pk",
+        "short_code",
+        "amount",
+        "currency",
+        "description",
+        "status",
+        "created_at",
+        "expires_at",
+        "status_changed_at",
+        "merchant_id",
+        "merchant_name",
+    )
+
+    def __init__(self, data):
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field))
+
+    def __repr__(self):
+        return f"<PaymentSnapshot {self.short_code} ({self.status})>"
+
+    @property
+    def id(self):
+        return self.pk
+
+    @classmethod
+    def dump(cls, payment_request):
+        merchant = payment_request.merchant
+        return {
+            "pk": payment_request.pk,
+            "short_code": payment_request.short_code,
+            "amount": payment_request.amount,
+            "currency": payment_request.currency,
+            "description": payment_request.description,
+            "status": payment_request.status,
+            "created_at": payment_request.created_at,
+            "expires_at": payment_request.expires_at,
+            "status_changed_at": payment_request.status_changed_at,
+            "merchant_id": payment_request.merchant_id,
+            "merchant_name": merchant.get_full_name() or merchant.get_username(),
+        }
+
+    def is_expired(self) -> bool:
+        return bool(self.expires_at and timezone.now() > self.expires_at)
+
+
+def _load(short_code):
+    try:
+        payment_request = (
+            PaymentRequest.objects
+            .select_related("merchant")
+            .get(short_code=short_code)
+        )
+    except PaymentRequest.DoesNotExist:
+        return None
+    return PaymentSnapshot.dump(payment_request)
+
+
+def get_snapshot(short_code):
+    """Return a PaymentSnapshot for `short_code`, or None if there is no such link."""
+    if not _VALID_CODE.match(short_code):
+        return None
+
+    conf = _conf()
+    cache = _cache()
+    data = cache.get(_key(short_code))
+
+    if data is None:
+        data = _load(short_code)
+        if data is None:
+            cache.set(_key(short_code), _MISSING, conf["NEGATIVE_TTL"])
+            return None
+        cache.set(_key(short_code), data, conf["TTL"])
+
+    if data == _MISSING:
+        return None
+    return PaymentSnapshot(data)
+
+
+async def _aload(short_code):
+    try:
+        payment_request = await (
+            PaymentRequest.objects
+            .select_related("merchant")
+            .aget(short_code=short_code)
+        )
+    except PaymentRequest.DoesNotExist:
+        return None
+    return PaymentSnapshot.dump(payment_request)
+
+
+async def aget_snapshot(short_code):
+    """Async get_snapshot(), for the ASGI views."""
+    if not _VALID_CODE.match(short_code):
+        return None
+
+    conf = _conf()
+    cache = _cache()
+    data = await cache.aget(_key(short_code))
+
+    if data is None:
+        data = await _aload(short_code)
+        if data is None:
+            await cache.aset(_key(short_code), _MISSING, conf["NEGATIVE_TTL"])
+            return None
+        await cache.aset(_key(short_code), data, conf["TTL"])
+
+    if data == _MISSING:
+        return None
+    return PaymentSnapshot(data)
+
+
+def get_snapshot_or_404(short_code):
+    snapshot = get_snapshot(short_code)
+    if snapshot is None:
+        raise Http404("No PaymentRequest matches the given query.")
+    return snapshot
+
+
+async def aget_snapshot_or_404(short_code):
+    snapshot = await aget_snapshot(short_code)
+    if snapshot is None:
+        raise Http404("No PaymentRequest matches the given query.")
+    return snapshot
+
+
+def invalidate(*short_codes):
+    _cache().delete_many([_key(code) for code in short_codes])
@@ -0,0 +1,104 @@
+"""
+Public JSON status of a payment link, for the success page and for
+merchant integrations that poll.
+
+The status comes from the link_cache snapshot, so a poll costs a cache
+read. Responses carry an ETag and a Last-Modified header, and a request
+whose If-None-Match still matches gets a bodyless 304.
+
+Long polling: with ?wait=N (seconds, at most PAYMENT_STATUS["MAX_WAIT"])
+and a matching If-None-Match, the async view holds the request until the
+status changes or N seconds pass, then answers 200 or 304. It wakes on
+the merchant's live updates (see payapp.live) and re-reads the cache
+every POLL_INTERVAL seconds in case one was missed. The sync view cannot
+afford to hold a worker, so it ignores `wait` and answers at once.
+"""
+import asyncio
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import link_cache, live
+from .models import PaymentRequest
+
+DEFAULTS = {
+    "MAX_WAIT": 25,
+    "POLL_INTERVAL": 5,
+}
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "PAYMENT_STATUS", {})}
+
+
+def requested_wait(request):
+    """Seconds the client asked to wait, clamped to MAX_WAIT (0 if none or invalid)."""
+    try:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, conf()["MAX_WAIT"]))
+
+
+def state(snapshot):
+    """(payload, ETag, Last-Modified datetime or None) for a link_cache snapshot."""
+    status = snapshot.status
+    modified = snapshot.status_changed_at or snapshot.created_at
+    if status == snapshot.STATUS_PENDING and snapshot.is_expired():
+        # Overdue but not swept yet; the pay page treats it as expired too.
+        status = snapshot.STATUS_EXPIRED
+        modified = snapshot.expires_at
+
+    payload = {
+        "short_code": snapshot.short_code,
+        "status": status,
+        "label": dict(PaymentRequest.STATUS_CHOICES).get(status, status),
+        "paid": status == snapshot.STATUS_PAID,
+        "amount": str(snapshot.amount),
+        "currency": snapshot.currency,
+        "expires_at": snapshot.expires_at.isoformat() if snapshot.expires_at else None,
+        "updated_at": modified.isoformat() if modified else None,
+    }
+    stamp = int(modified.timestamp()) if modified else 0
+    return payload, quote_etag(f"{status.lower()}-{stamp}"), modified
+
+
+def not_modified(request, snapshot):
+    """The 304 for `snapshot` if the client already has it, else None."""
+    _, etag, modified = state(snapshot)
+    last_modified = int(modified.timestamp()) if modified else None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def respond(request, snapshot):
+    payload, etag, modified = state(snapshot)
+    response = not_modified(request, snapshot)
+    if response is None:
+        response = JsonResponse(payload)
+    response["ETag"] = etag
+    if modified:
+        response["Last-Modified"] = http_date(modified.timestamp())
+    # Cacheable, but always revalidated: a poll is a conditional GET.
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def get_response(request, short_code):
+    return respond(request, link_cache.get_snapshot_or_404(short_code))
+
+
+async def aget_response(request, short_code):
+    snapshot = await link_cache.aget_snapshot_or_404(short_code)
+    wait = requested_wait(request)
+    if wait and not_modified(request, snapshot):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        poll_interval = conf()["POLL_INTERVAL"]
+        while (remaining := deadline - loop.time()) > 0:
+            await live.wait(snapshot.merchant_id, min(remaining, poll_interval))
+            snapshot = await link_cache.aget_snapshot_or_404(short_code)
+            if not not_modified(request, snapshot):
+                break
+    return respond(request, snapshot)
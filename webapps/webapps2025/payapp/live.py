@@ -0,0 +1,240 @@
+"""
+Live dashboard updates over Server-Sent Events.
+
+Publishers call `publish(merchant_id, event, data)`. These are the webhook
+handler (payments), link saves and the expiry sweep (status changes),
+and the analytics rollups (view counts). Delivery waits for the
+publisher's transaction to commit. Each open dashboard holds one SSE
+stream (async_views.dashboard_events) that waits on an asyncio.Queue in
+this process's Hub. An idle stream is a queue and a suspended coroutine,
+so one ASGI worker can hold thousands.
+
+Under ASGI, asgi.py sends the stream URL to StreamHandler rather than
+Django's own handler. The only difference is that StreamHandler has no
+per-request ThreadSensitiveContext. With one, every open stream would
+pin its own sync thread and database connection until the client left.
+
+Backends (LIVE_UPDATES["BACKEND"]):
+    "memory" - publish straight into this process's hub; right when the
+               publishers run in the process serving the streams (runserver,
+               a single ASGI worker with eager Celery, tests)
+    "redis"  - publish to a Redis channel per merchant; every ASGI worker
+               runs one subscriber task (one Redis connection, however many
+               streams it holds) that fans messages out to its hub
+
+Updates are best effort. A slow client's full queue drops messages, and
+a reload always shows the full picture.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ENABLED": True,
+    "BACKEND": "memory",
+    "REDIS_URL": "",
+    # Comment line sent on idle streams so proxies keep them open.
+    "HEARTBEAT": 15,
+    # Streams end after this many seconds; EventSource reconnects by itself.
+    "MAX_AGE": 3600,
+    # Reconnect delay suggested to the browser, in milliseconds.
+    "RETRY_MS": 3000,
+    "QUEUE_SIZE": 100,
+}
+
+CHANNEL_PREFIX = "payapp:live:"
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "LIVE_UPDATES", {})}
+
+
+def encode(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+# ─────────────────────────────────────
+# In-process fan-out
+# ─────────────────────────────────────
+def _offer(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+class Hub:
+    """Open streams per merchant. Subscribe on the event loop; dispatch from any thread."""
+
+    def __init__(self):
+        self._streams = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, merchant_id, queue_size):
+        queue = asyncio.Queue(queue_size)
+        with self._lock:
+            self._streams[str(merchant_id)].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, merchant_id, queue):
+        with self._lock:
+            streams = self._streams.get(str(merchant_id), set())
+            streams.difference_update({stream for stream in streams if stream[1] is queue})
+            if not streams:
+                self._streams.pop(str(merchant_id), None)
+
+    def dispatch(self, merchant_id, message):
+        with self._lock:
+            streams = list(self._streams.get(str(merchant_id), ()))
+        for loop, queue in streams:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # That stream's loop has closed; its generator cleans up.
+                pass
+
+    def count(self):
+        with self._lock:
+            return sum(len(streams) for streams in self._streams.values())
+
+
+hub = Hub()
+
+
+# ─────────────────────────────────────
+# Publishing
+# ─────────────────────────────────────
+_redis = None
+
+
+def _redis_client():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(conf()["REDIS_URL"])
+    return _redis
+
+
+def _send(merchant_id, message):
+    if conf()["BACKEND"] == "redis":
+        try:
+            _redis_client().publish(f"{CHANNEL_PREFIX}{merchant_id}", message)
+        except Exception:
+            # Never let a missed live update break payment handling.
+            logger.exception("Could not publish a live update")
+    else:
+        hub.dispatch(merchant_id, message)
+
+
+def publish(merchant_id, event, data):
+    """Push `event` to the merchant's open dashboards once the current transaction commits."""
+    if merchant_id is None or not conf()["ENABLED"]:
+        return
+    message = encode(event, data)
+    transaction.on_commit(lambda: _send(merchant_id, message))
+
+
+# ─────────────────────────────────────
+# Streams
+# ─────────────────────────────────────
+_listener = None
+
+
+async def _listen():
+    import redis.asyncio as aioredis
+
+    while True:
+        try:
+            client = aioredis.Redis.from_url(conf()["REDIS_URL"])
+            async with client.pubsub() as pubsub:
+                # Every merchant's channel: one connection per worker,
+                # and a message for a merchant with no stream here costs a lookup.
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        merchant_id = message["channel"].decode()[len(CHANNEL_PREFIX):]
+                        hub.dispatch(merchant_id, message["data"].decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Live update subscriber failed; reconnecting")
+            await asyncio.sleep(1)
+
+
+def _ensure_listener():
+    global _listener
+    if conf()["BACKEND"] == "redis" and (_listener is None or _listener.done()):
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+
+async def stream(merchant_id):
+    """SSE body for one dashboard: queued updates, with heartbeats while idle."""
+    config = conf()
+    _ensure_listener()
+    queue = hub.subscribe(merchant_id, config["QUEUE_SIZE"])
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config["MAX_AGE"]
+    try:
+        yield f"retry: {config['RETRY_MS']}\n\n"
+        while loop.time() < deadline:
+            try:
+                yield await asyncio.wait_for(queue.get(), config["HEARTBEAT"])
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        # Also runs when Django cancels the response on client disconnect.
+        hub.unsubscribe(merchant_id, queue)
+
+
+async def wait(merchant_id, timeout):
+    """Sleep until the next update for the merchant, or `timeout` seconds. True if an update came."""
+    _ensure_listener()
+    queue = hub.subscribe(merchant_id, 1)
+    try:
+        await asyncio.wait_for(queue.get(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        hub.unsubscribe(merchant_id, queue)
+
+
+# ─────────────────────────────────────
+# ASGI
+# ─────────────────────────────────────
+class StreamHandler(ASGIHandler):
+    """
+    Django's ASGI handler without the per-request ThreadSensitiveContext.
+    The sync work in a stream request (session, user, signals) runs on
+    asgiref's shared sync thread, and nothing is left holding a thread
+    once the stream is open.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError(f"Django can only handle ASGI/HTTP connections, not {scope['type']}.")
+        await self.handle(scope, receive, send)
+
+
+def route_streams(application):
+    """Wrap the project's ASGI application so dashboard streams go through StreamHandler."""
+    streams = StreamHandler()
+    path = reverse("payapp:dashboard_events")
+
+    async def router(scope, receive, send):
+        if scope["type"] == "http" and scope["path"].removeprefix(scope.get("root_path", "")) == path:
+            return await streams(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
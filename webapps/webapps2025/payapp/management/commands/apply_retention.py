@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from payapp import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact page views past retention into daily aggregates, move old Stripe "
+        "payloads to compressed cold storage and purge processed webhook events. "
+        "On PostgreSQL also creates upcoming monthly partitions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view-days", type=int, help="Keep raw page views this many days.")
+        parser.add_argument("--raw-response-days", type=int, help="Keep raw_response inline this many days.")
+        parser.add_argument("--webhook-event-days", type=int, help="Keep processed webhook events this many days.")
+        parser.add_argument("--chunk-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        for model in retention.PARTITIONED:
+            created = retention.ensure_partitions(model)
+            if created:
+                self.stdout.write(f"Created {created} partitions of {model._meta.db_table}.")
+
+        chunk_size = options["chunk_size"]
+        views = retention.compact_views(options["view_days"], chunk_size)
+        payloads = retention.archive_raw_responses(options["raw_response_days"], chunk_size)
+        events = retention.purge_webhook_events(options["webhook_event_days"], chunk_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {views} page views, archived {payloads} Stripe payloads, "
+            f"purged {events} webhook events."
+        ))
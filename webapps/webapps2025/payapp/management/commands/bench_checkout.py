@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from payapp import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare checkout POST throughput of the sync (WSGI, thread pool) and "
+        "async (ASGI, one event loop) pay views against a local fake Stripe "
+        "server. Runs on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=50,
+                            help="In-flight requests for the async run.")
+        parser.add_argument("--threads", type=int, default=8,
+                            help="Worker threads for the sync run (gunicorn workers x threads).")
+        parser.add_argument("--latency", type=float, default=0.2,
+                            help="Fake Stripe latency per call, in seconds.")
+        parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+
+    def handle(self, *args, **options):
+        modes = ["sync", "async"] if options["mode"] == "both" else [options["mode"]]
+        with benchmark.environment(options["latency"]):
+            merchant = benchmark.create_merchant()
+            for mode in modes:
+                # One fresh link per request, so every POST pays a Stripe round trip.
+                links = benchmark.create_links(merchant, options["requests"])
+                scenario = benchmark.checkout_post(merchant, links, options["requests"])
+                benchmark.route_views(mode == "async")
+                if mode == "sync":
+                    result = benchmark.run_threaded(scenario, merchant, options["threads"])
+                else:
+                    result = benchmark.run_async(scenario, merchant, options["concurrency"])
+                latency = result["latency_ms"]
+                self.stdout.write(
+                    f"{mode:>5}: {result['requests']} requests in {result['elapsed_s']}s "
+                    f"= {result['throughput_rps']} req/s, "
+                    f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, errors {result['errors']}"
+                )
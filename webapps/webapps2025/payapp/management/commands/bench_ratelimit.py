@@ -0,0 +1,82 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+
+from payapp import ratelimit
+
+# High enough that the accepted path is what gets measured.
+NO_LIMITS = {"ip": (10**9, 60), "link": (10**9, 60), "merchant": (10**9, 60)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the rate limiter's cost per Pay POST for the memory backend and "
+        "the shared cache backend: accepted requests from many IPs, across threads, "
+        "and requests shed by a full limit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checks", type=int, default=20000, help="Checks per thread.")
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--ips", type=int, default=5000, help="Distinct client IPs.")
+        parser.add_argument("--cache-alias", default="default", help="Cache for the shared backend.")
+
+    def handle(self, *args, **options):
+        if min(options["checks"], options["threads"], options["ips"]) < 1:
+            raise CommandError("--checks, --threads and --ips must be positive.")
+
+        factory = RequestFactory()
+        requests = [
+            factory.post("/pay/x/", REMOTE_ADDR=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+            for i in range(options["ips"])
+        ]
+        links = [SimpleNamespace(short_code=f"bench{i:03d}", merchant_id=i % 10) for i in range(100)]
+
+        for backend in ("memory", "cache"):
+            config = {"BACKEND": backend, "CACHE_ALIAS": options["cache_alias"]}
+            with override_settings(RATE_LIMIT={**config, "LIMITS": NO_LIMITS}):
+                ratelimit.reset()
+                self._report(f"{backend}, 1 thread", self._run(requests, links, options["checks"], 1))
+                self._report(
+                    f"{backend}, {options['threads']} threads",
+                    self._run(requests, links, options["checks"], options["threads"]),
+                )
+            with override_settings(RATE_LIMIT={**config, "LIMITS": {"ip": (1, 60)}}):
+                ratelimit.reset()
+                self._report(f"{backend}, shed", self._run(requests[:1], links[:1], options["checks"], 1))
+        ratelimit.reset()
+
+    def _run(self, requests, links, checks, threads):
+        def worker(offset):
+            samples, shed = [], 0
+            for i in range(offset, offset + checks):
+                request, link = requests[i % len(requests)], links[i % len(links)]
+                started = time.perf_counter()
+                response = ratelimit.check_pay_post(request, link)
+                samples.append(time.perf_counter() - started)
+                shed += response is not None
+            return samples, shed
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(worker, [n * checks for n in range(threads)]))
+        elapsed = time.perf_counter() - started
+
+        samples = sorted(sample for thread_samples, _ in results for sample in thread_samples)
+        return {
+            "checks": len(samples),
+            "shed": sum(shed for _, shed in results),
+            "per_second": len(samples) / elapsed,
+            "mean_us": statistics.fmean(samples) * 1e6,
+            "p99_us": samples[int(len(samples) * 0.99) - 1] * 1e6,
+        }
+
+    def _report(self, name, result):
+        self.stdout.write(
+            f"{name:<20} {result['checks']:>7} checks  {result['per_second']:>9.0f}/s  "
+            f"mean {result['mean_us']:6.1f} us  p99 {result['p99_us']:7.1f} us  shed {result['shed']}"
+        )
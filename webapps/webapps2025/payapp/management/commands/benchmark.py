@@ -0,0 +1,114 @@
+import json
+import platform
+import sys
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from payapp import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the public pay page, checkout POST, webhook bursts, dashboard "
+        "and QR endpoint against a local fake Stripe server, on a throwaway test "
+        "database. Reports p50/p95/p99 latency, throughput and queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(benchmark.SCENARIOS),
+            help="Scenario to run (repeatable). Default: all.",
+        )
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--links", type=int, default=50, help="Payment links per scenario.")
+        parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario.")
+        parser.add_argument("--stripe-latency", type=float, default=0.05, help="Seconds per fake Stripe call.")
+        parser.add_argument("--asgi", action="store_true", help="Use the async views and the ASGI handler.")
+        parser.add_argument("--output", help="Also write the JSON report to this file.")
+        parser.add_argument("--json", action="store_true", help="Print the JSON report instead of a table.")
+        parser.add_argument("--compare", help="Earlier JSON report to print changes against.")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["concurrency"] < 1 or options["links"] < 1:
+            raise CommandError("--requests, --concurrency and --links must be positive.")
+
+        names = options["scenario"] or list(benchmark.SCENARIOS)
+        run = benchmark.run_async if options["asgi"] else benchmark.run_threaded
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "mode": "asgi" if options["asgi"] else "wsgi",
+            "config": {
+                key: options[key]
+                for key in ("requests", "concurrency", "links", "warmup", "stripe_latency")
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "platform": sys.platform,
+            },
+            "results": [],
+        }
+
+        with benchmark.environment(options["stripe_latency"], async_views=options["asgi"]) as stripe:
+            merchant = benchmark.create_merchant()
+            for name in names:
+                build = benchmark.SCENARIOS[name]
+                # Fresh links for every run, so one scenario (e.g. webhooks
+                # marking links paid) cannot skew the next.
+                if options["warmup"]:
+                    warmup = build(merchant, benchmark.create_links(merchant, options["links"]), options["warmup"])
+                    run(warmup, merchant, options["concurrency"])
+
+                scenario = build(merchant, benchmark.create_links(merchant, options["links"]), options["requests"])
+                stripe_calls = stripe.requests
+                result = run(scenario, merchant, options["concurrency"])
+                result["stripe_calls"] = stripe.requests - stripe_calls
+                report["results"].append(result)
+
+                if not options["json"]:
+                    self._row(result)
+
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        elif options["compare"]:
+            with open(options["compare"]) as fh:
+                self._compare(json.load(fh), report)
+
+    def _row(self, result):
+        latency = result["latency_ms"]
+        queries = result["queries_per_request"]["mean"]
+        self.stdout.write(
+            f"{result['scenario']:<14} {result['throughput_rps']:>8} req/s  "
+            f"p50 {latency['p50']:>8} ms  p95 {latency['p95']:>8} ms  p99 {latency['p99']:>8} ms  "
+            f"queries {queries if queries is not None else '-':>5}  "
+            f"errors {result['errors']}"
+        )
+
+    def _compare(self, before, after):
+        previous = {result["scenario"]: result for result in before["results"]}
+        self.stdout.write(f"\nChanges against the run from {before['started_at']}:")
+        for result in after["results"]:
+            old = previous.get(result["scenario"])
+            if old is None:
+                continue
+            self.stdout.write(
+                f"{result['scenario']:<14} "
+                f"throughput {self._change(old['throughput_rps'], result['throughput_rps'])}  "
+                f"p95 {self._change(old['latency_ms']['p95'], result['latency_ms']['p95'])}  "
+                f"queries {old['queries_per_request']['mean']} -> {result['queries_per_request']['mean']}"
+            )
+
+    def _change(self, old, new):
+        if not old or new is None:
+            return f"{old} -> {new}"
+        return f"{(new - old) / old:+.0%}"
@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from payapp import benchmark
+from payapp.models import Transaction
+from payapp.views import dashboard_context
+
+TEMPLATE = "payapp/dashboard.html"
+
+UNCACHED_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time dashboard renders (context building included) with the plain "
+        "template loaders and no fragment cache, with the cached loader, and "
+        "with the cached loader plus warm {% cache %} fragments. Runs on a "
+        "throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--renders", type=int, default=200, help="Measured renders per configuration.")
+        parser.add_argument("--links", type=int, default=50, help="Payment links (and transactions) to show.")
+
+    def handle(self, *args, **options):
+        if options["renders"] < 1 or options["links"] < 1:
+            raise CommandError("--renders and --links must be positive.")
+
+        with benchmark.environment():
+            merchant = benchmark.create_merchant()
+            links = benchmark.create_links(merchant, options["links"])
+            Transaction.objects.bulk_create(
+                Transaction(
+                    payment_request=link,
+                    merchant=merchant,
+                    status=Transaction.STATUS_SUCCESS,
+                    amount=link.amount,
+                    currency=link.currency,
+                )
+                for link in links
+            )
+            request = RequestFactory().get("/payments/dashboard/")
+            request.user = merchant
+
+            uncached = DjangoTemplates({
+                "NAME": "uncached",
+                "DIRS": settings.TEMPLATES[0]["DIRS"],
+                "APP_DIRS": False,
+                "OPTIONS": {**settings.TEMPLATES[0]["OPTIONS"], "loaders": UNCACHED_LOADERS},
+            })
+            no_fragments = {
+                **settings.CACHES,
+                "template_fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            }
+
+            results = []
+            with override_settings(CACHES=no_fragments):
+                results.append(self._run("plain loaders", uncached, merchant, request, options["renders"]))
+                results.append(self._run("cached loader", engines["django"], merchant, request, options["renders"]))
+            results.append(
+                self._run("cached loader + fragments", engines["django"], merchant, request, options["renders"])
+            )
+
+        baseline = results[0]["mean"]
+        for result in results:
+            self.stdout.write(
+                f"{result['name']:<26} mean {result['mean']:7.2f} ms  p95 {result['p95']:7.2f} ms  "
+                f"queries {result['queries']:4.1f}  {baseline / result['mean']:5.1f}x"
+            )
+
+    def _run(self, name, engine, merchant, request, renders):
+        # One unmeasured render warms the loader and fragment caches.
+        engine.get_template(TEMPLATE).render(dashboard_context(merchant), request)
+
+        samples, queries = [], 0
+        for _ in range(renders):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                engine.get_template(TEMPLATE).render(dashboard_context(merchant), request)
+                samples.append((time.perf_counter() - started) * 1000)
+            queries += len(captured)
+
+        samples.sort()
+        return {
+            "name": name,
+            "mean": statistics.fmean(samples),
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "queries": queries / renders,
+        }
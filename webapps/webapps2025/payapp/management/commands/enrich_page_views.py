@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payapp import enrichment
+from payapp.models import PaymentView
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in device type, platform, country and city for page views that "
+        "have not been enriched yet, in bulk_update batches. Reports rows/sec."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many rows.")
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Re-enrich every row, e.g. after installing a newer GeoIP database.",
+        )
+
+    def handle(self, *args, **options):
+        if options["reset"]:
+            marked = PaymentView.objects.filter(enriched=True).update(enriched=False)
+            enrichment.reset()
+            self.stdout.write(f"Marked {marked} page views for re-enrichment.")
+
+        started = time.perf_counter()
+        count = enrichment.enrich_pending(batch_size=options["batch_size"], limit=options["limit"])
+        elapsed = time.perf_counter() - started
+
+        ua_cache = enrichment.parse_user_agent.cache_info()
+        lookups = ua_cache.hits + ua_cache.misses
+        self.stdout.write(
+            f"User-agent cache: {ua_cache.hits}/{lookups} hits, {ua_cache.currsize} entries."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Enriched {count} page views in {elapsed:.2f}s "
+            f"({count / elapsed if elapsed else 0:.0f} rows/sec)."
+        ))
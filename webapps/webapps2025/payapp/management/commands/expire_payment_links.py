@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payapp import expiry
+
+
+class Command(BaseCommand):
+    help = "Mark every overdue PENDING payment link as EXPIRED, in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = expiry.expire_overdue(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Expired {count} payment links."))
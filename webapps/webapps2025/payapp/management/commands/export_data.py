@@ -0,0 +1,63 @@
+import sys
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payapp import exports
+from payapp.db_router import read_alias
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+class Command(BaseCommand):
+    help = "Stream a merchant's transactions, payment links or page views to a CSV/NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(exports.KINDS))
+        parser.add_argument("--merchant", required=True, help="Merchant username.")
+        parser.add_argument("--format", choices=sorted(exports.FORMATS), default="csv")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", "-o", help="File to write (defaults to stdout).")
+        parser.add_argument("--from", dest="date_from", type=_date, help="YYYY-MM-DD, inclusive.")
+        parser.add_argument("--to", dest="date_to", type=_date, help="YYYY-MM-DD, inclusive.")
+        parser.add_argument("--status")
+        parser.add_argument(
+            "--include-raw",
+            action="store_true",
+            help="Include Stripe raw_response payloads (transactions only).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            merchant = get_user_model().objects.get(username=options["merchant"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No merchant called {options['merchant']!r}")
+
+        start = end = None
+        if options["date_from"]:
+            start = timezone.make_aware(datetime.combine(options["date_from"], time.min))
+        if options["date_to"]:
+            end = timezone.make_aware(datetime.combine(options["date_to"] + timedelta(days=1), time.min))
+
+        header, rows = exports.export_rows(
+            options["kind"],
+            merchant,
+            start=start,
+            end=end,
+            status=options["status"],
+            include_raw=options["include_raw"],
+            using=read_alias(),
+        )
+        chunks = exports.stream(header, rows, fmt=options["format"], gzip=options["gzip"])
+
+        out = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options["output"]:
+                out.close()
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from payapp.stripe_stub import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local Stripe stand-in for development, tests and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=12111)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds to sleep before answering each request.",
+        )
+        parser.add_argument("--verbose", action="store_true")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            (options["host"], options["port"]),
+            latency=options["latency"],
+            verbose=options["verbose"],
+        )
+        self.stdout.write(f"Fake Stripe listening on {server.url} (set STRIPE_API_BASE to this)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
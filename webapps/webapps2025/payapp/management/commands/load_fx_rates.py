@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payapp import fx
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace the FX rate table from a local JSON file "
+        '({"base": "GBP", "rates": {"USD": 1.27, ...}}). Defaults to FX["RATES_FILE"].'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="JSON rates file.")
+
+    def handle(self, *args, **options):
+        path = options["path"] or fx.conf()["RATES_FILE"]
+        if not path:
+            raise CommandError("Give a rates file or set FX['RATES_FILE'].")
+        try:
+            count = fx.load(path)
+        except (OSError, KeyError, ValueError) as exc:
+            raise CommandError(f"Could not load {path}: {exc}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {count} rates against {fx.conf()['BASE_CURRENCY']}."
+        ))
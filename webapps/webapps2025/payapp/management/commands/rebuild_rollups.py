@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from payapp import rollups
+
+
+class Command(BaseCommand):
+    help = "Backfill or rebuild the analytics rollup tables from raw PaymentView/Transaction rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--merchant",
+            action="append",
+            dest="merchants",
+            help="Username of a merchant to rebuild (repeatable). Defaults to every merchant.",
+        )
+
+    def handle(self, *args, **options):
+        merchants = get_user_model().objects.filter(payment_requests__isnull=False).distinct()
+        if options["merchants"]:
+            merchants = get_user_model().objects.filter(username__in=options["merchants"])
+
+        for merchant in merchants.order_by("pk").iterator():
+            rows = rollups.rebuild(merchant.pk)
+            self.stdout.write(f"{merchant.username}: {rows} link-day rows")
+
+        self.stdout.write(self.style.SUCCESS("Rollups rebuilt."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from payapp import webhooks
+
+
+class Command(BaseCommand):
+    help = "Show webhook inbox lag, drain due events without Celery, or requeue dead events."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--process",
+            action="store_true",
+            help="Process every due event in this process.",
+        )
+        parser.add_argument(
+            "--requeue-dead",
+            nargs="*",
+            metavar="EVENT_ID",
+            help="Move dead events (all, or the given Stripe event ids) back to pending.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_dead"] is not None:
+            count = webhooks.requeue_dead(options["requeue_dead"])
+            self.stdout.write(f"Requeued {count} dead events.")
+
+        if options["process"]:
+            handled = sum(webhooks.process_pending(key) for key in webhooks.due_ordering_keys())
+            self.stdout.write(f"Processed {handled} events.")
+
+        stats = webhooks.inbox_stats()
+        self.stdout.write(
+            f"pending={stats['pending']} retrying={stats['retrying']} "
+            f"dead={stats['dead']} lag={stats['lag_seconds']:.1f}s"
+        )
@@ -0,0 +1,212 @@
+"""
+In-process request metrics, exposed in Prometheus text format.
+
+payapp.middleware.InstrumentationMiddleware opens a RequestTimings for
+every request; database queries (via an execute wrapper installed on each
+connection) and Stripe API calls (via the HTTP clients in
+payapp.stripe_client) add to it. When the response is ready the figures
+go into per-view histograms, rendered by `render()` for the /metrics view.
+
+Recording a request is a few dict lookups under one lock, cheap enough to
+leave on in production. Figures are per process: with several gunicorn
+workers behind one port a scrape only sees the worker that answered it,
+so give each worker its own scrape target (or run one worker per
+container) where exact counts matter.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+DEFAULTS = {
+    "ENABLED": True,
+    "SERVER_TIMING": True,
+    # Bearer token required by /metrics; without one it is only served with DEBUG on.
+    "TOKEN": "",
+}
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "PAYAPP_METRICS", {})}
+
+
+# ─────────────────────────────────────
+# Per-request timings
+# ─────────────────────────────────────
+class RequestTimings:
+    __slots__ = ("db_time", "db_queries", "stripe_time", "stripe_calls")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.stripe_time = 0.0
+        self.stripe_calls = 0
+
+
+_current = ContextVar("payapp_request_timings", default=None)
+
+
+def start_request():
+    """Begin collecting timings for this request; returns (timings, reset token)."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """Connection execute wrapper that charges query time to the current request."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_time += time.perf_counter() - started
+        timings.db_queries += 1
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    """connection_created receiver."""
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+@contextmanager
+def stripe_call():
+    timings = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.stripe_time += time.perf_counter() - started
+            timings.stripe_calls += 1
+
+
+# ─────────────────────────────────────
+# Registry
+# ─────────────────────────────────────
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [bucket counts..., +Inf count, sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", _number(bound)),), cumulative
+            yield f"{self.name}_sum", labels, series[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.series.items():
+            yield self.name, labels, value
+
+
+_lock = threading.Lock()
+
+REQUESTS = Counter("payapp_http_requests_total", "Responses by view, method and status code.")
+DURATION = Histogram("payapp_http_request_duration_seconds", "Wall time spent in Django per request.", SECONDS_BUCKETS)
+DB_DURATION = Histogram("payapp_db_duration_seconds", "Database time per request.", SECONDS_BUCKETS)
+DB_QUERIES = Histogram("payapp_db_queries", "Database queries per request.", QUERY_BUCKETS)
+STRIPE_DURATION = Histogram("payapp_stripe_duration_seconds", "Stripe API time per request.", SECONDS_BUCKETS)
+RESPONSE_SIZE = Histogram("payapp_http_response_size_bytes", "Response body size (non-streaming).", BYTES_BUCKETS)
+RATE_LIMITED = Counter("payapp_rate_limited_total", "Pay POSTs shed by payapp.ratelimit, by limit scope.")
+
+METRICS = (REQUESTS, DURATION, DB_DURATION, DB_QUERIES, STRIPE_DURATION, RESPONSE_SIZE, RATE_LIMITED)
+
+
+def record(view, method, status, wall, timings, size=None):
+    labels = (("view", view),)
+    with _lock:
+        REQUESTS.inc(labels + (("method", method), ("status", str(status))))
+        DURATION.observe(labels, wall)
+        DB_DURATION.observe(labels, timings.db_time)
+        DB_QUERIES.observe(labels, timings.db_queries)
+        if timings.stripe_calls:
+            STRIPE_DURATION.observe(labels, timings.stripe_time)
+        if size is not None:
+            RESPONSE_SIZE.observe(labels, size)
+
+
+def record_rate_limited(scope):
+    with _lock:
+        RATE_LIMITED.inc((("scope", scope),))
+
+
+def reset():
+    with _lock:
+        for metric in METRICS:
+            metric.series.clear()
+
+
+# ─────────────────────────────────────
+# Exposition
+# ─────────────────────────────────────
+def _number(value):
+    if value == "+Inf":
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _line(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+        return f"{name}{{{rendered}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+def render(gauges=()):
+    """
+    Prometheus text exposition of all metrics, plus `gauges`: an iterable
+    of (name, help, value) for point-in-time figures computed at scrape time.
+    """
+    lines = []
+    with _lock:
+        for metric in METRICS:
+            kind = "counter" if isinstance(metric, Counter) else "histogram"
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+            lines.extend(_line(*sample) for sample in metric.samples())
+    for name, help, value in gauges:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(_line(name, (), value))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,101 @@
+"""
+Request instrumentation (see payapp.metrics) and static file serving.
+
+Put InstrumentationMiddleware first in MIDDLEWARE so its wall time covers
+the rest of the stack. Works under WSGI and ASGI: the timings live in a
+ContextVar, which sync_to_async carries into the threads that run ORM
+queries for async views.
+
+StaticFilesMiddleware is whitenoise's middleware made async-capable. The
+stock one is sync-only, which under ASGI would push every request (async
+views, SSE streams) through a thread just to miss the static file lookup.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.conf = metrics.conf()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.conf["ENABLED"]:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        timings, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self._finish(request, response, time.perf_counter() - started, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self.conf["ENABLED"]:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        timings, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self._finish(request, response, time.perf_counter() - started, timings)
+        return response
+
+    def _finish(self, request, response, wall, timings):
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        # Streaming bodies are produced after we return; their size is unknown here.
+        size = None if response.streaming else len(response.content)
+        metrics.record(view, request.method, response.status_code, wall, timings, size)
+
+        if self.conf["SERVER_TIMING"]:
+            parts = [
+                f"app;dur={wall * 1000:.1f}",
+                f'db;dur={timings.db_time * 1000:.1f};desc="{timings.db_queries} queries"',
+            ]
+            if timings.stripe_calls:
+                parts.append(f'stripe;dur={timings.stripe_time * 1000:.1f};desc="{timings.stripe_calls} calls"')
+            response["Server-Timing"] = ", ".join(parts)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Walks the finders' directories; keep that off the event loop.
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            # Opens the file.
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
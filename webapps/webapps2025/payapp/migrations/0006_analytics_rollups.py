@@ -0,0 +1,68 @@
+# Generated by Django 5.2 on 2026-10-17 20:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0005_paymentconversion_paymentview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('conversions', models.PositiveIntegerField(default=0)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('amount_collected', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('day', models.DateField()),
+                ('payment_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='payapp.paymentrequest')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('payment_request', 'day'), name='payapp_linkdailystats_unique_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MerchantDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('conversions', models.PositiveIntegerField(default=0)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('amount_collected', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('links_created', models.PositiveIntegerField(default=0)),
+                ('amount_requested', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('merchant', 'day', 'currency'), name='payapp_merchantdailystats_unique_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MerchantStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('conversions', models.PositiveIntegerField(default=0)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('amount_collected', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('currency', models.CharField(max_length=3)),
+                ('links_created', models.PositiveIntegerField(default=0)),
+                ('amount_requested', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('merchant', 'currency'), name='payapp_merchantstats_unique_currency')],
+            },
+        ),
+    ]
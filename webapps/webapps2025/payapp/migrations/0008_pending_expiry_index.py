@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-17 20:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0007_webhook_inbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(condition=models.Q(('status', 'PENDING')), fields=['expires_at'], name='payapp_pr_pending_expiry_idx'),
+        ),
+    ]
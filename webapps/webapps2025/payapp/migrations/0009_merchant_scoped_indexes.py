@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-17 20:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_transaction_merchant(apps, schema_editor):
+    Transaction = apps.get_model("payapp", "Transaction")
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    Transaction.objects.filter(merchant__isnull=True, payment_request__isnull=False).update(
+        merchant_id=Subquery(
+            PaymentRequest.objects
+            .filter(pk=OuterRef("payment_request_id"))
+            .values("merchant_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0008_pending_expiry_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='merchant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='merchant_transactions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_transaction_merchant, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='paymentconversion',
+            index=models.Index(fields=['payment_request', 'timestamp'], name='payapp_conv_link_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(fields=['merchant', '-created_at'], name='payapp_pr_merchant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentview',
+            index=models.Index(fields=['payment_request', 'timestamp'], name='payapp_view_link_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['merchant', '-created_at'], name='payapp_txn_merchant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['merchant', 'status', 'created_at'], name='payapp_txn_merchant_status'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-17 20:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0009_merchant_scoped_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentrequest',
+            name='payapp_pr_merchant_created',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='payapp_txn_merchant_created',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='payapp_txn_merchant_status',
+        ),
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(fields=['merchant', '-created_at', '-id'], name='payapp_pr_merchant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentrequest',
+            index=models.Index(fields=['merchant', 'status', '-created_at', '-id'], name='payapp_pr_merchant_status'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['merchant', '-created_at', '-id'], name='payapp_txn_merchant_created'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['merchant', 'status', '-created_at', '-id'], name='payapp_txn_merchant_status'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-17 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkdailystats',
+            name='payers_sketch',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='linkdailystats',
+            name='visitors_sketch',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='merchantdailystats',
+            name='payers_sketch',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='merchantdailystats',
+            name='visitors_sketch',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentconversion',
+            name='visitor',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
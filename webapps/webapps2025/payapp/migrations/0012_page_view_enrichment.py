@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-17 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0011_visitor_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentview',
+            name='enriched',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='paymentview',
+            index=models.Index(condition=models.Q(('enriched', False)), fields=['id'], name='payapp_view_unenriched_idx'),
+        ),
+    ]
@@ -0,0 +1,144 @@
+# Generated by Django 5.2 on 2026-10-17 21:17
+
+from datetime import date, datetime, time, timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# Monthly range partitions for the raw analytics tables on PostgreSQL;
+# other databases keep plain tables. payapp.retention creates later months
+# and drops expired ones.
+PARTITIONED = [
+    ("payapp_paymentview", "timestamp"),
+    ("payapp_paymentconversion", "timestamp"),
+]
+MONTHS_AHEAD = 3
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _partition_by_month(cursor, quote, table, column):
+    """
+    Rebuild `table` as a table partitioned by month on `column`: same
+    columns, defaults, indexes and foreign keys, with the primary key
+    widened to (id, column) as PostgreSQL requires. Existing rows are
+    copied into monthly partitions, so this takes a while on big tables.
+    """
+    old = f"{table}_unpartitioned"
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'f', 'c')",
+        [table],
+    )
+    constraints = cursor.fetchall()
+    primary_key = next(name for name, kind, _ in constraints if kind == "p")
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+        [table, primary_key],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(f"SELECT min({quote(column)}) FROM {quote(table)}")
+    oldest = cursor.fetchone()[0]
+
+    # Free the table, index and primary key names for the new table.
+    cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}")
+    cursor.execute(f"ALTER TABLE {quote(old)} RENAME CONSTRAINT {quote(primary_key)} TO {quote(primary_key + '_old')}")
+    for name, _ in indexes:
+        cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(name + '_old')}")
+
+    cursor.execute(
+        f"CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING IDENTITY) "
+        f"PARTITION BY RANGE ({quote(column)})"
+    )
+    cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (id, {quote(column)})")
+    for name, kind, definition in constraints:
+        if kind != "p":
+            cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+    for _, definition in indexes:
+        cursor.execute(definition)
+
+    cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(table)} DEFAULT")
+    month = timezone.localdate(oldest).replace(day=1) if oldest else date.today().replace(day=1)
+    last = date.today().replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        cursor.execute(
+            f"CREATE TABLE {quote(f'{table}_p{month:%Y_%m}')} PARTITION OF {quote(table)} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [_aware(month), _aware(_next_month(month))],
+        )
+        month = _next_month(month)
+
+    cursor.execute(f"INSERT INTO {quote(table)} OVERRIDING SYSTEM VALUE SELECT * FROM {quote(old)}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) FROM {quote(table)}",
+        [table],
+    )
+    cursor.execute(f"DROP TABLE {quote(old)}")
+
+
+def partition_event_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        for table, column in PARTITIONED:
+            _partition_by_month(cursor, connection.ops.quote_name, table, column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0012_page_view_enrichment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentViewDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('country', models.CharField(blank=True, max_length=50)),
+                ('device_type', models.CharField(blank=True, max_length=50)),
+                ('platform', models.CharField(blank=True, max_length=50)),
+                ('views', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionArchive',
+            fields=[
+                ('transaction', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='payapp.transaction')),
+                ('raw_response', models.BinaryField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('raw_response__isnull', False)), fields=['created_at'], name='payapp_txn_unarchived_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentviewdaily',
+            name='payment_request',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compacted_views', to='payapp.paymentrequest'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentviewdaily',
+            constraint=models.UniqueConstraint(fields=('payment_request', 'day', 'country', 'device_type', 'platform'), name='payapp_viewdaily_unique'),
+        ),
+        # Not reversed: the partitioned tables keep working unpartitioned code.
+        migrations.RunPython(partition_event_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def backfill_rollups(apps, schema_editor):
+    # 0006 created the rollup tables empty, and the dashboard reads only
+    # from them. Rebuild every merchant with links from the raw rows: the
+    # same code as `manage.py rebuild_rollups`, which is safe to re-run.
+    # It uses the current models, which match the schema at this point.
+    from payapp import rollups
+
+    PaymentRequest = apps.get_model("payapp", "PaymentRequest")
+    merchant_ids = PaymentRequest.objects.order_by("merchant_id").values_list("merchant_id", flat=True).distinct()
+    for merchant_id in merchant_ids:
+        rollups.rebuild(merchant_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payapp', '0017_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
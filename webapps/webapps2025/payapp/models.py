@@ -1,4 +1,7 @@
+import json
 import uuid
+import zlib
+
 from django.conf import settings
 from django.db import models
 from django.utils import timezone
@@ -37,15 +40,28 @@ class PaymentRequest(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
+    # Set by the code paths that change `status`; Last-Modified for payapp.link_status.
+    status_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Merchant link listings, newest first; id breaks ties for keyset pagination
+            models.Index(fields=["merchant", "-created_at", "-id"], name="payapp_pr_merchant_created"),
+            models.Index(fields=["merchant", "status", "-created_at", "-id"], name="payapp_pr_merchant_status"),
+            # Serves the expiry sweeper: status='PENDING' AND expires_at < now
+            models.Index(
+                fields=["expires_at"],
+                condition=models.Q(status="PENDING"),
+                name="payapp_pr_pending_expiry_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.short_code} - {self.amount} {self.currency} ({self.status})"
 
     def is_expired(self) -> bool:
-        return self.expires_at and timezone.now() > self.expires_at
+        return bool(self.expires_at and timezone.now() > self.expires_at)
 
 
 class Transaction(models.Model):
@@ -70,6 +86,16 @@ class Transaction(models.Model):
         blank=True,
     )
 
+    # Copy of payment_request.merchant so merchant-scoped listings can be
+    # served from one index instead of a join plus sort.
+    merchant = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="merchant_transactions",
+        null=True,
+        blank=True,
+    )
+
     payer = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         null=True,
@@ -93,11 +119,51 @@ class Transaction(models.Model):
         indexes = [
             models.Index(fields=["status"]),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["merchant", "-created_at", "-id"], name="payapp_txn_merchant_created"),
+            models.Index(fields=["merchant", "status", "-created_at", "-id"], name="payapp_txn_merchant_status"),
+            # Payloads not yet moved to TransactionArchive (see payapp.retention)
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(raw_response__isnull=False),
+                name="payapp_txn_unarchived_idx",
+            ),
         ]
 
     def __str__(self):
         return f"{self.id} - {self.status} - {self.amount} {self.currency}"
 
+    def get_raw_response(self):
+        """The Stripe payload, from cold storage once payapp.retention has archived it."""
+        if self.raw_response is not None:
+            return self.raw_response
+        archive = TransactionArchive.objects.filter(transaction_id=self.pk).first()
+        return archive.payload() if archive else None
+
+
+class TransactionArchive(models.Model):
+    """
+    Cold storage for Transaction.raw_response: the zlib-compressed JSON,
+    moved here by payapp.retention so the transactions table stays small.
+    No database-level foreign key, so the transactions table can be
+    rewritten or partitioned independently.
+    """
+    transaction = models.OneToOneField(
+        Transaction,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name="archive",
+    )
+    raw_response = models.BinaryField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def payload(self):
+        return json.loads(zlib.decompress(self.raw_response))
+
+    @staticmethod
+    def compress(payload):
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode(), 9)
+
 
 class PaymentView(models.Model):
     """
@@ -121,8 +187,16 @@ class PaymentView(models.Model):
     device_type = models.CharField(max_length=50, blank=True, null=True)  # e.g. mobile / desktop
     platform = models.CharField(max_length=50, blank=True, null=True)    # e.g. iOS / Android / Windows
 
+    # Set once payapp.enrichment has filled in the fields above.
+    enriched = models.BooleanField(default=False)
+
     class Meta:
         ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["payment_request", "timestamp"], name="payapp_view_link_ts_idx"),
+            # The enrichment queue: small, since rows leave it once enriched.
+            models.Index(fields=["id"], condition=models.Q(enriched=False), name="payapp_view_unenriched_idx"),
+        ]
 
     def __str__(self):
         return f"View for {self.payment_request.short_code} at {self.timestamp}"
@@ -140,9 +214,316 @@ class PaymentConversion(models.Model):
     )
     timestamp = models.DateTimeField(default=timezone.now)
     source = models.CharField(max_length=100, blank=True, null=True)  # e.g. 'public_page', 'qr'
+    # payapp.hll.visitor_key() of whoever clicked Pay, so payer sketches can be rebuilt.
+    visitor = models.CharField(max_length=16, blank=True, default="")
 
     class Meta:
         ordering = ["-timestamp"]
+        indexes = [
+            models.Index(fields=["payment_request", "timestamp"], name="payapp_conv_link_ts_idx"),
+        ]
 
     def __str__(self):
         return f"Conversion for {self.payment_request.short_code} at {self.timestamp}"
+
+
+class PaymentViewDaily(models.Model):
+    """
+    Compacted page views: one row per link, day, country, device type and
+    platform, written by payapp.retention when raw PaymentView rows pass
+    their retention period. Unknown values are stored as "".
+    """
+    payment_request = models.ForeignKey(
+        "PaymentRequest",
+        related_name="compacted_views",
+        on_delete=models.CASCADE,
+    )
+    day = models.DateField()
+    country = models.CharField(max_length=50, blank=True)
+    device_type = models.CharField(max_length=50, blank=True)
+    platform = models.CharField(max_length=50, blank=True)
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["payment_request", "day", "country", "device_type", "platform"],
+                name="payapp_viewdaily_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_request_id} on {self.day}: {self.views} views"
+
+
+class RollupCounters(models.Model):
+    """
+    Counters shared by the analytics rollup tables. They are bumped
+    incrementally by payapp.rollups as events arrive and can be rebuilt
+    from the raw rows with `manage.py rebuild_rollups`.
+    """
+    views = models.PositiveIntegerField(default=0)
+    conversions = models.PositiveIntegerField(default=0)
+    payments = models.PositiveIntegerField(default=0)
+    amount_collected = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class VisitorSketches(models.Model):
+    """
+    HyperLogLog sketches (payapp.hll) of the visitors who opened a link and
+    of those who went on to start a payment, merged across rows to count
+    unique visitors over any date range.
+    """
+    visitors_sketch = models.BinaryField(null=True, editable=False)
+    payers_sketch = models.BinaryField(null=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+class LinkDailyStats(RollupCounters, VisitorSketches):
+    """Daily counters for a single payment link."""
+    payment_request = models.ForeignKey(
+        PaymentRequest,
+        related_name="daily_stats",
+        on_delete=models.CASCADE,
+    )
+    day = models.DateField()
+
+    class Meta:
+        ordering = ["-day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["payment_request", "day"],
+                name="payapp_linkdailystats_unique_day",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.payment_request_id} on {self.day}"
+
+
+class MerchantDailyStats(RollupCounters, VisitorSketches):
+    """
+    Daily counters for a merchant, split by link currency so that amounts
+    are never summed across currencies.
+    """
+    merchant = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="daily_stats",
+        on_delete=models.CASCADE,
+    )
+    day = models.DateField()
+    currency = models.CharField(max_length=3)
+    links_created = models.PositiveIntegerField(default=0)
+    amount_requested = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ["-day"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["merchant", "day", "currency"],
+                name="payapp_merchantdailystats_unique_day",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.merchant_id} on {self.day} ({self.currency})"
+
+
+class MerchantStats(RollupCounters):
+    """Lifetime counters for a merchant, one row per currency."""
+    merchant = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="stats",
+        on_delete=models.CASCADE,
+    )
+    currency = models.CharField(max_length=3)
+    links_created = models.PositiveIntegerField(default=0)
+    amount_requested = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["merchant", "currency"],
+                name="payapp_merchantstats_unique_currency",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.merchant_id} ({self.currency})"
+
+
+class FxRate(models.Model):
+    """
+    Units of `currency` per one unit of FX["BASE_CURRENCY"], loaded from a
+    local file by the `load_fx_rates` command (see payapp.fx).
+    """
+    currency = models.CharField(max_length=3, primary_key=True)
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.currency}: {self.rate}"
+
+
+class ReportingPreference(models.Model):
+    """The currency a merchant's dashboard converts its totals into."""
+    merchant = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        related_name="reporting_preference",
+        on_delete=models.CASCADE,
+    )
+    currency = models.CharField(max_length=3, default="GBP")
+
+    def __str__(self):
+        return f"{self.merchant_id}: {self.currency}"
+
+
+class WebhookEvent(models.Model):
+    """
+    Durable inbox of verified Stripe webhook events.
+
+    The webhook view only stores the event and returns 200; Celery workers
+    process it (see payapp.webhooks). Events sharing an ordering_key (the
+    payment link's short_code) are processed strictly in arrival order.
+    """
+    STATUS_PENDING = "PENDING"
+    STATUS_DONE = "DONE"
+    STATUS_DEAD = "DEAD"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_DONE, "Done"),
+        (STATUS_DEAD, "Dead"),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    ordering_key = models.CharField(max_length=64, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["received_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["ordering_key", "status", "received_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} - {self.type} ({self.status})"
+
+
+class ReceiptPreference(models.Model):
+    """How a merchant wants payment receipts: one email per payment, or a periodic digest."""
+    MODE_EACH = "EACH"
+    MODE_DIGEST = "DIGEST"
+
+    MODE_CHOICES = [
+        (MODE_EACH, "One email per payment"),
+        (MODE_DIGEST, "Periodic digest"),
+    ]
+
+    merchant = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        related_name="receipt_preference",
+        on_delete=models.CASCADE,
+    )
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=MODE_EACH)
+
+    def __str__(self):
+        return f"{self.merchant_id}: {self.mode}"
+
+
+class ReceiptEmail(models.Model):
+    """
+    Outbox of merchant receipt emails.
+
+    Written in the same database transaction as the payment it describes;
+    Celery workers send pending rows in batches over one SMTP connection
+    (see payapp.receipts). Digest rows wait for the merchant's next digest.
+    """
+    STATUS_PENDING = "PENDING"
+    STATUS_SENT = "SENT"
+    STATUS_FAILED = "FAILED"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    transaction = models.OneToOneField(
+        Transaction,
+        related_name="receipt_email",
+        on_delete=models.CASCADE,
+    )
+    merchant = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        related_name="receipt_emails",
+        on_delete=models.CASCADE,
+    )
+    to_email = models.EmailField()
+    digest = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The two send queues: only pending rows, in the order they are sent.
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status="PENDING", digest=False),
+                name="payapp_receipt_pending_idx",
+            ),
+            models.Index(
+                fields=["merchant", "created_at"],
+                condition=models.Q(status="PENDING", digest=True),
+                name="payapp_receipt_digest_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Receipt for {self.transaction_id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key and the response its first request got
+    (see payapp.idempotency). `key` and `fingerprint` are SHA-256 digests,
+    and the stored body is zlib-compressed, so rows stay small.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running.
+    status_code = models.PositiveSmallIntegerField(null=True)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    # While in progress, the end of the first request's lease on the key.
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key[:12]}… ({self.status_code or 'in progress'})"
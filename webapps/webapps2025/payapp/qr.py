@@ -0,0 +1,162 @@
+"""
+Content-addressed QR code rendering.
+
+A QR image only depends on the encoded URL and the rendering options, so
+the sha256 of those is both the cache key and the HTTP ETag. Rendered
+images are kept in a bounded in-process LRU and, if QR_CACHE["DIR"] is
+set, in an on-disk tier shared by every worker on the host (which is also
+what makes `prerender()` from a Celery worker useful to the web workers).
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+from django.conf import settings
+
+FORMATS = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+DEFAULT_BOX_SIZE = 10
+MIN_BOX_SIZE = 1
+MAX_BOX_SIZE = 40
+BORDER = 4
+
+DEFAULTS = {
+    "MAX_BYTES": 16 * 1024 * 1024,
+    "DIR": None,
+    "MAX_AGE": 86400,
+}
+
+
+def _conf():
+    return {**DEFAULTS, **getattr(settings, "QR_CACHE", {})}
+
+
+def max_age() -> int:
+    return _conf()["MAX_AGE"]
+
+
+def cache_key(data, fmt="png", box_size=DEFAULT_BOX_SIZE, border=BORDER) -> str:
+    raw = f"{fmt}\0{box_size}\0{border}\0{data}".encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def render(data, fmt="png", box_size=DEFAULT_BOX_SIZE, border=BORDER) -> bytes:
+    """Render a QR code without any caching."""
+    qr = qrcode.QRCode(box_size=box_size, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    buffer = BytesIO()
+    if fmt == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image().save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class QRCache:
+    """LRU of rendered images bounded by total size, with an optional disk tier."""
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key, fmt):
+        return os.path.join(self.directory, key[:2], f"{key}.{fmt}")
+
+    def get(self, key, fmt):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return content
+
+        if self.directory:
+            try:
+                with open(self._path(key, fmt), "rb") as fh:
+                    content = fh.read()
+            except OSError:
+                content = None
+            if content is not None:
+                self._remember(key, content)
+                self.hits += 1
+                return content
+
+        self.misses += 1
+        return None
+
+    def put(self, key, fmt, content):
+        self._remember(key, content)
+        if self.directory:
+            self._write_file(self._path(key, fmt), content)
+
+    def _remember(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    @staticmethod
+    def _write_file(path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(content)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> QRCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                conf = _conf()
+                _cache = QRCache(conf["MAX_BYTES"], conf["DIR"])
+    return _cache
+
+
+def get_qr(data, fmt="png", box_size=DEFAULT_BOX_SIZE, border=BORDER):
+    """Return (key, content) for a QR code, rendering it only on a cache miss."""
+    key = cache_key(data, fmt, box_size, border)
+    cache = get_cache()
+    content = cache.get(key, fmt)
+    if content is None:
+        content = render(data, fmt, box_size, border)
+        cache.put(key, fmt, content)
+    return key, content
+
+
+def prerender(urls, formats=("png",), box_size=DEFAULT_BOX_SIZE):
+    """Warm the cache for a batch of freshly created payment links."""
+    for url in urls:
+        for fmt in formats:
+            get_qr(url, fmt, box_size)
@@ -0,0 +1,283 @@
+"""
+Sliding-window rate limits for the public Pay POST.
+
+Every POST to /pay/<short_code>/ records a conversion and may call
+Stripe, so it is counted against three limits before any of that
+happens: per client IP, per link and per merchant. When one is full the
+view answers 429 with a Retry-After header and does no other work.
+
+Each limit is a sliding-window counter: the count in the current fixed
+window plus the previous window's count weighted by how much of it still
+overlaps the sliding window. Two integers per key, no per-request log.
+
+The client IP is REMOTE_ADDR unless the app sits behind proxies. Behind
+the Heroku router every request comes from the router's address, so set
+either RATE_LIMIT["PROXY_HOPS"] (how many proxies in front of the app
+append to X-Forwarded-For; 1 on Heroku) or RATE_LIMIT["TRUSTED_PROXIES"]
+(their addresses or networks). The client IP is then read from
+X-Forwarded-For, counting from the right, so entries a client put there
+itself are never used.
+
+Backends (RATE_LIMIT["BACKEND"]):
+    "memory" - counters in a dict in each worker process; limits apply
+               per worker, which is enough to stop a single client's
+               retry storm and costs no I/O
+    "cache"  - counters in RATE_LIMIT["CACHE_ALIAS"] (Redis in production),
+               shared by all workers; check-then-increment is not atomic
+               across workers, so bursts can overshoot slightly
+"""
+import ipaddress
+import math
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from . import metrics
+
+DEFAULTS = {
+    "ENABLED": True,
+    "BACKEND": "memory",
+    "CACHE_ALIAS": "default",
+    # scope -> (requests, window in seconds); None turns a scope off.
+    "LIMITS": {
+        "ip": (20, 60),
+        "link": (60, 60),
+        "merchant": (600, 60),
+    },
+    # Keys the memory backend keeps before dropping idle ones.
+    "MAX_KEYS": 100000,
+    # Proxies in front of the app that append to X-Forwarded-For.
+    "PROXY_HOPS": 0,
+    # Or the proxies' addresses / networks, e.g. ["10.0.0.0/8"].
+    "TRUSTED_PROXIES": [],
+}
+
+
+def conf():
+    config = {**DEFAULTS, **getattr(settings, "RATE_LIMIT", {})}
+    config["LIMITS"] = {**DEFAULTS["LIMITS"], **config["LIMITS"]}
+    return config
+
+
+def _retry_after(previous, current, limit, window, elapsed):
+    """Seconds until one more request fits (0 if it fits now)."""
+    if previous * (1 - elapsed / window) + current + 1 <= limit:
+        return 0
+    if current + 1 <= limit:
+        # Fits once enough of the previous window has slid out.
+        wait = window * (1 - (limit - 1 - current) / previous) - elapsed
+    elif current == 0:
+        # A limit below 1 never lets a request through; retry next window.
+        wait = window - elapsed
+    else:
+        # This window is full: wait for it to become the previous one,
+        # then for enough of it to slide out.
+        wait = window - elapsed + window * (1 - (limit - 1) / current)
+    return max(1, math.ceil(wait))
+
+
+# ─────────────────────────────────────
+# Backends
+# ─────────────────────────────────────
+class MemoryBackend:
+    """Per-process counters: key -> [window, window index, previous count, current count]."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _counter(self, key, window, index):
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= self.max_keys:
+                self._evict(time.time())
+            counter = self._counters[key] = [window, index, 0, 0]
+        elif counter[1] != index:
+            # Roll forward; anything older than the previous window counts as 0.
+            counter[2] = counter[3] if counter[1] == index - 1 else 0
+            counter[3] = 0
+            counter[1] = index
+        return counter
+
+    def _evict(self, now):
+        idle = [
+            key for key, (window, index, _, _) in self._counters.items()
+            if index < now // window - 1
+        ]
+        for key in idle:
+            del self._counters[key]
+        if len(self._counters) >= self.max_keys:
+            # Flooded with live keys (e.g. spoofed sources): fail open
+            # rather than grow without bound.
+            self._counters.clear()
+
+    def hit(self, checks, now):
+        with self._lock:
+            counters = []
+            for scope, key, limit, window in checks:
+                counter = self._counter(key, window, int(now // window))
+                wait = _retry_after(counter[2], counter[3], limit, window, now % window)
+                if wait:
+                    return scope, wait
+                counters.append(counter)
+            for counter in counters:
+                counter[3] += 1
+        return None
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class CacheBackend:
+    """Counters shared through a Django cache: one key per limit and fixed window."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def hit(self, checks, now):
+        cache = caches[self.alias]
+        keys = {}
+        for scope, key, limit, window in checks:
+            index = int(now // window)
+            keys[scope] = (f"payapp:rl:{key}:{index - 1}", f"payapp:rl:{key}:{index}")
+        counts = cache.get_many([name for pair in keys.values() for name in pair])
+
+        for scope, key, limit, window in checks:
+            previous, current = (counts.get(name, 0) for name in keys[scope])
+            wait = _retry_after(previous, current, limit, window, now % window)
+            if wait:
+                return scope, wait
+
+        for scope, key, limit, window in checks:
+            name = keys[scope][1]
+            if not cache.add(name, 1, window * 2):
+                try:
+                    cache.incr(name)
+                except ValueError:
+                    # Expired between add() and incr().
+                    cache.set(name, 1, window * 2)
+        return None
+
+    def reset(self):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = conf()
+                if config["BACKEND"] == "cache":
+                    _backend = CacheBackend(config["CACHE_ALIAS"])
+                else:
+                    _backend = MemoryBackend(config["MAX_KEYS"])
+    return _backend
+
+
+def reset():
+    """Forget all counters and re-read the backend setting (tests, benchmarks)."""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.reset()
+        _backend = None
+
+
+# ─────────────────────────────────────
+# Client address
+# ─────────────────────────────────────
+@lru_cache(maxsize=8)
+def _networks(trusted):
+    return tuple(ipaddress.ip_network(network, strict=False) for network in trusted)
+
+
+def _is_trusted(address, networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def client_ip(request, config=None):
+    """The address to rate-limit: REMOTE_ADDR, or X-Forwarded-For behind trusted proxies."""
+    config = config or conf()
+    remote = request.META.get("REMOTE_ADDR") or "unknown"
+    forwarded = [part.strip() for part in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if part.strip()]
+
+    hops = config["PROXY_HOPS"]
+    if hops:
+        # Each of our proxies appended the address it received from.
+        return forwarded[-hops] if len(forwarded) >= hops else remote
+
+    networks = _networks(tuple(config["TRUSTED_PROXIES"]))
+    if networks and _is_trusted(remote, networks):
+        for address in reversed(forwarded):
+            if not _is_trusted(address, networks):
+                return address
+        return forwarded[0] if forwarded else remote
+    return remote
+
+
+# ─────────────────────────────────────
+# Pay POSTs
+# ─────────────────────────────────────
+def _checks(request, payment_request, config):
+    limits = config["LIMITS"]
+    subjects = {
+        "ip": client_ip(request, config),
+        "link": payment_request.short_code,
+        "merchant": payment_request.merchant_id,
+    }
+    return [
+        (scope, f"{scope}:{subject}", *limits[scope])
+        for scope, subject in subjects.items()
+        # A limit of 0 (or less) switches the scope off.
+        if limits.get(scope) and limits[scope][0] > 0
+    ]
+
+
+def _too_many(scope, retry_after):
+    metrics.record_rate_limited(scope)
+    response = HttpResponse(
+        "Too many payment attempts. Please try again shortly.",
+        status=429,
+        content_type="text/plain; charset=utf-8",
+    )
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def check_pay_post(request, payment_request):
+    """Count a Pay POST. Returns a 429 response if it is over a limit, else None."""
+    config = conf()
+    if not config["ENABLED"]:
+        return None
+    shed = get_backend().hit(_checks(request, payment_request, config), time.time())
+    return _too_many(*shed) if shed else None
+
+
+async def acheck_pay_post(request, payment_request):
+    config = conf()
+    if not config["ENABLED"]:
+        return None
+    backend = get_backend()
+    checks = _checks(request, payment_request, config)
+    if isinstance(backend, MemoryBackend):
+        # A dict update under a lock; not worth a thread hop.
+        shed = backend.hit(checks, time.time())
+    else:
+        shed = await sync_to_async(backend.hit)(checks, time.time())
+    return _too_many(*shed) if shed else None
@@ -0,0 +1,252 @@
+"""
+Batched delivery of merchant receipt emails.
+
+The webhook handler only calls `queue()`, which adds a ReceiptEmail row
+to the outbox inside the payment's transaction, so handling a payment
+never waits on SMTP. Celery workers then:
+
+- `send_pending()`: per-payment receipts, in batches of
+  RECEIPT_EMAILS["BATCH_SIZE"], each batch over a single SMTP connection.
+- `send_digests()`: one email per merchant who chose the digest mode
+  (ReceiptPreference), covering every receipt queued since the last one.
+
+Sends share a per-minute budget across workers (RECEIPT_EMAILS["RATE_LIMIT"],
+counted in the cache); whatever does not fit stays queued for the next
+sweep. Failed sends are retried with exponential backoff and marked
+FAILED after RECEIPT_EMAILS["MAX_ATTEMPTS"].
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import ReceiptEmail, ReceiptPreference
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "BATCH_SIZE": 50,
+    # Emails per minute across all workers; 0 means no limit.
+    "RATE_LIMIT": 0,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_BACKOFF": 60,  # seconds, doubled per attempt
+}
+
+RECEIPT_SUBJECT = "VyoPay payment received"
+DIGEST_SUBJECT = "VyoPay payments received"
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "RECEIPT_EMAILS", {})}
+
+
+@lru_cache(maxsize=None)
+def _template(name):
+    # Compiled once per process instead of on every email.
+    return get_template(name)
+
+
+# ─────────────────────────────────────
+# Producer side
+# ─────────────────────────────────────
+def queue(payment_request, txn):
+    """Queue the receipt for a new payment. Call inside the payment's transaction."""
+    to_email = payment_request.merchant.email
+    if not to_email:
+        return None
+
+    digest = ReceiptPreference.objects.filter(
+        merchant_id=payment_request.merchant_id,
+        mode=ReceiptPreference.MODE_DIGEST,
+    ).exists()
+    receipt = ReceiptEmail.objects.create(
+        transaction=txn,
+        merchant_id=payment_request.merchant_id,
+        to_email=to_email,
+        digest=digest,
+    )
+    if not digest:
+        transaction.on_commit(_enqueue)
+    return receipt
+
+
+def _enqueue():
+    from .tasks import send_receipts
+
+    try:
+        send_receipts.delay()
+    except Exception:
+        # The receipt is safe in the outbox; the periodic sweep will send it.
+        logger.exception("Could not enqueue receipt delivery")
+
+
+# ─────────────────────────────────────
+# Rate limit
+# ─────────────────────────────────────
+def _allowance(wanted):
+    """How many of `wanted` emails fit in this minute's shared budget (and claim them)."""
+    limit = conf()["RATE_LIMIT"]
+    if not limit:
+        return wanted
+
+    key = f"payapp:receipts:sent:{int(time.time() // 60)}"
+    cache.add(key, 0, 120)
+    try:
+        used = cache.incr(key, wanted)
+    except ValueError:
+        # Evicted between add() and incr().
+        cache.set(key, wanted, 120)
+        used = wanted
+
+    allowed = max(0, min(wanted, limit - (used - wanted)))
+    if allowed < wanted:
+        cache.decr(key, wanted - allowed)
+    return allowed
+
+
+# ─────────────────────────────────────
+# Consumer side
+# ─────────────────────────────────────
+def _receipt_message(receipt):
+    txn = receipt.transaction
+    payment_request = txn.payment_request
+    message = EmailMultiAlternatives(
+        subject=RECEIPT_SUBJECT,
+        body=f"Payment received via VyoPay: {txn.amount} {txn.currency} for link {payment_request.short_code}.",
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[receipt.to_email],
+    )
+    html = _template("emails/payment_receipt.html").render({"payment": payment_request, "transaction": txn})
+    message.attach_alternative(html, "text/html")
+    return message
+
+
+def _digest_message(receipts):
+    transactions = [receipt.transaction for receipt in receipts]
+    totals = defaultdict(Decimal)
+    for txn in transactions:
+        totals[txn.currency] += txn.amount
+    totals = sorted(totals.items())
+
+    message = EmailMultiAlternatives(
+        subject=DIGEST_SUBJECT,
+        body=f"{len(transactions)} payments received via VyoPay: "
+             + ", ".join(f"{amount} {currency}" for currency, amount in totals) + ".",
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[receipts[-1].to_email],
+    )
+    html = _template("emails/payment_digest.html").render({"transactions": transactions, "totals": totals})
+    message.attach_alternative(html, "text/html")
+    return message
+
+
+def _record_failure(receipts, exc):
+    config = conf()
+    now = timezone.now()
+    for receipt in receipts:
+        receipt.attempts += 1
+        receipt.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+        if receipt.attempts >= config["MAX_ATTEMPTS"]:
+            receipt.status = ReceiptEmail.STATUS_FAILED
+        else:
+            receipt.next_attempt_at = now + timedelta(
+                seconds=config["RETRY_BACKOFF"] * 2 ** (receipt.attempts - 1)
+            )
+
+
+def _deliver(jobs):
+    """
+    Send [(message, receipts)] over one SMTP connection and update the
+    receipts in memory. Returns False if the connection itself failed.
+    """
+    now = timezone.now()
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.exception("Could not connect to the mail server")
+        for _, receipts in jobs:
+            _record_failure(receipts, exc)
+        return False
+
+    try:
+        for message, receipts in jobs:
+            message.connection = connection
+            try:
+                message.send()
+            except Exception as exc:
+                logger.exception("Could not send %s", message.subject)
+                _record_failure(receipts, exc)
+            else:
+                for receipt in receipts:
+                    receipt.status = ReceiptEmail.STATUS_SENT
+                    receipt.attempts += 1
+                    receipt.last_error = ""
+                    receipt.sent_at = now
+    finally:
+        connection.close()
+    return True
+
+
+def _save(receipts):
+    ReceiptEmail.objects.bulk_update(
+        receipts, ["status", "attempts", "last_error", "next_attempt_at", "sent_at"]
+    )
+
+
+def _due(digest):
+    return (
+        ReceiptEmail.objects
+        .select_for_update(skip_locked=True, of=("self",))
+        .filter(status=ReceiptEmail.STATUS_PENDING, digest=digest, next_attempt_at__lte=timezone.now())
+        .select_related("transaction__payment_request")
+    )
+
+
+def send_pending(batch_size=None):
+    """Send due per-payment receipts, one SMTP connection per batch. Returns how many were sent."""
+    batch_size = batch_size or conf()["BATCH_SIZE"]
+    sent = 0
+    while True:
+        # Rows stay locked while their batch is sent, so parallel workers
+        # skip them instead of sending twice.
+        with transaction.atomic():
+            batch = list(_due(digest=False).order_by("next_attempt_at")[:batch_size])
+            batch = batch[:_allowance(len(batch))]
+            if not batch:
+                return sent
+
+            connected = _deliver([(_receipt_message(receipt), [receipt]) for receipt in batch])
+            _save(batch)
+
+        sent += sum(receipt.status == ReceiptEmail.STATUS_SENT for receipt in batch)
+        if not connected or len(batch) < batch_size:
+            return sent
+
+
+def send_digests():
+    """Send every digest merchant one email covering their queued receipts. Returns emails sent."""
+    with transaction.atomic():
+        receipts = list(_due(digest=True).order_by("merchant_id", "created_at"))
+        jobs = [
+            list(merchant_receipts)
+            for _, merchant_receipts in groupby(receipts, key=lambda receipt: receipt.merchant_id)
+        ]
+        jobs = jobs[:_allowance(len(jobs))]
+        if not jobs:
+            return 0
+
+        _deliver([(_digest_message(merchant_receipts), merchant_receipts) for merchant_receipts in jobs])
+        _save([receipt for merchant_receipts in jobs for receipt in merchant_receipts])
+
+    return sum(merchant_receipts[0].status == ReceiptEmail.STATUS_SENT for merchant_receipts in jobs)
@@ -0,0 +1,302 @@
+"""
+Retention for the raw analytics and payment tables.
+
+Runs daily from Celery beat (tasks.apply_retention) or the
+`apply_retention` command:
+
+- Page views older than RETENTION["VIEW_DAYS"] are compacted into
+  PaymentViewDaily (per link, day, country, device type and platform) and
+  deleted. The rollups (payapp.rollups) already hold their daily counts
+  and visitor sketches, so nothing on the dashboard changes.
+- Transaction.raw_response payloads older than RETENTION["RAW_RESPONSE_DAYS"]
+  move to TransactionArchive, zlib-compressed, and are read back on
+  demand (Transaction.get_raw_response, exports).
+- Processed webhook inbox events older than RETENTION["WEBHOOK_EVENT_DAYS"]
+  are deleted; Stripe stops retrying an event after three days.
+
+On PostgreSQL the page view and conversion tables are partitioned by month
+(migration 0013). Partitions are created ahead of time here, and a month
+of page views that is entirely past retention is compacted and then
+detached and dropped as a whole instead of deleted row by row.
+"""
+import logging
+import re
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import enrichment
+from .models import (
+    PaymentConversion,
+    PaymentView,
+    PaymentViewDaily,
+    Transaction,
+    TransactionArchive,
+    WebhookEvent,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "VIEW_DAYS": 90,
+    "RAW_RESPONSE_DAYS": 30,
+    "WEBHOOK_EVENT_DAYS": 30,
+    "CHUNK_SIZE": 1000,
+    "PARTITION_MONTHS_AHEAD": 3,
+}
+
+PARTITIONED = (PaymentView, PaymentConversion)
+DIMENSIONS = ("country", "device_type", "platform")
+
+
+def conf():
+    return {**DEFAULTS, **getattr(settings, "RETENTION", {})}
+
+
+def _cutoff(days, now=None):
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+# ─────────────────────────────────────
+# Monthly partitions (PostgreSQL)
+# ─────────────────────────────────────
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def is_partitioned(model):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [model._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(model):
+    """[(name, first day, first day of the next month)] of a table's monthly partitions, oldest first."""
+    table = model._meta.db_table
+    pattern = re.compile(rf"^{re.escape(table)}_p(\d{{4}})_(\d{{2}})$")
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND pg_table_is_visible(p.oid)",
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    result = []
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            start = date(int(match[1]), int(match[2]), 1)
+            result.append((name, start, _next_month(start)))
+    return sorted(result, key=lambda partition: partition[1])
+
+
+def ensure_partitions(model, months_ahead=None, today=None):
+    """Create the monthly partitions from this month to `months_ahead` months out."""
+    if not is_partitioned(model):
+        return 0
+    months_ahead = conf()["PARTITION_MONTHS_AHEAD"] if months_ahead is None else months_ahead
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    existing = {name for name, _, _ in partitions(model)}
+
+    created = 0
+    start = _month_start(today or timezone.localdate())
+    for _ in range(months_ahead + 1):
+        name = f"{table}_p{start:%Y_%m}"
+        end = _next_month(start)
+        if name not in existing:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} "
+                    f"FOR VALUES FROM (%s) TO (%s)",
+                    [_aware(start), _aware(end)],
+                )
+            created += 1
+        start = end
+    return created
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _drop_partition(model, name):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {quote(model._meta.db_table)} DETACH PARTITION {quote(name)}")
+        cursor.execute(f"DROP TABLE {quote(name)}")
+
+
+# ─────────────────────────────────────
+# Page views
+# ─────────────────────────────────────
+def _compact(queryset):
+    """Add the rows of `queryset` to PaymentViewDaily. Returns how many were counted."""
+    counts = Counter()
+    for row in (
+        queryset
+        .annotate(day=TruncDate("timestamp"))
+        .values("payment_request_id", "day", *DIMENSIONS)
+        .annotate(n=Count("id"))
+        .order_by()
+    ):
+        key = (row["payment_request_id"], row["day"]) + tuple(row[field] or "" for field in DIMENSIONS)
+        counts[key] += row["n"]
+    if not counts:
+        return 0
+
+    existing = {
+        (row.payment_request_id, row.day) + tuple(getattr(row, field) for field in DIMENSIONS): row
+        for row in PaymentViewDaily.objects.filter(
+            payment_request_id__in={key[0] for key in counts},
+            day__in={key[1] for key in counts},
+        )
+    }
+    updated, created = [], []
+    for key, n in counts.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(
+                PaymentViewDaily(
+                    payment_request_id=key[0],
+                    day=key[1],
+                    views=n,
+                    **dict(zip(DIMENSIONS, key[2:])),
+                )
+            )
+        else:
+            row.views += n
+            updated.append(row)
+    PaymentViewDaily.objects.bulk_update(updated, ["views"])
+    PaymentViewDaily.objects.bulk_create(created)
+    return counts.total()
+
+
+def compact_views(days=None, chunk_size=None, now=None):
+    """Compact and delete page views older than `days`. Returns how many raw rows went."""
+    config = conf()
+    cutoff = _cutoff(config["VIEW_DAYS"] if days is None else days, now)
+    chunk_size = chunk_size or config["CHUNK_SIZE"]
+    # Compacted rows keep only what enrichment derived, so enrich first.
+    enrichment.enrich_pending()
+
+    total = 0
+    if is_partitioned(PaymentView):
+        cutoff_day = timezone.localdate(cutoff)
+        for name, start, end in partitions(PaymentView):
+            if end > cutoff_day:
+                break
+            with transaction.atomic():
+                total += _compact(PaymentView.objects.filter(timestamp__gte=_aware(start), timestamp__lt=_aware(end)))
+                _drop_partition(PaymentView, name)
+            logger.info("Compacted and dropped partition %s", name)
+
+    # Whatever is left (a partly expired month, the default partition or an
+    # unpartitioned table) goes in id windows, oldest first. Ids follow
+    # insertion order, which follows timestamps to within the analytics
+    # buffer's flush interval, so the first window with nothing expired
+    # ends the walk without scanning the rest of the table.
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            window = list(
+                PaymentView.objects
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "timestamp")[:chunk_size]
+            )
+            if not any(timestamp < cutoff for _, timestamp in window):
+                break
+            expired = PaymentView.objects.filter(
+                pk__gte=window[0][0],
+                pk__lte=window[-1][0],
+                timestamp__lt=cutoff,
+            )
+            total += _compact(expired)
+            expired.delete()
+        last_pk = window[-1][0]
+
+    return total
+
+
+# ─────────────────────────────────────
+# Stripe payloads and webhook events
+# ─────────────────────────────────────
+def archive_raw_responses(days=None, chunk_size=None, now=None):
+    """Move raw_response payloads older than `days` to TransactionArchive. Returns how many moved."""
+    config = conf()
+    cutoff = _cutoff(config["RAW_RESPONSE_DAYS"] if days is None else days, now)
+    chunk_size = chunk_size or config["CHUNK_SIZE"]
+
+    total = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Transaction.objects
+                .filter(created_at__lt=cutoff, raw_response__isnull=False)
+                .order_by("created_at")
+                .values_list("pk", "raw_response")[:chunk_size]
+            )
+            if not batch:
+                break
+            TransactionArchive.objects.bulk_create(
+                [
+                    TransactionArchive(transaction_id=pk, raw_response=TransactionArchive.compress(payload))
+                    for pk, payload in batch
+                ],
+                ignore_conflicts=True,
+            )
+            Transaction.objects.filter(pk__in=[pk for pk, _ in batch]).update(raw_response=None)
+        total += len(batch)
+        if len(batch) < chunk_size:
+            break
+    return total
+
+
+def purge_webhook_events(days=None, chunk_size=None, now=None):
+    """Delete processed (DONE) inbox events older than `days`; dead ones stay for inspection."""
+    config = conf()
+    cutoff = _cutoff(config["WEBHOOK_EVENT_DAYS"] if days is None else days, now)
+    chunk_size = chunk_size or config["CHUNK_SIZE"]
+
+    total = 0
+    while True:
+        pks = list(
+            WebhookEvent.objects
+            .filter(status=WebhookEvent.STATUS_DONE, processed_at__lt=cutoff)
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            break
+        total += WebhookEvent.objects.filter(pk__in=pks).delete()[0]
+        if len(pks) < chunk_size:
+            break
+    return total
+
+
+def run():
+    """Everything above, with the configured periods. Returns counts per step."""
+    for model in PARTITIONED:
+        ensure_partitions(model)
+    return {
+        "views_compacted": compact_views(),
+        "raw_responses_archived": archive_raw_responses(),
+        "webhook_events_purged": purge_webhook_events(),
+    }
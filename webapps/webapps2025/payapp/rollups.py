@@ -0,0 +1,386 @@
+"""
+Incremental analytics rollups.
+
+Every analytics event (view, conversion, successful payment, link
+creation) bumps three counter rows: the link's day, the merchant's day
+(per currency) and the merchant's lifetime totals (per currency). The
+dashboard reads only these tables, so its cost does not depend on how
+much raw history a merchant has.
+
+The daily rows also carry HyperLogLog sketches (payapp.hll) of the
+visitors who opened a link and of those who started a payment;
+`unique_counts()` merges them for any date range.
+
+`rebuild()` recomputes the rollups from the raw rows; it backs the
+`rebuild_rollups` management command. Page views already compacted by
+payapp.retention count from PaymentViewDaily, and their days keep the
+visitor sketches they had.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import live
+from .hll import HyperLogLog, visitor_key
+from .models import (
+    LinkDailyStats,
+    MerchantDailyStats,
+    MerchantStats,
+    PaymentConversion,
+    PaymentRequest,
+    PaymentView,
+    PaymentViewDaily,
+    Transaction,
+)
+
+LINK_COUNTERS = ("views", "conversions", "payments", "amount_collected")
+SKETCHES = ("visitors_sketch", "payers_sketch")
+
+
+def _bump(model, keys, deltas):
+    """Add `deltas` to the row identified by `keys`, creating the row if needed."""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+            return
+    except IntegrityError:
+        # Somebody else created the row between our UPDATE and INSERT.
+        pass
+    model.objects.filter(**keys).update(**updates)
+
+
+def _apply(link_deltas, link_info):
+    """
+    Apply per-(link, day) deltas to all three rollup levels.
+
+    `link_info` maps payment_request_id -> (merchant_id, currency).
+    """
+    merchant_daily = defaultdict(Counter)
+    merchant_totals = defaultdict(Counter)
+
+    for (link_id, day), deltas in link_deltas.items():
+        if link_id not in link_info:
+            continue
+        merchant_id, currency = link_info[link_id]
+        _bump(
+            LinkDailyStats,
+            {"payment_request_id": link_id, "day": day},
+            {k: v for k, v in deltas.items() if k in LINK_COUNTERS},
+        )
+        merchant_daily[(merchant_id, day, currency)].update(deltas)
+        merchant_totals[(merchant_id, currency)].update(deltas)
+
+    for (merchant_id, day, currency), deltas in merchant_daily.items():
+        _bump(MerchantDailyStats, {"merchant_id": merchant_id, "day": day, "currency": currency}, deltas)
+
+    for (merchant_id, currency), deltas in merchant_totals.items():
+        _bump(MerchantStats, {"merchant_id": merchant_id, "currency": currency}, deltas)
+
+
+def _empty_sketches():
+    return {field: HyperLogLog() for field in SKETCHES}
+
+
+def _merge_into(model, keys, sketches):
+    """Merge in-memory sketches into the stored ones of an existing row."""
+    sketches = {field: sketch for field, sketch in sketches.items() if sketch}
+    if not sketches:
+        return
+    with transaction.atomic():
+        stored = model.objects.select_for_update().filter(**keys).values(*sketches).first()
+        if stored is None:
+            return
+        model.objects.filter(**keys).update(**{
+            field: HyperLogLog.from_bytes(stored[field]).merge(sketch).to_bytes()
+            for field, sketch in sketches.items()
+        })
+
+
+def _apply_sketches(link_sketches, link_info):
+    """Like _apply(), for per-(link, day) sketches; the rows must already exist."""
+    merchant_daily = defaultdict(_empty_sketches)
+
+    for (link_id, day), sketches in sorted(link_sketches.items()):
+        if link_id not in link_info:
+            continue
+        merchant_id, currency = link_info[link_id]
+        _merge_into(LinkDailyStats, {"payment_request_id": link_id, "day": day}, sketches)
+        for field, sketch in sketches.items():
+            merchant_daily[(merchant_id, day, currency)][field].merge(sketch)
+
+    for (merchant_id, day, currency), sketches in sorted(merchant_daily.items()):
+        _merge_into(MerchantDailyStats, {"merchant_id": merchant_id, "day": day, "currency": currency}, sketches)
+
+
+def _link_info(link_ids):
+    return {
+        pk: (merchant_id, currency)
+        for pk, merchant_id, currency in (
+            PaymentRequest.objects
+            .filter(pk__in=link_ids)
+            .values_list("pk", "merchant_id", "currency")
+        )
+    }
+
+
+# ─────────────────────────────────────
+# Incremental updates
+# ─────────────────────────────────────
+def record_events(views, conversions):
+    """Fold a batch of buffered analytics events (see payapp.analytics) into the rollups."""
+    link_deltas = defaultdict(Counter)
+    link_sketches = defaultdict(_empty_sketches)
+    for event in views:
+        key = (event["payment_request_id"], timezone.localdate(event["timestamp"]))
+        link_deltas[key]["views"] += 1
+        link_sketches[key]["visitors_sketch"].add(visitor_key(event.get("ip_address"), event.get("user_agent")))
+    for event in conversions:
+        key = (event["payment_request_id"], timezone.localdate(event["timestamp"]))
+        link_deltas[key]["conversions"] += 1
+        if event.get("visitor"):
+            link_sketches[key]["payers_sketch"].add(event["visitor"])
+
+    if link_deltas:
+        link_info = _link_info({link_id for link_id, _ in link_deltas})
+        _apply(link_deltas, link_info)
+        # After _apply(), which creates any missing rows.
+        _apply_sketches(link_sketches, link_info)
+        _publish_traffic(link_deltas, link_info)
+
+
+def _publish_traffic(link_deltas, link_info):
+    per_merchant = defaultdict(Counter)
+    for (link_id, day), deltas in link_deltas.items():
+        if link_id in link_info:
+            per_merchant[link_info[link_id][0], day].update(deltas)
+    for (merchant_id, day), deltas in per_merchant.items():
+        live.publish(merchant_id, "traffic", {
+            "day": day,
+            "views": deltas["views"],
+            "conversions": deltas["conversions"],
+        })
+
+
+def record_link_created(payment_request):
+    record_links_created([payment_request])
+
+
+def record_links_created(payment_requests):
+    """Count new links: one update per merchant, currency and day, however many links."""
+    merchant_daily = defaultdict(Counter)
+    merchant_totals = defaultdict(Counter)
+    for payment_request in payment_requests:
+        deltas = {"links_created": 1, "amount_requested": Decimal(payment_request.amount)}
+        keys = (payment_request.merchant_id, payment_request.currency)
+        merchant_daily[(*keys, timezone.localdate(payment_request.created_at))].update(deltas)
+        merchant_totals[keys].update(deltas)
+
+    for (merchant_id, currency, day), deltas in merchant_daily.items():
+        _bump(MerchantDailyStats, {"merchant_id": merchant_id, "day": day, "currency": currency}, deltas)
+    for (merchant_id, currency), deltas in merchant_totals.items():
+        _bump(MerchantStats, {"merchant_id": merchant_id, "currency": currency}, deltas)
+
+
+def record_payment(payment_request, amount, when=None):
+    day = timezone.localdate(when or timezone.now())
+    _apply(
+        {(payment_request.pk, day): Counter({"payments": 1, "amount_collected": Decimal(amount)})},
+        {payment_request.pk: (payment_request.merchant_id, payment_request.currency)},
+    )
+
+
+# ─────────────────────────────────────
+# Rebuild from raw rows
+# ─────────────────────────────────────
+def _per_link_day(queryset, date_field, **aggregates):
+    return (
+        queryset
+        .annotate(day=TruncDate(date_field))
+        .values("payment_request_id", "day")
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+
+def _sketches_per_link_day(queryset, columns, key):
+    """
+    Yield ((link_id, day), sketch) from raw rows, one link at a time, so
+    only one link's sketches are held in memory. `key` turns a row's
+    `columns` into the visitor key to add.
+    """
+    rows = queryset.order_by("payment_request_id", "timestamp").values_list(
+        "payment_request_id", "timestamp", *columns,
+    )
+    for link_id, link_rows in groupby(rows.iterator(), key=lambda row: row[0]):
+        sketches = defaultdict(HyperLogLog)
+        for _, timestamp, *values in link_rows:
+            visitor = key(*values)
+            if visitor:
+                sketches[timezone.localdate(timestamp)].add(visitor)
+        for day, sketch in sketches.items():
+            yield (link_id, day), sketch
+
+
+@transaction.atomic
+def rebuild(merchant_id):
+    """Recompute every rollup row for one merchant from the raw tables."""
+    links = PaymentRequest.objects.filter(merchant_id=merchant_id)
+    link_info = {
+        pk: (merchant_id, currency)
+        for pk, currency in links.values_list("pk", "currency")
+    }
+
+    link_deltas = defaultdict(Counter)
+    for row in _per_link_day(
+        PaymentView.objects.filter(payment_request__merchant_id=merchant_id),
+        "timestamp", n=Count("id"),
+    ):
+        link_deltas[(row["payment_request_id"], row["day"])]["views"] += row["n"]
+
+    compacted = {}
+    for row in (
+        PaymentViewDaily.objects
+        .filter(payment_request__merchant_id=merchant_id)
+        .values("payment_request_id", "day")
+        .annotate(n=Sum("views"))
+        .order_by()
+    ):
+        link_deltas[(row["payment_request_id"], row["day"])]["views"] += row["n"]
+        compacted[(row["payment_request_id"], row["day"])] = None
+
+    # The raw views behind these days are gone, so start from the stored
+    # sketches; merging is idempotent, so any raw rows left can go on top.
+    if compacted:
+        for link_id, day, sketch in (
+            LinkDailyStats.objects
+            .filter(payment_request__merchant_id=merchant_id, day__in={day for _, day in compacted})
+            .values_list("payment_request_id", "day", "visitors_sketch")
+        ):
+            if (link_id, day) in compacted:
+                compacted[(link_id, day)] = HyperLogLog.from_bytes(sketch)
+
+    for row in _per_link_day(
+        PaymentConversion.objects.filter(payment_request__merchant_id=merchant_id),
+        "timestamp", n=Count("id"),
+    ):
+        link_deltas[(row["payment_request_id"], row["day"])]["conversions"] += row["n"]
+
+    for row in _per_link_day(
+        Transaction.objects.filter(
+            merchant_id=merchant_id,
+            status=Transaction.STATUS_SUCCESS,
+        ),
+        "created_at", n=Count("id"), amount=Sum("amount"),
+    ):
+        deltas = link_deltas[(row["payment_request_id"], row["day"])]
+        deltas["payments"] += row["n"]
+        deltas["amount_collected"] += row["amount"]
+
+    merchant_daily = defaultdict(Counter)
+    for row in (
+        links
+        .annotate(day=TruncDate("created_at"))
+        .values("day", "currency")
+        .annotate(n=Count("id"), amount=Sum("amount"))
+        .order_by()
+    ):
+        merchant_daily[(row["day"], row["currency"])].update(
+            {"links_created": row["n"], "amount_requested": row["amount"]}
+        )
+
+    for (link_id, day), deltas in link_deltas.items():
+        merchant_daily[(day, link_info[link_id][1])].update(deltas)
+
+    merchant_totals = defaultdict(Counter)
+    for (day, currency), deltas in merchant_daily.items():
+        merchant_totals[currency].update(deltas)
+
+    # Link sketches are stored compressed as soon as they are built; the
+    # merchant's daily ones stay in memory until the end.
+    link_sketches = defaultdict(dict)
+    merchant_sketches = defaultdict(_empty_sketches)
+    for field, queryset, columns, key in (
+        ("visitors_sketch", PaymentView.objects, ("ip_address", "user_agent"), visitor_key),
+        ("payers_sketch", PaymentConversion.objects, ("visitor",), lambda visitor: visitor),
+    ):
+        raw = queryset.filter(payment_request__merchant_id=merchant_id)
+        for (link_id, day), sketch in _sketches_per_link_day(raw, columns, key):
+            if field == "visitors_sketch" and compacted.get((link_id, day)):
+                sketch.merge(compacted.pop((link_id, day)))
+            link_sketches[(link_id, day)][field] = sketch.to_bytes()
+            merchant_sketches[(day, link_info[link_id][1])][field].merge(sketch)
+
+    for (link_id, day), sketch in compacted.items():
+        if sketch:
+            link_sketches[(link_id, day)]["visitors_sketch"] = sketch.to_bytes()
+            merchant_sketches[(day, link_info[link_id][1])]["visitors_sketch"].merge(sketch)
+
+    LinkDailyStats.objects.filter(payment_request__merchant_id=merchant_id).delete()
+    MerchantDailyStats.objects.filter(merchant_id=merchant_id).delete()
+    MerchantStats.objects.filter(merchant_id=merchant_id).delete()
+
+    LinkDailyStats.objects.bulk_create(
+        [
+            LinkDailyStats(
+                payment_request_id=link_id,
+                day=day,
+                **{k: v for k, v in deltas.items() if k in LINK_COUNTERS},
+                **link_sketches.get((link_id, day), {}),
+            )
+            for (link_id, day), deltas in link_deltas.items()
+        ],
+        batch_size=1000,
+    )
+    MerchantDailyStats.objects.bulk_create(
+        [
+            MerchantDailyStats(
+                merchant_id=merchant_id,
+                day=day,
+                currency=currency,
+                **deltas,
+                **{
+                    field: sketch.to_bytes()
+                    for field, sketch in merchant_sketches.get((day, currency), {}).items()
+                    if sketch
+                },
+            )
+            for (day, currency), deltas in merchant_daily.items()
+        ],
+        batch_size=1000,
+    )
+    MerchantStats.objects.bulk_create(
+        [
+            MerchantStats(merchant_id=merchant_id, currency=currency, **deltas)
+            for currency, deltas in merchant_totals.items()
+        ]
+    )
+    return len(link_deltas)
+
+
+# ─────────────────────────────────────
+# Unique visitors
+# ─────────────────────────────────────
+def unique_counts(rows):
+    """
+    Estimated (unique visitors, unique payers) over a queryset of daily
+    rollup rows, e.g. one merchant's MerchantDailyStats for a date range.
+    Each visitor is counted once however many days or links they touched.
+    """
+    visitors, payers = HyperLogLog(), HyperLogLog()
+    for visitors_sketch, payers_sketch in rows.values_list(*SKETCHES):
+        visitors.merge(HyperLogLog.from_bytes(visitors_sketch))
+        payers.merge(HyperLogLog.from_bytes(payers_sketch))
+    return visitors.count(), payers.count()
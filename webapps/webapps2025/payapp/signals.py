@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import checkout, fragments, link_cache, live, metrics
+from .models import PaymentRequest, ReportingPreference, Transaction
+
+# Charge query time to the current request (see payapp.metrics).
+connection_created.connect(metrics.install_db_wrapper, dispatch_uid="payapp.metrics.db")
+
+
+@receiver(post_save, sender=PaymentRequest)
+@receiver(post_delete, sender=PaymentRequest)
+def invalidate_link_cache(sender, instance, **kwargs):
+    # Also clears a negative entry when a new link reuses a probed code.
+    short_code = instance.short_code
+    transaction.on_commit(lambda: link_cache.invalidate(short_code))
+    if instance.status != PaymentRequest.STATUS_PENDING:
+        transaction.on_commit(lambda: checkout.invalidate(short_code))
+
+
+@receiver(post_save, sender=PaymentRequest)
+def publish_link_status(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or "status" in update_fields):
+        live.publish(instance.merchant_id, "link_status", {
+            "short_codes": [instance.short_code],
+            "status": instance.status,
+            "label": instance.get_status_display(),
+        })
+
+
+@receiver(post_save, sender=PaymentRequest)
+@receiver(post_delete, sender=PaymentRequest)
+@receiver(post_save, sender=Transaction)
+@receiver(post_save, sender=ReportingPreference)
+def invalidate_dashboard_fragments(sender, instance, **kwargs):
+    merchant_id = instance.merchant_id
+    transaction.on_commit(lambda: fragments.bump(merchant_id))
@@ -0,0 +1,79 @@
+"""
+Process-wide Stripe client.
+
+Uses a StripeClient with its own RequestsClient instead of the
+module-global default, so every worker thread keeps a pooled keep-alive
+session to the Stripe API. STRIPE_API_BASE redirects it to a local
+stand-in (payapp.stripe_stub) for tests and benchmarks.
+
+The async views (payapp.async_views) use a second client backed by
+httpx.AsyncClient, one per event loop, so a Stripe round trip does not
+hold a worker thread.
+
+Both HTTP clients report their time (retries included) to the request
+metrics in payapp.metrics.
+"""
+import asyncio
+import threading
+import weakref
+
+import stripe
+from django.conf import settings
+
+from . import metrics
+
+_client = None
+_client_lock = threading.Lock()
+
+# httpx connection pools are tied to the loop they were opened on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class _TimedRequestsClient(stripe.RequestsClient):
+    def request_with_retries(self, *args, **kwargs):
+        with metrics.stripe_call():
+            return super().request_with_retries(*args, **kwargs)
+
+
+class _TimedHTTPXClient(stripe.HTTPXClient):
+    async def request_with_retries_async(self, *args, **kwargs):
+        with metrics.stripe_call():
+            return await super().request_with_retries_async(*args, **kwargs)
+
+
+def _build(http_client) -> stripe.StripeClient:
+    base_addresses = {}
+    if settings.STRIPE_API_BASE:
+        base_addresses["api"] = settings.STRIPE_API_BASE
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        base_addresses=base_addresses,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+    )
+
+
+def get_client() -> stripe.StripeClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build(_TimedRequestsClient(timeout=settings.STRIPE_TIMEOUT))
+    return _client
+
+
+def get_async_client() -> stripe.StripeClient:
+    """Client for the `*_async` methods; call it from inside the running loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _build(_TimedHTTPXClient(timeout=settings.STRIPE_TIMEOUT))
+    return client
+
+
+def reset():
+    """Forget the cached clients, e.g. after changing STRIPE_API_BASE."""
+    global _client
+    with _client_lock:
+        _client = None
+        _async_clients.clear()
@@ -0,0 +1,127 @@
+"""
+Minimal local stand-in for the Stripe API.
+
+Implements just enough of /v1/checkout/sessions for the pay flow, with an
+artificial per-request latency, so the checkout path can be exercised and
+benchmarked without network access. Like Stripe, it replays the response
+to a reused Idempotency-Key, and rejects the key if the parameters differ. Point the app at it with
+STRIPE_API_BASE=http://127.0.0.1:<port> (see `manage.py fake_stripe`).
+"""
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def _unflatten(pairs):
+    """Turn Stripe's form encoding (line_items[0][price_data][currency]=gbp) into dicts."""
+    result = {}
+    for key, value in pairs:
+        parts = key.replace("]", "").split("[")
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeStripe/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_{secrets.token_hex(8)}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        params = _unflatten(parse_qsl(self.rfile.read(length).decode()))
+        time.sleep(self.server.latency)
+
+        if self.path != "/v1/checkout/sessions":
+            return self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+        idempotency_key = self.headers.get("Idempotency-Key")
+        with self.server.lock:
+            self.server.requests += 1
+            if idempotency_key and idempotency_key in self.server.idempotent:
+                first_params, session = self.server.idempotent[idempotency_key]
+                if first_params != params:
+                    return self._send(400, {"error": {
+                        "type": "idempotency_error",
+                        "message": "Keys for idempotent requests can only be used with the same parameters "
+                                   "they were first used with.",
+                    }})
+                return self._send(200, session)
+
+            session = self.server.create_session(params)
+            if idempotency_key:
+                self.server.idempotent[idempotency_key] = (params, session)
+        self._send(200, session)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        prefix = "/v1/checkout/sessions/"
+        with self.server.lock:
+            self.server.requests += 1
+            session = self.server.sessions.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if session is None:
+            return self._send(404, {"error": {"type": "invalid_request_error", "message": "No such session"}})
+        self._send(200, session)
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks open many connections at once; the default backlog is 5.
+    request_queue_size = 128
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, verbose=False):
+        super().__init__(address, FakeStripeHandler)
+        self.latency = latency
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.idempotent = {}
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def create_session(self, params):
+        session_id = f"cs_test_{secrets.token_hex(12)}"
+        line_item = params.get("line_items", {}).get("0", {})
+        price_data = line_item.get("price_data", {})
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "status": "open",
+            "mode": params.get("mode", "payment"),
+            "url": f"{self.url}/checkout/{session_id}",
+            "amount_total": int(price_data.get("unit_amount", 0)) * int(line_item.get("quantity", 1)),
+            "currency": price_data.get("currency", "gbp"),
+            "metadata": params.get("metadata", {}),
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "expires_at": int(params.get("expires_at") or time.time() + 24 * 3600),
+            "payment_intent": None,
+        }
+        self.sessions[session_id] = session
+        return session
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="fake-stripe", daemon=True)
+        thread.start()
+        return self
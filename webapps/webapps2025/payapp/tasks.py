@@ -0,0 +1,71 @@
+from celery import shared_task
+
+from . import checkout, enrichment, expiry, idempotency, qr, receipts, retention, webhooks
+from .analytics import deserialize_events, write_events
+
+
+@shared_task(ignore_result=True)
+def ingest_analytics(events):
+    """Bulk-insert a batch of buffered PaymentView / PaymentConversion events."""
+    write_events(deserialize_events(events))
+
+
+@shared_task(ignore_result=True)
+def prerender_qr_codes(urls, formats=("png",)):
+    """Render QR codes for a batch of new links into the shared QR cache."""
+    qr.prerender(urls, formats=formats)
+
+
+@shared_task(ignore_result=True)
+def process_webhook_events(ordering_key):
+    """Drain the webhook inbox for one payment link, oldest event first."""
+    webhooks.process_pending(ordering_key)
+
+
+@shared_task(ignore_result=True)
+def retry_webhook_events():
+    """Periodic sweep: re-dispatch inbox events whose retry time has come."""
+    for ordering_key in webhooks.due_ordering_keys():
+        process_webhook_events.delay(ordering_key)
+
+
+@shared_task(ignore_result=True)
+def prewarm_checkout_session(short_code, success_url, cancel_url):
+    """Create a hot link's Checkout Session before anyone presses Pay."""
+    checkout.prewarm(short_code, success_url, cancel_url)
+
+
+@shared_task(ignore_result=True)
+def expire_payment_links():
+    """Periodic sweep: expire overdue PENDING links in chunked bulk updates."""
+    expiry.expire_overdue()
+
+
+@shared_task(ignore_result=True)
+def enrich_page_views():
+    """Periodic sweep: fill in device, platform and location for new page views."""
+    enrichment.enrich_pending()
+
+
+@shared_task(ignore_result=True)
+def apply_retention():
+    """Daily: compact old page views, archive Stripe payloads, purge processed webhook events."""
+    retention.run()
+
+
+@shared_task(ignore_result=True)
+def purge_idempotency_keys():
+    """Periodic: delete idempotency keys past their TTL."""
+    idempotency.purge_expired()
+
+
+@shared_task(ignore_result=True)
+def send_receipts():
+    """Send queued per-payment receipt emails; also runs periodically to pick up retries."""
+    receipts.send_pending()
+
+
+@shared_task(ignore_result=True)
+def send_receipt_digests():
+    """Periodic: one summary email per merchant in digest mode."""
+    receipts.send_digests()
@@ -1,3 +1,1347 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import importlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    analytics, async_views, bulk_links, checkout, db_router, enrichment, expiry, exports, fx, hll, idempotency,
+    link_cache, link_status, live, metrics, pagination, qr, ratelimit, receipts, retention, rollups, stripe_client,
+    tasks, views, webhooks,
+)
+from .models import (
+    IdempotencyKey,
+    LinkDailyStats,
+    MerchantDailyStats,
+    MerchantStats,
+    PaymentConversion,
+    PaymentRequest,
+    PaymentView,
+    PaymentViewDaily,
+    ReceiptEmail,
+    ReceiptPreference,
+    Transaction,
+    WebhookEvent,
+)
+from .stripe_stub import FakeStripeServer
+
+
+class QueryPlanTests(TestCase):
+    """
+    Query-plan regression suite for the hot, merchant-scoped queries.
+
+    Each test captures EXPLAIN output for a query the app runs on a hot
+    path and fails if the planner falls back to a full table scan (or, for
+    listings, to sorting the merchant's whole history). On PostgreSQL
+    sequential scans are disabled for the transaction, so an empty test
+    table still shows whether a usable index exists.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.merchant = get_user_model().objects.create_user("merchant", "m@example.com", "pw")
+        cls.payment = PaymentRequest.objects.create(
+            merchant=cls.merchant,
+            short_code="abc123",
+            amount="10.00",
+        )
+        cls.now = timezone.now()
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("EXPLAIN " + sql, params)
+                return "\n".join(row[0] for row in cursor.fetchall())
+            if connection.vendor == "sqlite":
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                return "\n".join(row[-1] for row in cursor.fetchall())
+        self.skipTest(f"No plan checks for {connection.vendor}")
+
+    def assertIndexed(self, queryset, sorted_by_index=False):
+        plan = self.explain(queryset)
+        if connection.vendor == "sqlite":
+            full_scans = [
+                line for line in plan.splitlines()
+                if re.search(r"\bSCAN payapp_", line) and "USING COVERING INDEX" not in line
+            ]
+            sorts = "USE TEMP B-TREE FOR ORDER BY" in plan
+        else:
+            full_scans = re.findall(r"Seq Scan on payapp_\w+", plan)
+            sorts = re.search(r"^\s*(->\s*)?Sort\b", plan, re.MULTILINE) is not None
+
+        self.assertFalse(full_scans, f"Full table scan in plan:\n{plan}")
+        if sorted_by_index:
+            self.assertFalse(sorts, f"Plan sorts instead of reading an index in order:\n{plan}")
+
+    def test_public_short_code_lookup(self):
+        self.assertIndexed(
+            PaymentRequest.objects.select_related("merchant").filter(short_code="abc123")
+        )
+
+    def test_dashboard_recent_links(self):
+        self.assertIndexed(
+            PaymentRequest.objects.filter(merchant=self.merchant)[:10],
+            sorted_by_index=True,
+        )
+
+    def test_dashboard_recent_transactions(self):
+        self.assertIndexed(
+            Transaction.objects
+            .filter(merchant=self.merchant)
+            .select_related("payment_request")
+            .order_by("-created_at")[:20],
+            sorted_by_index=True,
+        )
+
+    def test_keyset_pages(self):
+        cursor = pagination.encode_cursor(self.payment)
+        for queryset in (
+            PaymentRequest.objects.filter(merchant=self.merchant),
+            PaymentRequest.objects.filter(merchant=self.merchant, status=PaymentRequest.STATUS_PAID),
+            Transaction.objects.filter(merchant=self.merchant),
+            Transaction.objects.filter(merchant=self.merchant, status=Transaction.STATUS_SUCCESS),
+        ):
+            self.assertIndexed(pagination.page_queryset(queryset), sorted_by_index=True)
+            self.assertIndexed(pagination.page_queryset(queryset, cursor), sorted_by_index=True)
+
+    def test_successful_transactions_in_date_range(self):
+        self.assertIndexed(
+            Transaction.objects.filter(
+                merchant=self.merchant,
+                status=Transaction.STATUS_SUCCESS,
+                created_at__gte=self.now - timedelta(days=7),
+                created_at__lt=self.now,
+            )
+        )
+
+    def test_link_views_in_date_range(self):
+        self.assertIndexed(
+            PaymentView.objects.filter(
+                payment_request=self.payment,
+                timestamp__gte=self.now - timedelta(days=7),
+                timestamp__lt=self.now,
+            )
+        )
+
+    def test_link_conversions_in_date_range(self):
+        self.assertIndexed(
+            PaymentConversion.objects.filter(
+                payment_request=self.payment,
+                timestamp__gte=self.now - timedelta(days=7),
+                timestamp__lt=self.now,
+            )
+        )
+
+    def test_dashboard_rollups(self):
+        self.assertIndexed(
+            MerchantStats.objects
+            .filter(merchant=self.merchant)
+            .values("currency")
+            .annotate(total_amount=Sum("amount_requested"))
+            .order_by("currency"),
+            sorted_by_index=True,
+        )
+        self.assertIndexed(
+            MerchantDailyStats.objects
+            .filter(merchant=self.merchant, day__gte=self.now.date() - timedelta(days=6))
+            .values("day")
+            .annotate(views=Sum("views"))
+            .order_by("day")
+        )
+
+    def test_enrichment_queue(self):
+        self.assertIndexed(
+            PaymentView.objects
+            .filter(enriched=False, pk__gt=0)
+            .order_by("pk")
+            .only("pk", "ip_address", "user_agent")[:1000],
+            sorted_by_index=True,
+        )
+
+    def test_raw_response_archive(self):
+        self.assertIndexed(
+            Transaction.objects
+            .filter(created_at__lt=self.now, raw_response__isnull=False)
+            .order_by("created_at")
+            .values_list("pk", "raw_response")[:1000],
+            sorted_by_index=True,
+        )
+
+    def test_receipt_outbox(self):
+        self.assertIndexed(
+            ReceiptEmail.objects
+            .filter(status=ReceiptEmail.STATUS_PENDING, digest=False, next_attempt_at__lte=self.now)
+            .order_by("next_attempt_at")[:50],
+            sorted_by_index=True,
+        )
+
+    def test_expiry_sweep(self):
+        self.assertIndexed(
+            PaymentRequest.objects
+            .filter(status=PaymentRequest.STATUS_PENDING, expires_at__lt=self.now)
+            .order_by("expires_at")
+            .values_list("pk", "short_code", "merchant_id")[:1000]
+        )
+
+    def test_webhook_inbox(self):
+        self.assertIndexed(
+            WebhookEvent.objects
+            .filter(ordering_key="abc123", status=WebhookEvent.STATUS_PENDING)
+            .order_by("received_at", "pk")[:1]
+        )
+        self.assertIndexed(
+            WebhookEvent.objects
+            .filter(status=WebhookEvent.STATUS_PENDING, next_attempt_at__lte=self.now)
+            .values_list("ordering_key", flat=True)
+            .distinct()
+        )
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = db_router.ReplicaRouter()
+        patcher = mock.patch.dict(settings.DATABASES, {db_router.REPLICA: {}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_stay_on_primary_by_default(self):
+        self.assertIsNone(self.router.db_for_read(PaymentView))
+        self.assertEqual(db_router.read_alias(), db_router.REPLICA)
+
+    def test_replica_reads_route_payapp_models(self):
+        with db_router.replica_reads():
+            self.assertEqual(self.router.db_for_read(PaymentView), db_router.REPLICA)
+            self.assertEqual(self.router.db_for_read(Transaction), db_router.REPLICA)
+            # Sessions and users always come from the primary.
+            self.assertIsNone(self.router.db_for_read(get_user_model()))
+            self.assertEqual(self.router.db_for_write(PaymentRequest), "default")
+        self.assertIsNone(self.router.db_for_read(PaymentView))
+
+    def test_no_replica_configured(self):
+        del settings.DATABASES[db_router.REPLICA]
+        with db_router.replica_reads():
+            self.assertIsNone(self.router.db_for_read(PaymentView))
+        self.assertEqual(db_router.read_alias(), "default")
+
+    def test_replica_is_never_migrated(self):
+        self.assertFalse(self.router.allow_migrate(db_router.REPLICA, "payapp"))
+        self.assertTrue(self.router.allow_migrate("default", "payapp"))
+
+
+class CursorTests(TestCase):
+    def cursor(self, value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+    def test_malformed_cursors(self):
+        for cursor in (
+            "not base64!",
+            self.cursor(["2024-01-01T00:00:00+00:00", "nope"]),
+            self.cursor(["2024-01-01T00:00:00+00:00", 5]),
+            self.cursor(["yesterday", str(uuid.uuid4())]),
+            self.cursor({"created_at": "2024-01-01"}),
+        ):
+            with self.assertRaises(pagination.InvalidCursor):
+                pagination.decode_cursor(cursor)
+
+    def test_tampered_cursor_is_a_form_error(self):
+        merchant = get_user_model().objects.create_user("cursor", "c@example.com", "pw")
+        self.client.force_login(merchant)
+        response = self.client.get(
+            reverse("payapp:payment_list_api"),
+            {"cursor": self.cursor(["2024-01-01T00:00:00+00:00", "nope"])},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"]["cursor"], ["Invalid cursor."])
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def test_estimate_is_close(self):
+        for n in (10, 1000, 50000):
+            estimate = hll.HyperLogLog().update(f"visitor-{i}" for i in range(n)).count()
+            self.assertLess(abs(estimate - n) / n, 0.05, (n, estimate))
+
+    def test_merge_counts_the_union_once(self):
+        monday = hll.HyperLogLog().update(f"visitor-{i}" for i in range(3000))
+        tuesday = hll.HyperLogLog().update(f"visitor-{i}" for i in range(2000, 5000))
+        estimate = monday.merge(tuesday).count()
+        self.assertLess(abs(estimate - 5000) / 5000, 0.05, estimate)
+
+    def test_round_trip(self):
+        sketch = hll.HyperLogLog().update(["a", "b", "c"])
+        stored = sketch.to_bytes()
+        self.assertLess(len(stored), 100)
+        self.assertEqual(hll.HyperLogLog.from_bytes(stored).registers, sketch.registers)
+        self.assertEqual(hll.HyperLogLog.from_bytes(None).count(), 0)
+
+
+class UserAgentParserTests(SimpleTestCase):
+    def test_parse(self):
+        cases = {
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148": ("mobile", "iOS"),
+            "Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15": ("tablet", "iOS"),
+            "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/124.0 Mobile Safari/537.36": ("mobile", "Android"),
+            "Mozilla/5.0 (Linux; Android 13; SM-X710) AppleWebKit/537.36 Chrome/124.0 Safari/537.36": ("tablet", "Android"),
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36": ("desktop", "Windows"),
+            "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Version/17.4 Safari/605.1.15": ("desktop", "macOS"),
+            "Mozilla/5.0 (X11; CrOS x86_64 15633.69.0) AppleWebKit/537.36 Chrome/119.0 Safari/537.36": ("desktop", "ChromeOS"),
+            "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)": ("bot", "Other"),
+            "": (None, None),
+        }
+        for user_agent, expected in cases.items():
+            with self.subTest(user_agent=user_agent):
+                self.assertEqual(enrichment.parse_user_agent(user_agent), expected)
+
+    def test_no_geoip_database(self):
+        with self.settings(ENRICHMENT={"GEOIP_DATABASE": ""}):
+            enrichment.reset()
+            self.assertEqual(enrichment.locate("81.2.69.160"), (None, None))
+        enrichment.reset()
+
+
+def clear_caches():
+    # Fragments are keyed by user pk, which the test database reuses.
+    for alias in ("default", "template_fragments"):
+        caches[alias].clear()
+
+
+class DashboardFragmentTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_new_link_invalidates_cached_fragments(self):
+        merchant = get_user_model().objects.create_user("fragments", "f@example.com", "pw")
+        self.client.force_login(merchant)
+        self.assertNotContains(self.client.get(reverse("payapp:dashboard")), "frag0001")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PaymentRequest.objects.create(merchant=merchant, short_code="frag0001", amount=5)
+
+        self.assertContains(self.client.get(reverse("payapp:dashboard")), "frag0001")
+        with self.assertNumQueries(3):
+            # Session, user and the chart; every fragment comes from the cache.
+            self.client.get(reverse("payapp:dashboard"))
+
+
+class FxTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        fx.reset()
+        self.addCleanup(fx.reset)
+
+    def load(self, data):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fh:
+            json.dump(data, fh)
+        self.addCleanup(os.remove, fh.name)
+        return fx.load(fh.name)
+
+    def test_load_rebases_and_converts(self):
+        # A USD-based file is stored against GBP.
+        self.assertEqual(self.load({"base": "USD", "rates": {"GBP": 0.8, "EUR": 0.9}}), 3)
+        self.assertEqual(fx.rates()["USD"], Decimal("1.25"))
+        self.assertEqual(fx.convert_totals({"gbp": Decimal("10"), "USD": Decimal("12.50")}, "GBP"), Decimal("20.00"))
+        self.assertEqual(fx.convert_totals({"GBP": Decimal("8")}, "EUR"), Decimal("9.00"))
+        self.assertIsNone(fx.convert_totals({"JPY": Decimal("100")}, "GBP"))
+
+    def test_dashboard_totals_per_currency(self):
+        self.load({"base": "GBP", "rates": {"USD": 1.25}})
+        merchant = get_user_model().objects.create_user("fx", "fx@example.com", "pw")
+        for code, currency in (("fx000001", "GBP"), ("fx000002", "USD")):
+            link = PaymentRequest.objects.create(merchant=merchant, short_code=code, amount=10, currency=currency)
+            rollups.record_link_created(link)
+
+        self.client.force_login(merchant)
+        response = self.client.get(reverse("payapp:dashboard"))
+        self.assertContains(response, "10.00 GBP")
+        self.assertContains(response, "10.00 USD")
+        self.assertContains(response, "≈ 18.00 GBP in total.")
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_sliding_window(self):
+        backend = ratelimit.MemoryBackend(max_keys=100)
+        checks = [("ip", "ip:1.2.3.4", 10, 60)]
+        for _ in range(10):
+            self.assertIsNone(backend.hit(checks, 600.0))
+        # Full until enough of the window has slid out: half of it at the
+        # start of the next window, then one request per six seconds.
+        self.assertEqual(backend.hit(checks, 630.0), ("ip", 36))
+        self.assertEqual(backend.hit(checks, 665.0), ("ip", 1))
+        self.assertIsNone(backend.hit(checks, 666.0))
+
+    def test_shed_counts_nothing(self):
+        backend = ratelimit.MemoryBackend(max_keys=100)
+        backend.hit([("link", "link:abc", 1, 60)], 0.0)
+        checks = [("ip", "ip:1.2.3.4", 5, 60), ("link", "link:abc", 1, 60)]
+        self.assertEqual(backend.hit(checks, 1.0)[0], "link")
+        self.assertIsNone(backend.hit(checks[:1], 1.0))
+        self.assertEqual(backend._counters["ip:1.2.3.4"][3], 1)
+
+    def test_pay_post_returns_429(self):
+        link = mock.Mock(short_code="abc123", merchant_id=1)
+        request = RequestFactory().post("/pay/abc123/", REMOTE_ADDR="1.2.3.4")
+        with self.settings(RATE_LIMIT={"LIMITS": {"ip": (2, 60)}}):
+            ratelimit.reset()
+            self.addCleanup(ratelimit.reset)
+            self.assertIsNone(ratelimit.check_pay_post(request, link))
+            self.assertIsNone(ratelimit.check_pay_post(request, link))
+            response = ratelimit.check_pay_post(request, link)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    def test_zero_limit_disables_the_scope(self):
+        link = mock.Mock(short_code="abc123", merchant_id=1)
+        request = RequestFactory().post("/pay/abc123/", REMOTE_ADDR="203.0.113.5")
+        with self.settings(RATE_LIMIT={"LIMITS": {"ip": (0, 60), "link": (0, 60), "merchant": (0, 60)}}):
+            ratelimit.reset()
+            self.addCleanup(ratelimit.reset)
+            for _ in range(3):
+                self.assertIsNone(ratelimit.check_pay_post(request, link))
+        self.assertEqual(ratelimit._retry_after(0, 0, 0, 60, 10), 50)
+
+    def test_client_ip_behind_proxies(self):
+        factory = RequestFactory()
+        spoofed = factory.post("/", REMOTE_ADDR="10.1.2.3", HTTP_X_FORWARDED_FOR="6.6.6.6, 203.0.113.9")
+        direct = factory.post("/", REMOTE_ADDR="198.51.100.1")
+        config = {**ratelimit.conf(), "PROXY_HOPS": 0, "TRUSTED_PROXIES": []}
+
+        self.assertEqual(ratelimit.client_ip(spoofed, config), "10.1.2.3")
+        # One proxy (the Heroku router): the entry it appended, not the client's own.
+        self.assertEqual(ratelimit.client_ip(spoofed, {**config, "PROXY_HOPS": 1}), "203.0.113.9")
+        self.assertEqual(ratelimit.client_ip(direct, {**config, "PROXY_HOPS": 1}), "198.51.100.1")
+        trusted = {**config, "TRUSTED_PROXIES": ["10.0.0.0/8"]}
+        self.assertEqual(ratelimit.client_ip(spoofed, trusted), "203.0.113.9")
+        self.assertEqual(ratelimit.client_ip(direct, trusted), "198.51.100.1")
+
+    def test_payers_behind_one_router_get_their_own_limit(self):
+        link = mock.Mock(short_code="abc123", merchant_id=1)
+        factory = RequestFactory()
+        with self.settings(RATE_LIMIT={"LIMITS": {"ip": (1, 60)}, "PROXY_HOPS": 1}):
+            ratelimit.reset()
+            self.addCleanup(ratelimit.reset)
+            for client in ("203.0.113.1", "203.0.113.2"):
+                request = factory.post("/pay/abc123/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR=client)
+                self.assertIsNone(ratelimit.check_pay_post(request, link))
+            self.assertEqual(ratelimit.check_pay_post(request, link).status_code, 429)
+
+
+class BulkLinkTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.merchant = get_user_model().objects.create_user("bulk", "bulk@example.com", "pw")
+        self.client.force_login(self.merchant)
+        self.url = reverse("payapp:payment_bulk_create_api")
+
+    def test_json_upload(self):
+        rows = [{"amount": "12.50", "currency": "eur", "description": "Invoice 1"}, {"amount": "3"}]
+        response = self.client.post(self.url, json.dumps(rows), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        results = response.json()["results"]
+        self.assertEqual([(r["amount"], r["currency"]) for r in results], [("12.50", "EUR"), ("3.00", "GBP")])
+        self.assertEqual(PaymentRequest.objects.filter(merchant=self.merchant).count(), 2)
+        self.assertEqual(
+            MerchantStats.objects.filter(merchant=self.merchant).aggregate(n=Sum("links_created"))["n"], 2
+        )
+
+    def test_invalid_row_creates_nothing(self):
+        content = "amount,currency\n10,GBP\n-1,GBP\n"
+        response = self.client.post(self.url, content, content_type="text/csv")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["row"] for error in response.json()["errors"]["rows"]], [2])
+        self.assertFalse(PaymentRequest.objects.exists())
+
+    def test_allocation_skips_taken_codes(self):
+        PaymentRequest.objects.create(merchant=self.merchant, short_code="taken001", amount=1)
+        codes = iter(["taken001", "taken001", "fresh001", "fresh002"])
+        with mock.patch.object(bulk_links, "generate_short_code", lambda: next(codes)):
+            self.assertEqual(sorted(bulk_links.allocate_short_codes(2)), ["fresh001", "fresh002"])
+
+
+class LiveUpdateTests(TestCase):
+    def test_stream_delivers_events_and_heartbeats(self):
+        async def listen():
+            events = live.stream(42)
+            self.assertEqual(await anext(events), "retry: 3000\n\n")
+            # Published from another thread, as the webhook task would.
+            await sync_to_async(live.publish, thread_sensitive=False)(42, "payment", {"amount": Decimal("5.00")})
+            await sync_to_async(live.publish, thread_sensitive=False)(43, "payment", {"amount": Decimal("9.00")})
+            self.assertEqual(await anext(events), 'event: payment\ndata: {"amount": "5.00"}\n\n')
+            self.assertEqual(await anext(events), ": keep-alive\n\n")
+            self.assertEqual(live.hub.count(), 1)
+            await events.aclose()
+
+        with self.settings(LIVE_UPDATES={"BACKEND": "memory", "HEARTBEAT": 0.05}):
+            asyncio.run(listen())
+        self.assertEqual(live.hub.count(), 0)
+
+    def test_publish_waits_for_commit(self):
+        with mock.patch.object(live, "_send") as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                live.publish(42, "traffic", {"views": 1})
+                send.assert_not_called()
+        send.assert_called_once_with(42, 'event: traffic\ndata: {"views": 1}\n\n')
+
+    def test_events_view(self):
+        url = reverse("payapp:dashboard_events")
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        merchant = get_user_model().objects.create_user("live", "live@example.com", "pw")
+        self.client.force_login(merchant)
+        response = self.client.get(url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+
+class PaymentStatusTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        caches["links"].clear()
+        merchant = get_user_model().objects.create_user("status", "status@example.com", "pw")
+        self.link = PaymentRequest.objects.create(merchant=merchant, short_code="stat0001", amount="7.50")
+        self.url = reverse("payapp:payment_status", args=["stat0001"])
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["status"], "PENDING")
+        self.assertIn("Last-Modified", response)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.link.status = PaymentRequest.STATUS_PAID
+            self.link.status_changed_at = timezone.now() + timedelta(seconds=1)
+            self.link.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["paid"])
+
+    def test_expired_link_reports_its_label(self):
+        PaymentRequest.objects.filter(pk=self.link.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        data = self.client.get(self.url).json()
+        self.assertEqual((data["status"], data["label"], data["paid"]), ("EXPIRED", "Expired", False))
+
+    def test_long_poll_wakes_on_update(self):
+        pending = link_cache.get_snapshot("stat0001")
+        paid = link_cache.PaymentSnapshot({
+            **vars(pending), "status": PaymentRequest.STATUS_PAID, "status_changed_at": timezone.now(),
+        })
+        request = RequestFactory().get(self.url, {"wait": "5"}, HTTP_IF_NONE_MATCH=link_status.state(pending)[1])
+
+        async def poll():
+            loop = asyncio.get_running_loop()
+            loop.call_later(0.05, live.hub.dispatch, pending.merchant_id, "update")
+            started = loop.time()
+            response = await link_status.aget_response(request, "stat0001")
+            return response, loop.time() - started
+
+        snapshots = mock.AsyncMock(side_effect=[pending, paid])
+        with mock.patch.object(link_cache, "aget_snapshot_or_404", snapshots):
+            response, elapsed = asyncio.run(poll())
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 1)
+
+    def test_success_page_finds_link_by_session(self):
+        caches["default"].set(checkout._session_key("cs_test_1"), "stat0001")
+        response = self.client.get(reverse("payapp:payment_success"), {"session_id": "cs_test_1"})
+        self.assertContains(response, "7.50 GBP")
+        self.assertContains(response, self.url)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.merchant = get_user_model().objects.create_user("idem", "idem@example.com", "pw")
+        self.client.force_login(self.merchant)
+
+    def test_api_retry_replays_response(self):
+        url = reverse("payapp:payment_bulk_create_api")
+        body = json.dumps([{"amount": "4.00"}])
+        first = self.client.post(url, body, content_type="application/json", HTTP_IDEMPOTENCY_KEY="k1")
+        replay = self.client.post(url, body, content_type="application/json", HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(replay.status_code, 201)
+        self.assertEqual(replay["Idempotent-Replayed"], "true")
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(PaymentRequest.objects.filter(merchant=self.merchant).count(), 1)
+
+        other = self.client.post(url, json.dumps([{"amount": "5.00"}]), content_type="application/json",
+                                 HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(other.status_code, 422)
+
+    def test_form_resubmission_creates_one_link(self):
+        data = {"amount": "9.99", "currency": "GBP", "expiry_days": 7, "idempotency_key": idempotency.new_key()}
+        first = self.client.post(reverse("payapp:payment_new"), data)
+        second = self.client.post(reverse("payapp:payment_new"), data)
+        self.assertEqual(first.status_code, 302)
+        self.assertEqual(second["Location"], first["Location"])
+        self.assertEqual(PaymentRequest.objects.filter(merchant=self.merchant).count(), 1)
+
+    def test_checkout_key_goes_to_stripe_once(self):
+        PaymentRequest.objects.create(
+            merchant=self.merchant, short_code="idem0001", amount=3, expires_at=timezone.now() + timedelta(days=1),
+        )
+        session_expires = timezone.now() + timedelta(minutes=30)
+        session = {"url": "https://checkout.example.com/c/1", "expires_at": int(session_expires.timestamp())}
+        url = reverse("payapp:public_pay", args=["idem0001"])
+        with mock.patch.object(checkout, "get_session", return_value=session) as get_session, \
+                mock.patch.multiple(analytics, record_view=mock.DEFAULT, record_conversion=mock.DEFAULT):
+            self.client.post(url, {"idempotency_key": "abc"})
+            response = self.client.post(url, {"idempotency_key": "abc"})
+        self.assertEqual(response["Location"], session["url"])
+        get_session.assert_called_once()
+        row = IdempotencyKey.objects.get()
+        self.assertEqual(get_session.call_args.args[3].pk, row.pk)
+        # The redirect is only replayed while the Checkout Session lasts.
+        self.assertLessEqual(row.expires_at, session_expires)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(idempotency.purge_expired(), 1)
+
+    def test_shed_pay_post_claims_no_key(self):
+        PaymentRequest.objects.create(
+            merchant=self.merchant, short_code="idem0002", amount=3, expires_at=timezone.now() + timedelta(days=1),
+        )
+        url = reverse("payapp:public_pay", args=["idem0002"])
+        with mock.patch.object(ratelimit, "check_pay_post", return_value=HttpResponse(status=429)):
+            response = self.client.post(url, {"idempotency_key": "abc"})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_abandoned_claim_is_taken_over_with_its_created_at(self):
+        claimed = idempotency._try_claim("k" * 64, "f")
+        self.assertIs(idempotency._try_claim("k" * 64, "f"), idempotency._BUSY)
+        self.assertEqual(idempotency._try_claim("k" * 64, "g").status_code, 422)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        retaken = idempotency._try_claim("k" * 64, "f")
+        self.assertIsInstance(retaken, IdempotencyKey)
+        self.assertEqual(retaken.created_at, claimed.created_at)
+        self.assertGreater(retaken.expires_at, timezone.now())
+
+
+class StripeStubTests(TestCase):
+    def setUp(self):
+        self.server = FakeStripeServer().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        overrides = self.settings(STRIPE_API_BASE=self.server.url, STRIPE_SECRET_KEY="sk_test_stub")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        stripe_client.reset()
+        self.addCleanup(stripe_client.reset)
+        self.link = PaymentRequest(short_code="stub0001", amount=Decimal("12.50"), currency="GBP")
+
+    def test_retry_under_a_key_replays_the_session(self):
+        claimed = IdempotencyKey(key="k" * 64, created_at=timezone.now() - timedelta(minutes=5))
+        first = checkout.create_session(self.link, "https://x/ok", "https://x/no", claimed)
+        with mock.patch("time.time", return_value=first["expires_at"] - 1800):
+            retry = checkout.create_session(self.link, "https://x/ok", "https://x/no", claimed)
+        self.assertEqual(retry["id"], first["id"])
+        self.assertEqual(len(self.server.sessions), 1)
+
+    def test_reused_key_with_other_params_is_rejected(self):
+        claimed = IdempotencyKey(key="k" * 64, created_at=timezone.now())
+        checkout.create_session(self.link, "https://x/ok", "https://x/no", claimed)
+        claimed.created_at -= timedelta(minutes=1)
+        with self.assertRaises(stripe.IdempotencyError):
+            checkout.create_session(self.link, "https://x/ok", "https://x/no", claimed)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(reverse("payapp:payment_failed"))
+        self.assertRegex(response["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+        exposition = metrics.render()
+        labels = 'view="payapp:payment_failed"'
+        self.assertIn(f'payapp_http_requests_total{{{labels},method="GET",status="200"}} 1', exposition)
+        self.assertIn(f'payapp_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', exposition)
+        self.assertIn(f'payapp_http_request_duration_seconds_count{{{labels}}} 1', exposition)
+        self.assertIn(f'payapp_db_queries_bucket{{{labels},le="0"}} 1', exposition)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("h", "help", (1, 5))
+        for value in (0.5, 3, 3, 9):
+            histogram.observe((), value)
+        self.assertEqual(
+            [(name, labels[-1][1], value) for name, labels, value in histogram.samples() if name == "h_bucket"],
+            [("h_bucket", "1", 1), ("h_bucket", "5", 3), ("h_bucket", "+Inf", 4)],
+        )
+
+    def test_scrape_needs_token(self):
+        url = reverse("payapp:metrics")
+        with self.settings(DEBUG=False, PAYAPP_METRICS={"TOKEN": ""}):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        with self.settings(PAYAPP_METRICS={"TOKEN": "s3cret"}):
+            self.assertEqual(self.client.get(url).status_code, 401)
+            response = self.client.get(url, HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("payapp_webhook_inbox_pending", response.content.decode())
+
+
+class AnalyticsBufferTests(TestCase):
+    def setUp(self):
+        merchant = get_user_model().objects.create_user("buf", "buf@example.com", "pw")
+        self.link = PaymentRequest.objects.create(
+            merchant=merchant, short_code="buf00001", amount=5, expires_at=timezone.now() + timedelta(days=1),
+        )
+        # Flush by hand; no background thread.
+        patcher = mock.patch.object(analytics.AnalyticsBuffer, "_ensure_flusher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flush_writes_in_batches(self):
+        buffer = analytics.AnalyticsBuffer(batch_size=2)
+        for _ in range(3):
+            buffer.add(analytics.VIEW, self.link.pk, ip_address="203.0.113.1")
+        buffer.add(analytics.CONVERSION, self.link.pk, source="public_page", visitor="v1")
+        self.assertEqual(PaymentView.objects.count(), 0)
+
+        with mock.patch.object(analytics, "_bulk_insert", wraps=analytics._bulk_insert) as bulk_insert:
+            self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(bulk_insert.call_count, 2)
+        self.assertEqual(PaymentView.objects.filter(payment_request=self.link).count(), 3)
+        self.assertEqual(PaymentConversion.objects.filter(payment_request=self.link).count(), 1)
+        self.assertEqual((buffer.flushed, len(buffer)), (4, 0))
+
+    def test_overflow_drops_or_flushes(self):
+        dropping = analytics.AnalyticsBuffer(max_size=1)
+        self.assertTrue(dropping.add(analytics.VIEW, self.link.pk))
+        self.assertFalse(dropping.add(analytics.VIEW, self.link.pk))
+        self.assertEqual((dropping.dropped, len(dropping)), (1, 1))
+
+        flushing = analytics.AnalyticsBuffer(max_size=1, overflow="flush")
+        self.assertTrue(flushing.add(analytics.VIEW, self.link.pk))
+        self.assertTrue(flushing.add(analytics.VIEW, self.link.pk))
+        # The second add wrote the first event itself.
+        self.assertEqual((PaymentView.objects.count(), len(flushing)), (1, 1))
+
+    def test_events_survive_the_celery_round_trip(self):
+        event = {"kind": analytics.VIEW, "payment_request_id": self.link.pk, "timestamp": timezone.now()}
+        restored = analytics.deserialize_events(json.loads(json.dumps(analytics.serialize_events([event]))))
+        self.assertEqual(restored, [event])
+
+
+class AnalyticsFallbackTests(TransactionTestCase):
+    def test_celery_flush_keeps_events_of_links_that_still_exist(self):
+        merchant = get_user_model().objects.create_user("fall", "fall@example.com", "pw")
+        link = PaymentRequest.objects.create(
+            merchant=merchant, short_code="fall0001", amount=5, expires_at=timezone.now() + timedelta(days=1),
+        )
+        buffer = analytics.AnalyticsBuffer(backend="celery")
+        with mock.patch.object(analytics.AnalyticsBuffer, "_ensure_flusher"):
+            buffer.add(analytics.VIEW, link.pk)
+            # A link deleted while its events sat in the buffer.
+            buffer.add(analytics.VIEW, uuid.uuid4())
+
+        # Eager Celery: serialized, deserialized, then the IntegrityError fallback.
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(list(PaymentView.objects.values_list("payment_request_id", flat=True)), [link.pk])
+        self.assertEqual(buffer.dropped, 0)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.merchant = get_user_model().objects.create_user("roll", "roll@example.com", "pw")
+        self.links = [
+            PaymentRequest.objects.create(merchant=self.merchant, short_code=code, amount=10, currency=currency)
+            for code, currency in (("roll0001", "GBP"), ("roll0002", "GBP"), ("roll0003", "EUR"))
+        ]
+        rollups.record_links_created(self.links)
+
+    def rollup_rows(self):
+        return (
+            sorted(LinkDailyStats.objects.values_list("payment_request__short_code", "day", *rollups.LINK_COUNTERS)),
+            sorted(MerchantDailyStats.objects.values_list(
+                "day", "currency", "views", "conversions", "payments", "amount_collected",
+                "links_created", "amount_requested",
+            )),
+            sorted(MerchantStats.objects.values_list(
+                "currency", "views", "conversions", "payments", "amount_collected", "links_created",
+            )),
+            rollups.unique_counts(MerchantDailyStats.objects.filter(merchant=self.merchant)),
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        noon = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        events = []
+        for days_ago in (0, 1):
+            for n, link in enumerate(self.links):
+                for visitor in range(n + 2):
+                    events.append({
+                        "kind": analytics.VIEW, "payment_request_id": link.pk,
+                        "timestamp": noon - timedelta(days=days_ago, minutes=visitor),
+                        "ip_address": f"203.0.113.{visitor}", "user_agent": "ua",
+                    })
+                events.append({
+                    "kind": analytics.CONVERSION, "payment_request_id": link.pk,
+                    "timestamp": noon - timedelta(days=days_ago), "source": "public_page", "visitor": f"v{n}",
+                })
+        # In several batches, as the buffer flushes them.
+        for start in range(0, len(events), 5):
+            analytics.write_events(events[start:start + 5])
+
+        paid = Transaction.objects.create(
+            payment_request=self.links[0], merchant=self.merchant, amount=10, status=Transaction.STATUS_SUCCESS,
+        )
+        rollups.record_payment(self.links[0], paid.amount, paid.created_at)
+
+        incremental = self.rollup_rows()
+        self.assertEqual(incremental[2], [("EUR", 8, 2, 0, 0, 1), ("GBP", 10, 4, 1, Decimal("10.00"), 2)])
+        self.assertEqual(rollups.rebuild(self.merchant.pk), 6)
+        self.assertEqual(self.rollup_rows(), incremental)
+
+
+class LinkCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.merchant = get_user_model().objects.create_user("cache", "cache@example.com", "pw")
+
+    def create(self, short_code, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return PaymentRequest.objects.create(merchant=self.merchant, short_code=short_code, amount=4, **fields)
+
+    def test_save_invalidates_snapshot(self):
+        link = self.create("lc000001", description="Old")
+        self.assertEqual(link_cache.get_snapshot("lc000001").description, "Old")
+        with self.assertNumQueries(0):
+            self.assertEqual(link_cache.get_snapshot("lc000001").description, "Old")
+
+        link.description = "New"
+        with self.captureOnCommitCallbacks(execute=True):
+            link.save()
+        self.assertEqual(link_cache.get_snapshot("lc000001").description, "New")
+
+    def test_delete_invalidates_snapshot(self):
+        link = self.create("lc000002")
+        self.assertIsNotNone(link_cache.get_snapshot("lc000002"))
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+        self.assertIsNone(link_cache.get_snapshot("lc000002"))
+
+    def test_unknown_codes_are_cached_until_created(self):
+        self.assertIsNone(link_cache.get_snapshot("lc000003"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(link_cache.get_snapshot("lc000003"))
+            self.assertIsNone(link_cache.get_snapshot("not a code!"))
+
+        self.create("lc000003")
+        self.assertEqual(link_cache.get_snapshot("lc000003").short_code, "lc000003")
+
+
+class QRTests(TestCase):
+    def test_etag_revalidates_without_rendering(self):
+        merchant = get_user_model().objects.create_user("qr", "qr@example.com", "pw")
+        PaymentRequest.objects.create(merchant=merchant, short_code="qr000001", amount=1)
+        self.client.force_login(merchant)
+        url = reverse("payapp:payment_qr", args=["qr000001"])
+
+        first = self.client.get(url, {"format": "svg"})
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["Content-Type"], "image/svg+xml")
+        self.assertIn("private", first["Cache-Control"])
+
+        with mock.patch.object(qr, "render") as render:
+            again = self.client.get(url, {"format": "svg"}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again["ETag"], first["ETag"])
+        render.assert_not_called()
+
+        other_size = self.client.get(url, {"format": "svg", "size": "5"}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(other_size.status_code, 200)
+        self.assertNotEqual(other_size["ETag"], first["ETag"])
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = qr.QRCache(max_bytes=10)
+        cache.put("a", "png", b"aaaa")
+        cache.put("b", "png", b"bbbb")
+        self.assertEqual(cache.get("a", "png"), b"aaaa")
+        cache.put("c", "png", b"cccc")
+
+        self.assertIsNone(cache.get("b", "png"))
+        self.assertEqual(cache.get("a", "png"), b"aaaa")
+        self.assertEqual(cache.size, 8)
+        # Too big to keep at all.
+        cache.put("d", "png", b"d" * 11)
+        self.assertIsNone(cache.get("d", "png"))
+
+    def test_disk_tier_is_shared(self):
+        with tempfile.TemporaryDirectory() as directory:
+            qr.QRCache(1024, directory).put("e" * 64, "png", b"image")
+            self.assertEqual(qr.QRCache(1024, directory).get("e" * 64, "png"), b"image")
+
+
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        merchant = get_user_model().objects.create_user("hook", "hook@example.com", "pw")
+        self.link = PaymentRequest.objects.create(merchant=merchant, short_code="hook0001", amount=7)
+
+    def event(self, event_id, type="checkout.session.completed"):
+        return {
+            "id": event_id,
+            "type": type,
+            "data": {"object": {
+                "id": f"cs_{event_id}", "metadata": {"short_code": "hook0001"},
+                "amount_total": 700, "currency": "gbp", "payment_intent": f"pi_{event_id}",
+            }},
+        }
+
+    def test_redelivery_is_deduplicated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertIsNotNone(webhooks.receive(self.event("evt_1")))
+            self.assertIsNone(webhooks.receive(self.event("evt_1")))
+
+        self.assertEqual(WebhookEvent.objects.get().status, WebhookEvent.STATUS_DONE)
+        self.assertEqual(Transaction.objects.filter(payment_request=self.link).count(), 1)
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.status, PaymentRequest.STATUS_PAID)
+
+    def test_events_without_a_link_do_not_share_a_queue(self):
+        orphans = [
+            {"id": f"evt_{n}", "type": "charge.refunded", "data": {"object": {"id": f"ch_{n}", "metadata": {}}}}
+            for n in range(2)
+        ]
+        self.assertEqual([webhooks._ordering_key(event) for event in orphans], ["stripe:ch_0", "stripe:ch_1"])
+        self.assertEqual(webhooks._ordering_key({"id": "evt_x", "data": {"object": {}}}), "stripe:evt_x")
+        self.assertEqual(webhooks._ordering_key(self.event("evt_1")), "hook0001")
+
+    def test_failing_event_backs_off_then_dies_and_blocks_later_ones(self):
+        for event_id in ("evt_a", "evt_b"):
+            webhooks.receive(self.event(event_id))
+        handled = []
+
+        def handle(payload):
+            if payload["id"] == "evt_a":
+                raise ValueError("boom")
+            handled.append(payload["id"])
+
+        with mock.patch.object(webhooks, "handle_event", side_effect=handle), \
+                self.settings(WEBHOOK_INBOX={"MAX_ATTEMPTS": 2, "RETRY_BACKOFF": 30}), \
+                self.assertLogs("payapp.webhooks", "ERROR"):
+            self.assertEqual(webhooks.process_pending("hook0001"), 0)
+            first = WebhookEvent.objects.get(event_id="evt_a")
+            self.assertEqual((first.attempts, first.last_error), (1, "ValueError: boom"))
+            self.assertAlmostEqual(
+                (first.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5,
+            )
+            # Not due yet, and evt_b waits behind it.
+            self.assertEqual(webhooks.process_pending("hook0001"), 0)
+
+            WebhookEvent.objects.filter(event_id="evt_a").update(next_attempt_at=timezone.now())
+            self.assertEqual(webhooks.process_pending("hook0001"), 0)
+            # Dead now, so the next sweep gets past it.
+            self.assertEqual(webhooks.due_ordering_keys(), ["hook0001"])
+            self.assertEqual(webhooks.process_pending("hook0001"), 1)
+
+        self.assertEqual(WebhookEvent.objects.get(event_id="evt_a").status, WebhookEvent.STATUS_DEAD)
+        self.assertEqual(handled, ["evt_b"])
+        self.assertEqual(webhooks.inbox_stats()["dead"], 1)
+        self.assertEqual(webhooks.requeue_dead(), 1)
+        self.assertEqual(WebhookEvent.objects.get(event_id="evt_a").attempts, 0)
+
+
+class CheckoutReuseTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        self.link = PaymentRequest(short_code="reuse001", amount=Decimal("20.00"), currency="GBP")
+        self.created = 0
+
+        def create_session(payment_request, success_url, cancel_url, claimed=None):
+            self.created += 1
+            return {
+                "id": f"cs_{self.created}", "url": f"https://checkout.example.com/{self.created}",
+                "expires_at": int(time.time()) + 3600,
+                "amount": int(payment_request.amount * 100), "currency": payment_request.currency.lower(),
+            }
+
+        patcher = mock.patch.object(checkout, "create_session", side_effect=create_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self):
+        return checkout.get_session(self.link, "https://x/ok", "https://x/no")["id"]
+
+    def test_open_session_is_reused_until_the_margin(self):
+        self.assertEqual(self.get(), "cs_1")
+        self.assertEqual(self.get(), "cs_1")
+
+        margin = checkout._conf()["REUSE_MARGIN"]
+        with mock.patch("time.time", return_value=time.time() + 3600 - margin + 1):
+            self.assertEqual(self.get(), "cs_2")
+
+    def test_amount_change_or_invalidate_gets_a_new_session(self):
+        self.assertEqual(self.get(), "cs_1")
+        self.link.amount = Decimal("25.00")
+        self.assertEqual(self.get(), "cs_2")
+        checkout.invalidate("reuse001")
+        self.assertEqual(self.get(), "cs_3")
+
+
+class ExpirySweepTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.merchant = get_user_model().objects.create_user("exp", "exp@example.com", "pw")
+
+    def test_sweep_expires_overdue_links_and_drops_their_caches(self):
+        past = timezone.now() - timedelta(hours=1)
+        for code, expires_at, status in (
+            ("exp00001", past, PaymentRequest.STATUS_PENDING),
+            ("exp00002", past, PaymentRequest.STATUS_PENDING),
+            ("exp00003", timezone.now() + timedelta(hours=1), PaymentRequest.STATUS_PENDING),
+            ("exp00004", past, PaymentRequest.STATUS_PAID),
+        ):
+            PaymentRequest.objects.create(
+                merchant=self.merchant, short_code=code, amount=2, expires_at=expires_at, status=status,
+            )
+        self.assertEqual(link_cache.get_snapshot("exp00001").status, PaymentRequest.STATUS_PENDING)
+
+        with mock.patch.object(checkout, "invalidate") as invalidate_session:
+            self.assertEqual(expiry.expire_overdue(chunk_size=1), 2)
+
+        self.assertEqual(
+            dict(PaymentRequest.objects.values_list("short_code", "status")),
+            {
+                "exp00001": PaymentRequest.STATUS_EXPIRED,
+                "exp00002": PaymentRequest.STATUS_EXPIRED,
+                "exp00003": PaymentRequest.STATUS_PENDING,
+                "exp00004": PaymentRequest.STATUS_PAID,
+            },
+        )
+        self.assertEqual(link_cache.get_snapshot("exp00001").status, PaymentRequest.STATUS_EXPIRED)
+        self.assertIsNotNone(link_cache.get_snapshot("exp00001").status_changed_at)
+        self.assertEqual(
+            sorted(code for call in invalidate_session.call_args_list for code in call.args),
+            ["exp00001", "exp00002"],
+        )
+        self.assertEqual(expiry.expire_overdue(), 0)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.merchant = get_user_model().objects.create_user("exporter", "exporter@example.com", "pw")
+        other = get_user_model().objects.create_user("other", "other@example.com", "pw")
+        link = PaymentRequest.objects.create(merchant=self.merchant, short_code="csv00001", amount=3)
+        for merchant, amount in ((self.merchant, 3), (self.merchant, 4), (other, 5)):
+            Transaction.objects.create(
+                payment_request=link, merchant=merchant, amount=amount, status=Transaction.STATUS_SUCCESS,
+                raw_response={"id": f"evt_{amount}", "note": "a,b"},
+            )
+        self.client.force_login(self.merchant)
+        self.url = reverse("payapp:export", args=["transactions"])
+
+    def rows(self, content):
+        return list(csv.reader(content.decode().splitlines()))
+
+    def test_streams_csv_of_own_rows(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = self.rows(b"".join(response.streaming_content))
+        self.assertEqual(rows[0], [name for name, _ in exports.KINDS["transactions"].fields])
+        self.assertEqual([row[3] for row in rows[1:]], ["3.00", "4.00"])
+
+    def test_gzip_and_include_raw(self):
+        response = self.client.get(self.url, {"gzip": "1", "include_raw": "1"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertTrue(response["Content-Disposition"].endswith('.csv.gz"'))
+        rows = self.rows(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertEqual(rows[0][-1], "raw_response")
+        self.assertEqual(json.loads(rows[1][-1]), {"id": "evt_3", "note": "a,b"})
+
+    def test_output_is_chunked(self):
+        header, rows = exports.export_rows("transactions", self.merchant)
+        with mock.patch.object(exports, "FLUSH_BYTES", 64):
+            chunks = list(exports.stream(header, rows, fmt="ndjson"))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([json.loads(line)["amount"] for line in b"".join(chunks).splitlines()], ["3.00", "4.00"])
+
+
+class AsyncViewParityTests(TestCase):
+    """payapp.async_views answers like the sync views it stands in for."""
+
+    def setUp(self):
+        clear_caches()
+        self.factory = RequestFactory()
+        self.merchant = get_user_model().objects.create_user("parity", "parity@example.com", "pw")
+        for code, expires_at in (("par00001", timezone.now() + timedelta(days=1)),
+                                 ("par00002", timezone.now() - timedelta(days=1))):
+            PaymentRequest.objects.create(
+                merchant=self.merchant, short_code=code, amount=Decimal("12.00"), description="Parity",
+                expires_at=expires_at,
+            )
+        patchers = [
+            mock.patch.multiple(analytics, record_view=mock.DEFAULT, record_conversion=mock.DEFAULT,
+                                arecord_view=mock.DEFAULT, arecord_conversion=mock.DEFAULT),
+            mock.patch.multiple(checkout, note_view=mock.DEFAULT, anote_view=mock.DEFAULT),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        checkout.note_view.return_value = False
+        checkout.anote_view.return_value = False
+
+    def both(self, name, method, path, *args, user=None, **kwargs):
+        """Responses of the sync and the async view to the same request."""
+        responses = []
+        for view in (getattr(views, name), getattr(async_views, name)):
+            request = getattr(self.factory, method)(path, **kwargs)
+            request.user = user or AnonymousUser()
+
+            async def auser(user=request.user):
+                return user
+
+            request.auser = auser
+            response = async_to_sync(view)(request, *args) if asyncio.iscoroutinefunction(view) \
+                else view(request, *args)
+            responses.append(response)
+        return responses
+
+    def assertSameHTML(self, sync_response, async_response):
+        self.assertEqual(sync_response.status_code, async_response.status_code)
+        tokens = re.compile(rb'name="(csrfmiddlewaretoken|idempotency_key)" value="[^"]*"')
+        self.assertEqual(tokens.sub(b"", sync_response.content), tokens.sub(b"", async_response.content))
+
+    def test_pay_page_get_and_expired(self):
+        self.assertSameHTML(*self.both("public_pay_page", "get", "/pay/par00001/", "par00001"))
+        sync_response, async_response = self.both("public_pay_page", "get", "/pay/par00002/", "par00002")
+        self.assertSameHTML(sync_response, async_response)
+        self.assertContains(async_response, "expired", status_code=200)
+
+    def test_pay_post_redirects_to_checkout(self):
+        session = {"id": "cs_parity", "url": "https://checkout.example.com/parity"}
+        with mock.patch.object(checkout, "get_session", return_value=session), \
+                mock.patch.object(checkout, "aget_session", return_value=session):
+            responses = self.both("public_pay_page", "post", "/pay/par00001/", "par00001")
+        self.assertEqual([(r.status_code, r["Location"]) for r in responses], [(303, session["url"])] * 2)
+
+    def test_status_qr_and_success(self):
+        sync_response, async_response = self.both("payment_status", "get", "/status/", "par00001")
+        self.assertEqual(json.loads(sync_response.content), json.loads(async_response.content))
+
+        sync_response, async_response = self.both(
+            "payment_qr", "get", "/qr/", "par00001", user=self.merchant, data={"format": "svg"},
+        )
+        self.assertEqual(sync_response.content, async_response.content)
+        self.assertEqual(sync_response["ETag"], async_response["ETag"])
+
+        self.assertSameHTML(*self.both("payment_success", "get", "/success/", data={"session_id": "cs_unknown"}))
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.merchant = get_user_model().objects.create_user("keep", "keep@example.com", "pw")
+        self.link = PaymentRequest.objects.create(merchant=self.merchant, short_code="ret00001", amount=6)
+        rollups.record_link_created(self.link)
+
+    def rollup_rows(self):
+        return (
+            sorted(LinkDailyStats.objects.values_list("day", "views", "conversions")),
+            sorted(MerchantDailyStats.objects.values_list("day", "views", "conversions")),
+            list(MerchantStats.objects.values_list("views", "conversions")),
+            rollups.unique_counts(MerchantDailyStats.objects.filter(merchant=self.merchant)),
+        )
+
+    def test_compacting_views_leaves_rollups_unchanged(self):
+        noon = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+        analytics.write_events([
+            {
+                "kind": analytics.VIEW, "payment_request_id": self.link.pk,
+                "timestamp": noon - timedelta(days=days_ago, minutes=n),
+                "ip_address": f"198.51.100.{n}",
+                "user_agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)",
+            }
+            for days_ago, visitors in ((120, 3), (100, 2), (1, 4))
+            for n in range(visitors)
+        ])
+        before = self.rollup_rows()
+
+        self.assertEqual(retention.compact_views(days=90, chunk_size=2), 5)
+        self.assertEqual(PaymentView.objects.count(), 4)
+        self.assertEqual(
+            sorted(PaymentViewDaily.objects.values_list("views", flat=True)), [2, 3],
+        )
+        self.assertEqual(self.rollup_rows(), before)
+        # Nothing left to do on a second run.
+        self.assertEqual(retention.compact_views(days=90), 0)
+
+        rollups.rebuild(self.merchant.pk)
+        self.assertEqual(self.rollup_rows(), before)
+
+    def test_archived_raw_response_reads_back(self):
+        payload = {"id": "evt_old", "data": {"object": {"amount_total": 600}}}
+        old, recent = (
+            Transaction.objects.create(payment_request=self.link, merchant=self.merchant, amount=6,
+                                       raw_response=payload)
+            for _ in range(2)
+        )
+        Transaction.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=40))
+
+        self.assertEqual(retention.archive_raw_responses(days=30), 1)
+        old.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertIsNone(old.raw_response)
+        self.assertEqual(recent.raw_response, payload)
+        self.assertEqual(old.get_raw_response(), payload)
+        self.assertEqual(retention.archive_raw_responses(days=30), 0)
+
+    def test_purge_keeps_dead_and_recent_events(self):
+        now = timezone.now()
+        for event_id, status, processed_at in (
+            ("evt_done_old", WebhookEvent.STATUS_DONE, now - timedelta(days=40)),
+            ("evt_done_new", WebhookEvent.STATUS_DONE, now - timedelta(days=1)),
+            ("evt_dead_old", WebhookEvent.STATUS_DEAD, now - timedelta(days=40)),
+        ):
+            WebhookEvent.objects.create(event_id=event_id, type="x", payload={}, status=status,
+                                        processed_at=processed_at)
+
+        self.assertEqual(retention.purge_webhook_events(days=30, chunk_size=1), 1)
+        self.assertEqual(
+            sorted(WebhookEvent.objects.values_list("event_id", flat=True)), ["evt_dead_old", "evt_done_new"],
+        )
+
+
+class ReceiptTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.merchant = get_user_model().objects.create_user("rcpt", "rcpt@example.com", "pw")
+
+    def pay(self, merchant, count, currency="GBP"):
+        for _ in range(count):
+            link = PaymentRequest.objects.create(
+                merchant=merchant, short_code=bulk_links.generate_short_code(), amount=5, currency=currency,
+            )
+            txn = Transaction.objects.create(
+                payment_request=link, merchant=merchant, amount=5, currency=currency,
+                status=Transaction.STATUS_SUCCESS,
+            )
+            receipts.queue(link, txn)
+
+    def test_batches_share_one_connection(self):
+        self.pay(self.merchant, 5)
+        with mock.patch.object(receipts, "get_connection", wraps=receipts.get_connection) as get_connection:
+            self.assertEqual(receipts.send_pending(batch_size=2), 5)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(ReceiptEmail.objects.exclude(status=ReceiptEmail.STATUS_SENT).exists())
+
+    def test_failures_back_off_then_fail(self):
+        self.pay(self.merchant, 1)
+        with self.settings(RECEIPT_EMAILS={"MAX_ATTEMPTS": 2, "RETRY_BACKOFF": 60}), \
+                mock.patch.object(receipts.EmailMultiAlternatives, "send", side_effect=OSError("mail down")), \
+                self.assertLogs("payapp.receipts", "ERROR"):
+            self.assertEqual(receipts.send_pending(), 0)
+            receipt = ReceiptEmail.objects.get()
+            self.assertEqual((receipt.status, receipt.attempts), (ReceiptEmail.STATUS_PENDING, 1))
+            self.assertAlmostEqual((receipt.next_attempt_at - timezone.now()).total_seconds(), 60, delta=5)
+            # Not due again yet.
+            self.assertEqual(receipts.send_pending(), 0)
+            self.assertEqual(ReceiptEmail.objects.get().attempts, 1)
+
+            ReceiptEmail.objects.update(next_attempt_at=timezone.now())
+            receipts.send_pending()
+        receipt = ReceiptEmail.objects.get()
+        self.assertEqual((receipt.status, receipt.attempts, receipt.last_error),
+                         (ReceiptEmail.STATUS_FAILED, 2, "OSError: mail down"))
+
+    def test_allowance_shares_the_minute_budget(self):
+        with self.settings(RECEIPT_EMAILS={"RATE_LIMIT": 3}), mock.patch("time.time", return_value=600.0):
+            self.assertEqual([receipts._allowance(2), receipts._allowance(2), receipts._allowance(1)], [2, 1, 0])
+
+        self.pay(self.merchant, 5)
+        with self.settings(RECEIPT_EMAILS={"RATE_LIMIT": 3}), mock.patch("time.time", return_value=1200.0):
+            self.assertEqual(receipts.send_pending(batch_size=2), 3)
+        self.assertEqual(ReceiptEmail.objects.filter(status=ReceiptEmail.STATUS_PENDING).count(), 2)
+
+    def test_digest_groups_receipts_per_merchant(self):
+        other = get_user_model().objects.create_user("rcpt2", "rcpt2@example.com", "pw")
+        for merchant in (self.merchant, other):
+            ReceiptPreference.objects.create(merchant=merchant, mode=ReceiptPreference.MODE_DIGEST)
+        self.pay(self.merchant, 2)
+        self.pay(self.merchant, 1, currency="EUR")
+        self.pay(other, 1)
+        # Digest receipts wait for send_digests().
+        self.assertEqual(receipts.send_pending(), 0)
+
+        self.assertEqual(receipts.send_digests(), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ["rcpt2@example.com", "rcpt@example.com"])
+        digest = next(message for message in mail.outbox if message.to == ["rcpt@example.com"])
+        self.assertEqual(digest.body, "3 payments received via VyoPay: 5.00 EUR, 10.00 GBP.")
+        self.assertFalse(ReceiptEmail.objects.exclude(status=ReceiptEmail.STATUS_SENT).exists())
+        self.assertEqual(receipts.send_digests(), 0)
+
+
+class PrewarmTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        merchant = get_user_model().objects.create_user("warm", "warm@example.com", "pw")
+        PaymentRequest.objects.create(merchant=merchant, short_code="warm0001", amount=8)
+        self.url = reverse("payapp:public_pay", args=["warm0001"])
+        patchers = [
+            mock.patch.multiple(analytics, record_view=mock.DEFAULT, record_conversion=mock.DEFAULT),
+            mock.patch.object(checkout, "note_view", return_value=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_broker_outage_does_not_break_the_page(self):
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=False), \
+                mock.patch.object(tasks.prewarm_checkout_session, "delay", side_effect=OSError("refused")) as delay, \
+                self.assertLogs("payapp.checkout", "ERROR"), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        delay.assert_called_once()
+
+    def test_no_prewarm_without_a_broker(self):
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=True), \
+                mock.patch.object(tasks.prewarm_checkout_session, "delay") as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        delay.assert_not_called()
+
+
+class RollupBackfillTests(TestCase):
+    def test_migration_fills_rollups_from_raw_rows(self):
+        merchant = get_user_model().objects.create_user("legacy", "legacy@example.com", "pw")
+        link = PaymentRequest.objects.create(merchant=merchant, short_code="old00001", amount=9)
+        # Rows from before the rollups existed: written without touching them.
+        PaymentView.objects.bulk_create([PaymentView(payment_request=link) for _ in range(3)])
+        self.assertFalse(MerchantStats.objects.exists())
+
+        migration = importlib.import_module("payapp.migrations.0018_backfill_rollups")
+        migration.backfill_rollups(django_apps, None)
+        self.assertEqual(
+            list(MerchantStats.objects.filter(merchant=merchant).values_list("views", "links_created")), [(3, 1)],
+        )
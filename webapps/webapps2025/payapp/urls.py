@@ -1,22 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Async versions of the public, Stripe-bound views for ASGI deployments.
+if settings.PAYAPP_ASYNC_VIEWS:
+    from . import async_views as io_views
+else:
+    io_views = views
 
 app_name = "payapp"
 
 urlpatterns = [
     path("", views.dashboard, name="dashboard"),
+    # Always async: an open SSE stream (see payapp/live.py).
+    path("events/", async_views.dashboard_events, name="dashboard_events"),
 
+    path("payments/", views.payment_link_list, name="payment_list"),
     path("payments/new/", views.create_payment_request, name="payment_new"),
+    # Before payments/<short_code>/, which would otherwise match them.
+    path("payments/success/", io_views.payment_success, name="payment_success"),
+    path("payments/failed/", views.payment_failed, name="payment_failed"),
     path("payments/<str:short_code>/", views.payment_link_detail, name="payment_link_detail"),
-    path("payments/<str:short_code>/qr/", views.payment_qr, name="payment_qr"),
+    path("payments/<str:short_code>/qr/", io_views.payment_qr, name="payment_qr"),
 
-    path("pay/<str:short_code>/", views.public_pay_page, name="public_pay"),
+    path("pay/<str:short_code>/", io_views.public_pay_page, name="public_pay"),
+    path("pay/<str:short_code>/status/", io_views.payment_status, name="payment_status"),
 
-    path("payments/success/", views.payment_success, name="payment_success"),
-    path("payments/failed/", views.payment_failed, name="payment_failed"),
+    path("webhooks/stripe/", io_views.stripe_webhook, name="stripe_webhook"),
+    path("transactions/", views.transaction_list, name="transaction_list"),
+    path("transactions/<uuid:transaction_id>/receipt/", views.payment_receipt, name="payment_receipt"),
+
+    path("api/payments/", views.payment_link_list_api, name="payment_list_api"),
+    path("api/payments/bulk/", views.payment_link_bulk_create_api, name="payment_bulk_create_api"),
+    path("api/transactions/", views.transaction_list_api, name="transaction_list_api"),
+
+    path("exports/<str:kind>/", views.export_data, name="export"),
 
-    path("webhooks/stripe/", views.stripe_webhook, name="stripe_webhook"),
-    path("transactions/<int:transaction_id>/receipt/", views.payment_receipt, name="payment_receipt"),
+    path("metrics", views.metrics_view, name="metrics"),
 
     path("logout/", views.logout_view, name="logout"),
 ]
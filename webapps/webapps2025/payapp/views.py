@@ -1,98 +1,137 @@
-import secrets
+import hmac
+import json
 import stripe
-import qrcode
 
 from datetime import timedelta
-from io import BytesIO
+from functools import cache
 
-from django.db.models.functions import TruncDate
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth import logout
 from django.utils import timezone
 from django.urls import reverse
 from django.conf import settings
 from django.views.decorators.http import require_http_methods
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
-from .models import PaymentRequest, Transaction, PaymentView, PaymentConversion
-from .forms import PaymentRequestForm
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-
-def _generate_short_code() -> str:
-    return secrets.token_urlsafe(6)[:8]
+from . import analytics, bulk_links, checkout, exports, fragments, fx, idempotency, link_cache, link_status, metrics, pagination, qr, ratelimit, rollups, webhooks
+from .models import PaymentRequest, Transaction, MerchantStats, MerchantDailyStats, LinkDailyStats, ReportingPreference
+from .db_router import read_alias, replica_reads
+from .forms import HistoryFilterForm, PaymentRequestForm
 
 
 @login_required
+@replica_reads()
 def dashboard(request):
-    payment_requests = PaymentRequest.objects.filter(merchant=request.user)
+    # Read-only and tolerant of a second of replica lag (see payapp.db_router).
+    return render(request, "payapp/dashboard.html", dashboard_context(request.user))
 
-    summary = payment_requests.aggregate(
-        total_amount=Sum("amount"),
-        total_paid=Sum("amount", filter=Q(status=PaymentRequest.STATUS_PAID)),
-        count=Count("id"),
-    )
+
+def dashboard_context(user):
+    """
+    Template context for the dashboard. The summary, unique counts and
+    recent lists are evaluated lazily (the template calls callables), so
+    a fragment served from the cache costs no queries at all.
+    """
+    # Totals and the chart come from the rollup tables (payapp.rollups),
+    # so the cost of this page does not grow with the merchant's history.
+    @cache
+    def summary():
+        # One grouped query, one row per currency. Amounts in different
+        # currencies are never added up as they are; the optional total
+        # converts these few rows with the cached rate table (payapp.fx).
+        currencies = list(
+            MerchantStats.objects
+            .filter(merchant=user)
+            .values("currency")
+            .annotate(
+                total_amount=Sum("amount_requested"),
+                total_paid=Sum("amount_collected"),
+                count=Sum("links_created"),
+            )
+            .order_by("currency")
+        )
+        reporting_currency = (
+            ReportingPreference.objects.filter(merchant=user).values_list("currency", flat=True).first()
+            or fx.conf()["BASE_CURRENCY"]
+        )
+        total_amount = total_paid = None
+        if {row["currency"].upper() for row in currencies} - {reporting_currency.upper()}:
+            total_amount = fx.convert_totals(
+                {row["currency"]: row["total_amount"] for row in currencies}, reporting_currency
+            )
+            total_paid = fx.convert_totals(
+                {row["currency"]: row["total_paid"] for row in currencies}, reporting_currency
+            )
+        return {
+            "currencies": currencies,
+            "count": sum(row["count"] for row in currencies),
+            "reporting_currency": reporting_currency,
+            "total_amount": total_amount,
+            "total_paid": total_paid,
+        }
 
     transactions = (
         Transaction.objects
-        .filter(payment_request__merchant=request.user)
+        .filter(merchant=user)
         .select_related("payment_request")
         .order_by("-created_at")[:20]
     )
 
     # Simple analytics: last 7 days views & payments
-    today = timezone.now().date()
+    today = timezone.localdate()
     week_ago = today - timedelta(days=6)
 
-    views_qs = (
-        PaymentView.objects
-        .filter(payment_request__merchant=request.user,
-                timestamp__date__gte=week_ago)
-        .annotate(day=TruncDate("timestamp"))
+    daily_qs = (
+        MerchantDailyStats.objects
+        .filter(merchant=user, day__gte=week_ago)
         .values("day")
-        .annotate(count=Count("id"))
-        .order_by("day")
-    )
-
-    paid_qs = (
-        Transaction.objects
-        .filter(payment_request__merchant=request.user,
-                status=Transaction.STATUS_SUCCESS,
-                created_at__date__gte=week_ago)
-        .annotate(day=TruncDate("created_at"))
-        .values("day")
-        .annotate(count=Count("id"))
+        .annotate(views=Sum("views"), paid=Sum("payments"))
         .order_by("day")
     )
 
     labels = []
+    days = []
     views_data = []
     paid_data = []
 
-    day_index = {v["day"]: v["count"] for v in views_qs}
-    paid_index = {p["day"]: p["count"] for p in paid_qs}
+    day_index = {row["day"]: row for row in daily_qs}
 
     for i in range(7):
         d = week_ago + timedelta(days=i)
+        row = day_index.get(d, {})
         labels.append(d.strftime("%d %b"))
-        views_data.append(day_index.get(d, 0))
-        paid_data.append(paid_index.get(d, 0))
-
-    context = {
-        "payment_requests": payment_requests[:10],
+        days.append(d.isoformat())
+        views_data.append(row.get("views", 0))
+        paid_data.append(row.get("paid", 0))
+
+    # Merged HyperLogLog sketches: one row per day, however busy the links were.
+    @cache
+    def traffic():
+        unique_visitors, unique_payers = rollups.unique_counts(
+            MerchantDailyStats.objects.filter(merchant=user, day__gte=week_ago)
+        )
+        return {
+            "unique_visitors": unique_visitors,
+            "unique_payers": unique_payers,
+            "visitor_conversion": unique_payers / unique_visitors if unique_visitors else None,
+        }
+
+    return {
+        "payment_requests": PaymentRequest.objects.filter(merchant=user)[:10],
         "transactions": transactions,
         "summary": summary,
         "chart_labels": labels,
+        "chart_days": days,
         "chart_views": views_data,
         "chart_paid": paid_data,
+        "traffic": traffic,
+        "fragments_version": fragments.version(user.pk),
     }
-    return render(request, "payapp/dashboard.html", context)
 
 
 # ─────────────────────────────────────
@@ -100,18 +139,14 @@ def dashboard(request):
 # ─────────────────────────────────────
 @login_required
 @require_http_methods(["GET", "POST"])
+@idempotency.idempotent
 def create_payment_request(request):
     if request.method == "POST":
         form = PaymentRequestForm(request.POST)
         if form.is_valid():
-            payment_request = form.save(commit=False)
-            payment_request.merchant = request.user
-            payment_request.short_code = _generate_short_code()
-
-            expiry_days = form.cleaned_data.get("expiry_days") or 7
-            payment_request.expires_at = timezone.now() + timedelta(days=expiry_days)
-
-            payment_request.save()
+            # Same path as bulk uploads: collision-checked short code, rollups.
+            cleaned = {**form.cleaned_data, "currency": form.cleaned_data["currency"].upper()}
+            payment_request = bulk_links.create_links(request.user, [cleaned])[0]
 
             return redirect(
                 "payapp:payment_link_detail",
@@ -125,7 +160,9 @@ def create_payment_request(request):
             }
         )
 
-    return render(request, "payapp/payment_new.html", {"form": form})
+    # A fresh key per render: a corrected resubmission is a new request.
+    context = {"form": form, "idempotency_key": idempotency.new_key()}
+    return render(request, "payapp/payment_new.html", context)
 
 
 @login_required
@@ -140,78 +177,301 @@ def payment_link_detail(request, short_code):
         reverse("payapp:public_pay", args=[payment.short_code])
     )
 
+    unique_visitors, unique_payers = rollups.unique_counts(
+        LinkDailyStats.objects.filter(payment_request=payment)
+    )
+
     context = {
         "payment": payment,
         "payment_url": payment_url,
+        "unique_visitors": unique_visitors,
+        "unique_payers": unique_payers,
     }
     return render(request, "payapp/payment_detail.html", context)
 
 
+# ─────────────────────────────────────
+# History listings (keyset pagination)
+# ─────────────────────────────────────
+def _history_page(request, queryset, status_choices):
+    """Apply the query-string filters and return (form, page); page is None if invalid."""
+    form = HistoryFilterForm(request.GET, status_choices=status_choices)
+    if not form.is_valid():
+        return form, None
+
+    data = form.cleaned_data
+    if data["status"]:
+        queryset = queryset.filter(status=data["status"])
+    if data["currency"]:
+        queryset = queryset.filter(currency=data["currency"])
+    # Plain ranges rather than __date, so the (merchant, created_at) indexes apply.
+    start, end = form.date_range()
+    if start:
+        queryset = queryset.filter(created_at__gte=start)
+    if end:
+        queryset = queryset.filter(created_at__lt=end)
+
+    try:
+        page = pagination.paginate(
+            queryset,
+            cursor=data["cursor"],
+            page_size=data["limit"] or pagination.DEFAULT_PAGE_SIZE,
+        )
+    except pagination.InvalidCursor:
+        form.add_error("cursor", "Invalid cursor.")
+        return form, None
+    return form, page
+
+
+def _next_page_query(request, page):
+    if not page or not page.has_next:
+        return ""
+    query = request.GET.copy()
+    query["cursor"] = page.next_cursor
+    return query.urlencode()
+
+
+def _payment_json(payment):
+    return {
+        "short_code": payment.short_code,
+        "amount": str(payment.amount),
+        "currency": payment.currency,
+        "description": payment.description,
+        "status": payment.status,
+        "created_at": payment.created_at.isoformat(),
+        "expires_at": payment.expires_at.isoformat() if payment.expires_at else None,
+    }
+
+
+def _transaction_json(txn):
+    return {
+        "id": str(txn.id),
+        "short_code": txn.payment_request.short_code if txn.payment_request else None,
+        "status": txn.status,
+        "amount": str(txn.amount),
+        "currency": txn.currency,
+        "provider_txn_id": txn.provider_txn_id,
+        "created_at": txn.created_at.isoformat(),
+    }
+
+
+def _links_queryset(request):
+    return PaymentRequest.objects.filter(merchant=request.user)
+
+
+def _transactions_queryset(request):
+    return (
+        Transaction.objects
+        .filter(merchant=request.user)
+        .select_related("payment_request")
+        .defer("raw_response")
+    )
+
+
+@login_required
+def payment_link_list(request):
+    form, page = _history_page(request, _links_queryset(request), PaymentRequest.STATUS_CHOICES)
+    context = {
+        "form": form,
+        "page": page,
+        "next_query": _next_page_query(request, page),
+    }
+    return render(request, "payapp/payment_list.html", context)
+
+
+@login_required
+def transaction_list(request):
+    form, page = _history_page(request, _transactions_queryset(request), Transaction.STATUS_CHOICES)
+    context = {
+        "form": form,
+        "page": page,
+        "next_query": _next_page_query(request, page),
+    }
+    return render(request, "payapp/transaction_list.html", context)
+
+
+@login_required
+def payment_link_list_api(request):
+    form, page = _history_page(request, _links_queryset(request), PaymentRequest.STATUS_CHOICES)
+    if page is None:
+        return JsonResponse({"errors": form.errors}, status=400)
+    return JsonResponse({
+        "results": [_payment_json(p) for p in page],
+        "next_cursor": page.next_cursor,
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+@idempotency.idempotent
+def payment_link_bulk_create_api(request):
+    """
+    Create many links at once from a JSON array (or {"links": [...]}), or
+    from CSV (Content-Type: text/csv) with amount, currency, description
+    and expiry_days columns. Every row is validated before any is created.
+    ?prerender_qr=1 also renders their QR codes ahead of time. Send an
+    Idempotency-Key header to make retries safe.
+    """
+    try:
+        rows = bulk_links.parse(request.body.decode("utf-8"), request.content_type)
+    except (UnicodeDecodeError, ValueError) as exc:
+        return JsonResponse({"errors": {"__all__": [str(exc)]}}, status=400)
+
+    max_rows = bulk_links.conf()["MAX_ROWS"]
+    if not rows or len(rows) > max_rows:
+        return JsonResponse({"errors": {"__all__": [f"Send between 1 and {max_rows} links."]}}, status=400)
+
+    cleaned, errors = bulk_links.validate(rows)
+    if errors:
+        return JsonResponse({"errors": {"rows": errors}}, status=400)
+
+    qr_base_url = request.build_absolute_uri("/") if request.GET.get("prerender_qr") in ("1", "true") else None
+    links = bulk_links.create_links(request.user, cleaned, qr_base_url=qr_base_url)
+    return JsonResponse({"created": len(links), "results": [_payment_json(p) for p in links]}, status=201)
+
+
+@login_required
+def transaction_list_api(request):
+    form, page = _history_page(request, _transactions_queryset(request), Transaction.STATUS_CHOICES)
+    if page is None:
+        return JsonResponse({"errors": form.errors}, status=400)
+    return JsonResponse({
+        "results": [_transaction_json(t) for t in page],
+        "next_cursor": page.next_cursor,
+    })
+
+
+@login_required
+def export_data(request, kind):
+    """
+    Stream a merchant's history as CSV or NDJSON (?format=csv|ndjson),
+    optionally gzipped (?gzip=1). Takes the same status and date filters
+    as the listings; ?include_raw=1 adds Stripe's raw_response payloads.
+    """
+    spec = exports.KINDS.get(kind)
+    if spec is None:
+        raise Http404("Unknown export")
+
+    fmt = request.GET.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        return HttpResponseBadRequest("Unsupported format")
+
+    form = HistoryFilterForm(request.GET, status_choices=spec.status_choices)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    start, end = form.date_range()
+    gzip = request.GET.get("gzip") in ("1", "true")
+    header, rows = exports.export_rows(
+        kind,
+        request.user,
+        start=start,
+        end=end,
+        status=form.cleaned_data["status"],
+        include_raw=request.GET.get("include_raw") in ("1", "true"),
+        # Rows are read while streaming, after this view has returned.
+        using=read_alias(),
+    )
+
+    filename = f"vyopay-{kind}-{timezone.localdate():%Y%m%d}.{fmt}"
+    response = StreamingHttpResponse(
+        exports.stream(header, rows, fmt=fmt, gzip=gzip),
+        content_type="application/gzip" if gzip else exports.FORMATS[fmt],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}{".gz" if gzip else ""}"'
+    return response
+
+
+def _see_other(url):
+    # redirect() has no 303 option; Stripe expects the POST to become a GET.
+    response = redirect(url)
+    response.status_code = 303
+    return response
+
+
+def _checkout_urls(request):
+    success_url = request.build_absolute_uri(
+        reverse("payapp:payment_success")
+    ) + "?session_id={CHECKOUT_SESSION_ID}"
+
+    cancel_url = request.build_absolute_uri(
+        reverse("payapp:payment_failed")
+    )
+    return success_url, cancel_url
+
+
 @require_http_methods(["GET", "POST"])
 def public_pay_page(request, short_code):
-    payment_request = get_object_or_404(PaymentRequest, short_code=short_code)
+    # Cached snapshot, not a model instance (see payapp.link_cache)
+    payment_request = link_cache.get_snapshot_or_404(short_code)
 
-    # If expired, mark and show expired page
-    if payment_request.is_expired():
-        payment_request.status = PaymentRequest.STATUS_EXPIRED
-        payment_request.save(update_fields=["status"])
+    # Overdue links are marked EXPIRED by the background sweeper
+    # (payapp.expiry); this page only reads.
+    if payment_request.status == PaymentRequest.STATUS_EXPIRED or payment_request.is_expired():
         return render(request, "payapp/payment_expired.html", {"payment": payment_request})
 
-    # Track a view every time this page is opened (GET or POST)
-    PaymentView.objects.create(
-        payment_request=payment_request,
-        ip_address=request.META.get("REMOTE_ADDR"),
-        user_agent=request.META.get("HTTP_USER_AGENT", ""),
-        referer=request.META.get("HTTP_REFERER", ""),
-    )
-
     if request.method == "POST":
-        # Track that the user started the payment flow
-        PaymentConversion.objects.create(
-            payment_request=payment_request,
-            source="public_page",
-        )
+        # Shed floods before they cost a conversion row, a key or a Stripe call.
+        too_many = ratelimit.check_pay_post(request, payment_request)
+        if too_many:
+            return too_many
 
-        success_url = request.build_absolute_uri(
-            reverse("payapp:payment_success")
-        ) + "?session_id={CHECKOUT_SESSION_ID}"
+    # Track a view every time this page is opened (GET or POST).
+    # Buffered: the rows are written in batches off the request path.
+    analytics.record_view(payment_request.pk, request)
 
-        cancel_url = request.build_absolute_uri(
-            reverse("payapp:payment_failed")
-        )
+    success_url, cancel_url = _checkout_urls(request)
 
-        amount_in_minor = int(payment_request.amount * 100)
-
-        session = stripe.checkout.Session.create(
-            payment_method_types=["card"],
-            mode="payment",
-            line_items=[
-                {
-                    "price_data": {
-                        "currency": payment_request.currency.lower(),
-                        "product_data": {
-                            "name": payment_request.description
-                            or f"Payment {payment_request.short_code}",
-                        },
-                        "unit_amount": amount_in_minor,
-                    },
-                    "quantity": 1,
-                }
-            ],
-            metadata={
-                "short_code": payment_request.short_code,
-            },
-            success_url=success_url,
-            cancel_url=cancel_url,
-        )
-
-        return redirect(session.url, code=303)
+    if request.method == "POST":
+        # A resubmitted form replays its first redirect (see payapp.idempotency).
+        claimed = idempotency.claim(request)
+        if isinstance(claimed, HttpResponse):
+            return claimed
 
-    return render(request, "payapp/public_pay.html", {"payment": payment_request})
+        try:
+            # Track that the user started the payment flow
+            analytics.record_conversion(payment_request.pk, request, source="public_page")
+
+            # Reuses the link's open Checkout Session when there is one (see payapp.checkout)
+            session = checkout.get_session(payment_request, success_url, cancel_url, claimed)
+        except BaseException:
+            if claimed:
+                idempotency.release(claimed)
+            raise
+
+        response = _see_other(session["url"])
+        if claimed:
+            # Replaying the redirect is pointless once the session has expired.
+            idempotency.store(claimed, response, checkout.session_expires(session))
+        return response
+
+    if checkout.note_view(payment_request):
+        checkout.schedule_prewarm(short_code, success_url, cancel_url)
+
+    return render(
+        request,
+        "payapp/public_pay.html",
+        {"payment": payment_request, "idempotency_key": idempotency.new_key()},
+    )
 
 
 @login_required
 def payment_qr(request, short_code):
+    """
+    QR image for a payment link. ?format=png|svg, ?size=<box size in px>.
+    Rendered images are cached by content (see payapp.qr) and served with
+    an ETag so browsers revalidate with a cheap 304.
+    """
+    fmt = request.GET.get("format", "png")
+    if fmt not in qr.FORMATS:
+        return HttpResponseBadRequest("Unsupported format")
+
+    try:
+        box_size = int(request.GET.get("size", qr.DEFAULT_BOX_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid size")
+    box_size = max(qr.MIN_BOX_SIZE, min(box_size, qr.MAX_BOX_SIZE))
+
     payment = get_object_or_404(
         PaymentRequest,
         short_code=short_code,
@@ -222,19 +482,25 @@ def payment_qr(request, short_code):
         reverse("payapp:public_pay", args=[payment.short_code])
     )
 
-    qr = qrcode.make(pay_url)
-    buffer = BytesIO()
-    qr.save(buffer, format="PNG")
-    buffer.seek(0)
+    etag = quote_etag(qr.cache_key(pay_url, fmt, box_size))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        _, content = qr.get_qr(pay_url, fmt, box_size)
+        response = HttpResponse(content, content_type=qr.FORMATS[fmt])
 
-    return HttpResponse(buffer.getvalue(), content_type="image/png")
+    response["ETag"] = etag
+    patch_cache_control(response, private=True, max_age=qr.max_age())
+    return response
 
 
 @csrf_exempt
 def stripe_webhook(request):
     """
     Handle Stripe webhook events.
-    We care about: checkout.session.completed
+
+    The verified event is stored in the WebhookEvent inbox and processed
+    by a Celery worker (payapp.webhooks), so Stripe gets its 200 without
+    waiting on our database writes or receipt email.
     """
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
@@ -244,7 +510,7 @@ def stripe_webhook(request):
         return HttpResponse(status=200)
 
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload=payload,
             sig_header=sig_header,
             secret=webhook_secret,
@@ -254,51 +520,31 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponseBadRequest("Invalid signature")
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-
-        short_code = session.get("metadata", {}).get("short_code")
-        amount_total = session.get("amount_total")
-        currency = session.get("currency", "gbp").upper()
-        provider_txn_id = session.get("payment_intent") or session.get("id")
-
-        if not short_code:
-            return HttpResponse(status=200)
-
-        try:
-            payment_request = PaymentRequest.objects.get(short_code=short_code)
-        except PaymentRequest.DoesNotExist:
-            return HttpResponse(status=200)
-
-        payment_request.status = PaymentRequest.STATUS_PAID
-        payment_request.save(update_fields=["status"])
-
-        txn = Transaction.objects.create(
-            payment_request=payment_request,
-            status=Transaction.STATUS_SUCCESS,
-            amount=(amount_total or 0) / 100 if amount_total else payment_request.amount,
-            currency=currency,
-            provider_txn_id=provider_txn_id or "",
-            raw_response=event,
-        )
+    webhooks.receive(json.loads(payload))
+    return HttpResponse(status=200)
 
-        to_email = payment_request.merchant.email or None
-        if to_email:
-            subject = "VyoPay payment received"
-            html_content = render_to_string(
-                "emails/payment_receipt.html",
-                {"payment": payment_request, "transaction": txn},
-            )
-            msg = EmailMultiAlternatives(
-                subject=subject,
-                body="Payment received via VyoPay.",
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[to_email],
-            )
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
 
-    return HttpResponse(status=200)
+def metrics_view(request):
+    """Prometheus scrape endpoint (see payapp.metrics)."""
+    token = metrics.conf()["TOKEN"]
+    if not token:
+        # Per-route latency and traffic are not for the public.
+        if not settings.DEBUG:
+            raise Http404
+    elif not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return HttpResponse(status=401)
+
+    inbox = webhooks.inbox_stats()
+    buffer = analytics.get_buffer()
+    gauges = [
+        ("payapp_webhook_inbox_pending", "Webhook events waiting to be processed.", inbox["pending"]),
+        ("payapp_webhook_inbox_retrying", "Pending webhook events that already failed once.", inbox["retrying"]),
+        ("payapp_webhook_inbox_dead", "Webhook events that ran out of attempts.", inbox["dead"]),
+        ("payapp_webhook_inbox_lag_seconds", "Age of the oldest pending webhook event.", inbox["lag_seconds"]),
+        ("payapp_analytics_buffer_events", "Analytics events queued in this process.", len(buffer)),
+        ("payapp_analytics_buffer_dropped", "Analytics events dropped by this process.", buffer.dropped),
+    ]
+    return HttpResponse(metrics.render(gauges), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @login_required
@@ -311,8 +557,19 @@ def payment_receipt(request, transaction_id):
     return render(request, "payapp/payment_receipt.html", {"transaction": txn})
 
 
+@require_http_methods(["GET", "HEAD"])
+def payment_status(request, short_code):
+    """JSON status of a payment link for polling (see payapp.link_status)."""
+    return link_status.get_response(request, short_code)
+
+
 def payment_success(request):
-    return render(request, "payapp/payment_success.html")
+    # Stripe appends ?session_id=; the page polls the link's status until the webhook lands.
+    payment = None
+    short_code = checkout.short_code_for_session(request.GET.get("session_id"))
+    if short_code:
+        payment = link_cache.get_snapshot(short_code)
+    return render(request, "payapp/payment_success.html", {"payment": payment})
 
 
 def payment_failed(request):
@@ -0,0 +1,221 @@
+"""
+Stripe webhook inbox processing.
+
+`receive()` is all the HTTP view does: it stores the verified event in
+the WebhookEvent inbox (deduplicated on the Stripe event id) and queues a
+Celery task once the row is committed. `process_pending()` then drains
+the inbox for one ordering key (the payment link, or else the Stripe
+object), oldest event first. A failing event is retried with exponential
+backoff and later events for the same key wait behind it; after
+WEBHOOK_INBOX["MAX_ATTEMPTS"] it is parked as DEAD.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import live, receipts, rollups
+from .models import PaymentRequest, Transaction, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MAX_ATTEMPTS": 8,
+    "RETRY_BACKOFF": 30,
+}
+
+
+def _conf():
+    return {**DEFAULTS, **getattr(settings, "WEBHOOK_INBOX", {})}
+
+
+def _ordering_key(event):
+    # Events for one payment link queue behind each other. Events without a
+    # link are only ordered per Stripe object, so a failing one holds up
+    # nothing else.
+    obj = event.get("data", {}).get("object", {})
+    short_code = (obj.get("metadata") or {}).get("short_code")
+    if short_code:
+        return short_code[:64]
+    return f"stripe:{obj.get('id') or event['id']}"[:64]
+
+
+# ─────────────────────────────────────
+# Inbox
+# ─────────────────────────────────────
+def receive(event):
+    """
+    Store a verified Stripe event. Returns the inbox row, or None if the
+    event was already received (Stripe redelivery).
+    """
+    try:
+        with transaction.atomic():
+            inbox_event = WebhookEvent.objects.create(
+                event_id=event["id"],
+                type=event["type"],
+                ordering_key=_ordering_key(event),
+                payload=event,
+            )
+    except IntegrityError:
+        return None
+
+    transaction.on_commit(lambda: _enqueue(inbox_event.ordering_key))
+    return inbox_event
+
+
+def _enqueue(ordering_key):
+    from .tasks import process_webhook_events
+    try:
+        process_webhook_events.delay(ordering_key)
+    except Exception:
+        # The event is safe in the inbox; the retry sweep will pick it up.
+        logger.exception("Could not enqueue webhook processing for %r", ordering_key)
+
+
+def process_pending(ordering_key):
+    """Process due events for one ordering key in arrival order. Returns the number handled."""
+    handled = 0
+    while True:
+        with transaction.atomic():
+            inbox_event = (
+                WebhookEvent.objects
+                .select_for_update()
+                .filter(ordering_key=ordering_key, status=WebhookEvent.STATUS_PENDING)
+                .order_by("received_at", "pk")
+                .first()
+            )
+            # Later events for this key wait until the oldest one succeeds or dies.
+            if inbox_event is None or inbox_event.next_attempt_at > timezone.now():
+                return handled
+
+            try:
+                with transaction.atomic():
+                    handle_event(inbox_event.payload)
+            except Exception as exc:
+                logger.exception("Webhook event %s failed", inbox_event.event_id)
+                _record_failure(inbox_event, exc)
+                return handled
+
+            inbox_event.status = WebhookEvent.STATUS_DONE
+            inbox_event.attempts += 1
+            inbox_event.processed_at = timezone.now()
+            inbox_event.last_error = ""
+            inbox_event.save(update_fields=["status", "attempts", "processed_at", "last_error"])
+            handled += 1
+
+        logger.info(
+            "Processed webhook event %s after %.3fs in the inbox",
+            inbox_event.event_id,
+            (inbox_event.processed_at - inbox_event.received_at).total_seconds(),
+        )
+
+
+def _record_failure(inbox_event, exc):
+    conf = _conf()
+    inbox_event.attempts += 1
+    inbox_event.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+    if inbox_event.attempts >= conf["MAX_ATTEMPTS"]:
+        inbox_event.status = WebhookEvent.STATUS_DEAD
+    else:
+        delay = conf["RETRY_BACKOFF"] * 2 ** (inbox_event.attempts - 1)
+        inbox_event.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    inbox_event.save(update_fields=["status", "attempts", "last_error", "next_attempt_at"])
+
+
+def due_ordering_keys():
+    return list(
+        WebhookEvent.objects
+        .filter(status=WebhookEvent.STATUS_PENDING, next_attempt_at__lte=timezone.now())
+        .values_list("ordering_key", flat=True)
+        .distinct()
+    )
+
+
+def requeue_dead(event_ids=None):
+    events = WebhookEvent.objects.filter(status=WebhookEvent.STATUS_DEAD)
+    if event_ids:
+        events = events.filter(event_id__in=event_ids)
+    return events.update(
+        status=WebhookEvent.STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=timezone.now(),
+    )
+
+
+def inbox_stats():
+    """Queue depth and lag figures for monitoring."""
+    now = timezone.now()
+    pending = WebhookEvent.objects.filter(status=WebhookEvent.STATUS_PENDING)
+    oldest = pending.aggregate(oldest=Min("received_at"))["oldest"]
+    return {
+        "pending": pending.count(),
+        "retrying": pending.filter(attempts__gt=0).count(),
+        "dead": WebhookEvent.objects.filter(status=WebhookEvent.STATUS_DEAD).count(),
+        "lag_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+# ─────────────────────────────────────
+# Event handlers
+# ─────────────────────────────────────
+def handle_event(event):
+    handler = HANDLERS.get(event["type"])
+    if handler is not None:
+        handler(event)
+
+
+def handle_checkout_completed(event):
+    session = event["data"]["object"]
+
+    short_code = (session.get("metadata") or {}).get("short_code")
+    amount_total = session.get("amount_total")
+    currency = (session.get("currency") or "gbp").upper()
+    provider_txn_id = session.get("payment_intent") or session.get("id")
+
+    if not short_code:
+        return
+
+    try:
+        payment_request = (
+            PaymentRequest.objects
+            .select_related("merchant")
+            .get(short_code=short_code)
+        )
+    except PaymentRequest.DoesNotExist:
+        return
+
+    payment_request.status = PaymentRequest.STATUS_PAID
+    payment_request.status_changed_at = timezone.now()
+    payment_request.save(update_fields=["status", "status_changed_at"])
+
+    txn = Transaction.objects.create(
+        payment_request=payment_request,
+        merchant_id=payment_request.merchant_id,
+        status=Transaction.STATUS_SUCCESS,
+        amount=Decimal(amount_total) / 100 if amount_total else payment_request.amount,
+        currency=currency,
+        provider_txn_id=provider_txn_id or "",
+        raw_response=event,
+    )
+    rollups.record_payment(payment_request, txn.amount, txn.created_at)
+    live.publish(payment_request.merchant_id, "payment", {
+        "short_code": short_code,
+        "description": payment_request.description,
+        "amount": txn.amount,
+        "currency": txn.currency,
+        "created_at": txn.created_at,
+        "day": timezone.localdate(txn.created_at),
+    })
+
+    # Only an outbox row here: workers send it (see payapp.receipts), so
+    # mail I/O never slows down or rolls back payment handling.
+    receipts.queue(payment_request, txn)
+
+
+HANDLERS = {
+    "checkout.session.completed": handle_checkout_completed,
+}
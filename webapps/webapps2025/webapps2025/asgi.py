@@ -11,6 +11,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webapps2025.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webapps.webapps2025.webapps2025.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Dashboard event streams stay open for minutes; see payapp/live.py.
+from payapp.live import route_streams  # noqa: E402 (needs settings)
+
+application = route_streams(django_application)